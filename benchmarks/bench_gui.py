@@ -0,0 +1,363 @@
+"""
+Benchmarks of the hot paths of the polyply GUI, run without a display
+against the recording canvas in :mod:`fake_gui`.
+
+Every case is timed on a graph of each size; the results hold the best
+wall time of the repeats, the peak traced memory of an extra run and
+the number of canvas calls. Results are saved as json so two revisions
+can be compared:
+
+    python benchmarks/bench_gui.py -o before.json
+    python benchmarks/bench_gui.py -o after.json
+    python benchmarks/bench_gui.py -compare before.json after.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+
+# benchmark the checkout the script lives in, not an installed version
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCH_DIR, os.path.dirname(BENCH_DIR)]
+from fake_gui import FakeWindow, FakeElement, make_event_handler
+
+MONOMER = "PEO"
+FORCE_FIELD = "2016H66"
+
+def _grid_coords(nodes):
+    """
+    Residues in order along the rows of a square grid, alternating
+    direction, so that consecutive residues are next to each other.
+    """
+    side = int(np.ceil(np.sqrt(len(nodes))))
+    rows, cols = np.divmod(np.arange(len(nodes)), side)
+    cols = np.where(rows % 2 == 1, side - 1 - cols, cols)
+    positions = np.column_stack([cols, rows]) * 1.5 / max(side - 1, 1) - 0.75
+    return dict(zip(nodes.tolist(), positions))
+
+def _handler_with_blocks(sizes):
+    """
+    Event handler holding linear blocks of `sizes` residues, drawn
+    on a grid; the layout is benchmarked by the cases that add
+    residues, so setting up the others stays cheap.
+    """
+    handler, main_window, canvas = make_event_handler()
+    for n_mon in sizes:
+        handler.builder.add_block(MONOMER, n_mon)
+    handler.coords = _grid_coords(handler.graph.node_array())
+    handler._draw()
+    return handler, main_window, canvas
+
+def _block_window():
+    window = FakeWindow()
+    window['-MONOMERS-'] = FakeElement(MONOMER)
+    window['tacticity'] = FakeElement(['atactic'])
+    return window
+
+def _write_itp(path, n_res):
+    with open(path, "w") as file_handle:
+        file_handle.write("[ moleculetype ]\nBENCH 1\n\n[ atoms ]\n")
+        for idx in range(1, n_res + 1):
+            file_handle.write("{0} C1 {0} {1} C1 {0} 0.0 72.0\n".format(idx, MONOMER))
+        file_handle.write("\n[ bonds ]\n")
+        for idx in range(1, n_res):
+            file_handle.write("{} {} 1 0.47 1250\n".format(idx, idx + 1))
+
+def _path_graph(size):
+    import networkx as nx
+    graph = nx.path_graph(size)
+    nx.set_node_attributes(graph, MONOMER, "resname")
+    return graph
+
+def bench_add_block(size):
+    handler, main_window, canvas = make_event_handler()
+    window = _block_window()
+    values = {'-NMON-': str(size), '-BRANCH-': '1', '-PROB-': '0.5', '-SEED-': '1'}
+    return lambda: handler.add_block(window, 'add_block', values), canvas
+
+def bench_append_block(size):
+    handler, main_window, canvas = _handler_with_blocks([size])
+    window = _block_window()
+    values = {'-NMON-': '10', '-BRANCH-': '1', '-PROB-': '0.5', '-SEED-': '1'}
+    return lambda: handler.add_block(window, 'add_block', values), canvas
+
+def bench_conncet_blocks(size):
+    handler, main_window, canvas = _handler_with_blocks([size // 2, size - size // 2])
+    values = {"idA": "1", "residA": str(size // 2), "idB": "2", "residB": "1"}
+    return lambda: handler.conncet_blocks(main_window, 'conncet_blocks', values), canvas
+
+def bench_batch_link(size):
+    # a comb: a side chain of 10 residues on every 10th backbone residue
+    n_side = size // 20
+    handler, main_window, canvas = _handler_with_blocks([size - 10 * n_side] + [10] * n_side)
+    values = {'-BLOCKA-': '1', '-STEP-': '10', '-BLOCKSB-': '2-{}'.format(n_side + 1)}
+    return lambda: handler.batch_link(main_window, 'batch_link', values), canvas
+
+def bench_remove_block(size):
+    handler, main_window, canvas = _handler_with_blocks([size - 10, 10])
+    main_window["-SEQ-"] = FakeElement(["2 {} 10".format(MONOMER)])
+    return lambda: handler.remove_block(main_window, 'remove_block', {}), canvas
+
+def bench_zoom(size):
+    handler, main_window, canvas = _handler_with_blocks([size])
+    def _zoom():
+        for _ in range(3):
+            handler.zoom_in(main_window, 'zoom_in', {})
+        for _ in range(3):
+            handler.zoom_out(main_window, 'zoom_out', {})
+    return _zoom, canvas
+
+def bench_pan(size):
+    handler, main_window, canvas = _handler_with_blocks([size])
+    def _pan():
+        for step in range(20):
+            handler.graph_event(main_window, 'graph_event', {'graph_event': (400 + 10 * step, 400)})
+        handler.end_drag(main_window, 'graph_event+UP', {'graph_event': (600, 400)})
+    return _pan, canvas
+
+def bench_pick(size):
+    handler, main_window, canvas = _handler_with_blocks([size])
+    # show every residue, so that all of them can be picked
+    handler.scene.lod_radius = 0
+    handler.scene.redraw()
+    nodes = np.random.default_rng(1).choice(handler.graph.node_array(), 100)
+    locations = [handler.scene._location(handler.coords[node]) for node in nodes]
+    def _pick():
+        for location in locations:
+            handler.graph_event(main_window, 'graph_event', {'graph_event': location})
+            handler.end_drag(main_window, 'graph_event+UP', {'graph_event': location})
+    return _pick, canvas
+
+def bench_load_file(size, tmpdir, cached=False):
+    from polyply_gui import loaders
+    path = os.path.join(tmpdir, "bench_{}.itp".format(size))
+    if not os.path.exists(path):
+        _write_itp(path, size)
+    handler, main_window, canvas = make_event_handler()
+    values = {'load_file': path}
+    if cached:
+        loaders.load_residue_graph(path)
+    else:
+        loaders._CACHE = loaders.ResidueGraphCache()
+    return lambda: handler.load_file(main_window, 'load_file', values), canvas
+
+def bench_write_seq_file(size, tmpdir, compact=False):
+    handler, main_window, canvas = _handler_with_blocks([size])
+    path = os.path.join(tmpdir, "bench.json")
+    values = {'write_seq_file': path, '-COMPACT-': compact}
+    return lambda: handler.write_seq_file(main_window, 'write_seq_file', values), canvas
+
+def bench_load_seq_file(size, tmpdir, layout=True):
+    # reopen a saved graph, with or without the layout saved next to it
+    path = os.path.join(tmpdir, "bench_{}.json".format(size))
+    if not os.path.exists(path):
+        handler, main_window, canvas = _handler_with_blocks([size])
+        handler.builder.write_seq_file(path, compact=True)
+    layout_file = path + ".layout.npz"
+    if not layout and os.path.exists(layout_file):
+        os.rename(layout_file, layout_file + ".off")
+    elif layout and os.path.exists(layout_file + ".off"):
+        os.rename(layout_file + ".off", layout_file)
+    handler, main_window, canvas = make_event_handler()
+    values = {'load_file': path}
+    return lambda: handler.load_file(main_window, 'load_file', values), canvas
+
+def bench_gen_itp(size, tmpdir, edit=False):
+    # the force field is loaded while setting up, as the GUI does
+    # when it is selected; the fragment cache starts empty, or, for
+    # `edit`, holds the molecule before its last block was replaced
+    from polyply_gui import polyply_runner
+    from polyply_gui.builder import GraphBuilder
+    from polyply_gui.fragments import FragmentCache
+    from fake_gui import FakeCanvas
+    polyply_runner._FRAGMENTS = FragmentCache(cache_dir=tempfile.mkdtemp(dir=tmpdir))
+    polyply_runner._force_field(FORCE_FIELD)
+    builder = GraphBuilder(force_field=FORCE_FIELD)
+    path = os.path.join(tmpdir, "bench_{}.itp".format(size))
+    if not edit:
+        builder.add_block(MONOMER, size)
+        return lambda: builder.gen_itp(path), FakeCanvas()
+
+    n_blocks = min(size, 10)
+    for block_idx in range(n_blocks):
+        builder.add_block(MONOMER if block_idx % 2 else "PS", size // n_blocks)
+        if block_idx:
+            builder.link(block_idx, size // n_blocks, block_idx + 1, 1)
+    builder.gen_itp(path)
+    builder.remove_block(n_blocks)
+    builder.add_block(MONOMER, size // n_blocks)
+    if n_blocks > 1:
+        builder.link(n_blocks - 1, size // n_blocks, n_blocks, 1)
+    return lambda: builder.gen_itp(path), FakeCanvas()
+
+def bench_draw_graph(size, initial_layout=None):
+    from polyply_gui.graph_drawing import draw_graph, GraphScene
+    from polyply_gui.molecule_graph import MoleculeGraph
+    from fake_gui import FakeCanvas
+    graph = MoleculeGraph()
+    graph.add_block_from_graph(_path_graph(size), name=MONOMER)
+    canvas = FakeCanvas()
+    def _draw():
+        scene = GraphScene(canvas, (400, 400))
+        draw_graph(canvas, graph, (400, 400), layout="incremental",
+                   scene=scene, blocks=graph.block_ranges(), initial_layout=initial_layout)
+    return _draw, canvas
+
+def benchmarks(tmpdir):
+    """
+    Name and setup function of every case. The setup gets the graph
+    size and returns the function to time and the fake canvas.
+    """
+    return {"add_block": bench_add_block,
+            "append_block": bench_append_block,
+            "conncet_blocks": bench_conncet_blocks,
+            "batch_link": bench_batch_link,
+            "remove_block": bench_remove_block,
+            "zoom": bench_zoom,
+            "pan": bench_pan,
+            "pick": bench_pick,
+            "draw_graph": bench_draw_graph,
+            "draw_graph_multilevel": lambda size: bench_draw_graph(size, "multilevel"),
+            "load_file": lambda size: bench_load_file(size, tmpdir),
+            "load_file_cached": lambda size: bench_load_file(size, tmpdir, cached=True),
+            "load_seq_file": lambda size: bench_load_seq_file(size, tmpdir, layout=False),
+            "load_seq_file_layout": lambda size: bench_load_seq_file(size, tmpdir),
+            "write_seq_file": lambda size: bench_write_seq_file(size, tmpdir),
+            "write_seq_file_compact": lambda size: bench_write_seq_file(size, tmpdir, compact=True),
+            "gen_itp": lambda size: bench_gen_itp(size, tmpdir),
+            "gen_itp_edit": lambda size: bench_gen_itp(size, tmpdir, edit=True),}
+
+def run_case(setup, size, repeat):
+    """
+    Time a case and measure its peak memory and canvas calls. Every
+    run gets a fresh setup, so cases that change the graph can be
+    repeated.
+
+    Returns
+    -------
+    dict
+    """
+    times = []
+    for _ in range(repeat):
+        function, canvas = setup(size)
+        canvas.calls.clear()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        draw_calls = dict(canvas.calls)
+
+    function, canvas = setup(size)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"time": min(times),
+            "peak_memory": peak_memory,
+            "draw_calls": sum(draw_calls.values()),
+            "calls": draw_calls}
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=BENCH_DIR).stdout.strip()
+    except OSError:
+        return None
+
+def run(sizes, cases=None, repeat=3, time_limit=60.):
+    """
+    Run the `cases` (default all) for every size. Larger sizes of a
+    case are skipped once a run is expected to take longer than
+    `time_limit` seconds. The time is extrapolated with the growth
+    exponent of the last two sizes, bounded to linear and quadratic.
+    """
+    # the GUI imports polyply and vermouth on first use, which
+    # should not be counted against the first case
+    import polyply.src.gen_seq
+    import vermouth.gmx.itp_read
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, setup in benchmarks(tmpdir).items():
+            if cases and name not in cases:
+                continue
+            done = []
+            for size in sorted(sizes):
+                if done:
+                    last = done[-1]
+                    exponent = 1
+                    if len(done) > 1 and done[-2]["time"] > 0:
+                        exponent = np.log(last["time"] / done[-2]["time"]) / np.log(last["size"] / done[-2]["size"])
+                        exponent = np.clip(exponent, 1, 2)
+                    if last["time"] * (size / last["size"])**exponent > time_limit:
+                        print("{:<24s} {:>8d} skipped".format(name, size), flush=True)
+                        continue
+                result = run_case(setup, size, repeat)
+                result.update(case=name, size=size)
+                results.append(result)
+                print("{:<24s} {:>8d} {:>10.4f} s {:>10.2f} MB {:>8d} calls".format(
+                      name, size, result["time"], result["peak_memory"] / 1e6, result["draw_calls"]),
+                      flush=True)
+                done.append(result)
+    return {"revision": _revision(),
+            "python": platform.python_version(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results}
+
+def compare(path_a, path_b):
+    """
+    Print the ratios of time and memory and the difference in canvas
+    calls of every case and size in both result files.
+    """
+    with open(path_a) as file_handle:
+        results_a = json.load(file_handle)
+    with open(path_b) as file_handle:
+        results_b = json.load(file_handle)
+    old = {(result["case"], result["size"]): result for result in results_a["results"]}
+    print("{} ({}) -> {} ({})".format(path_a, results_a["revision"], path_b, results_b["revision"]))
+    print("{:<24s} {:>8s} {:>10s} {:>10s} {:>12s}".format("case", "size", "time", "memory", "calls"))
+    for result in results_b["results"]:
+        key = (result["case"], result["size"])
+        if key not in old:
+            continue
+        print("{:<24s} {:>8d} {:>9.2f}x {:>9.2f}x {:>+12d}".format(
+              key[0], key[1],
+              result["time"] / max(old[key]["time"], 1e-9),
+              result["peak_memory"] / max(old[key]["peak_memory"], 1),
+              result["draw_calls"] - old[key]["draw_calls"]))
+
+def __main__():
+    parser = argparse.ArgumentParser(description="Benchmark the polyply GUI without a display")
+    parser.add_argument('-sizes', dest='sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000],
+                        help='number of residues of the benchmarked graphs')
+    parser.add_argument('-cases', dest='cases', type=str, nargs='+', default=None,
+                        help='cases to run; default all')
+    parser.add_argument('-repeat', dest='repeat', type=int, default=3,
+                        help='timed runs per case, of which the best is kept')
+    parser.add_argument('-time_limit', dest='time_limit', type=float, default=60.,
+                        help='skip sizes of a case expected to take longer (s)')
+    parser.add_argument('-o', dest='outpath', type=str, default=None,
+                        help='json file to save the results to')
+    parser.add_argument('-compare', dest='compare', type=str, nargs=2, default=None,
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args.sizes, args.cases, args.repeat, args.time_limit)
+    if args.outpath:
+        with open(args.outpath, "w") as file_handle:
+            json.dump(results, file_handle, indent=2)
+
+if __name__ == '__main__':
+    __main__()
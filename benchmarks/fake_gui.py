@@ -0,0 +1,107 @@
+"""
+Headless stand-ins for the PySimpleGUI elements the event handler
+talks to. The canvas keeps no pixels, only the figures alive and a
+count of the calls made to it.
+"""
+import itertools
+from collections import Counter
+
+class FakeTkCanvas():
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def scale(self, *args):
+        self.calls["scale"] += 1
+
+class FakeCanvas():
+    """
+    Records the drawing calls of :class:`PySimpleGUI.Graph`.
+    """
+
+    def __init__(self, canvas_size=(800, 800)):
+        self.canvas_size = canvas_size
+        self.calls = Counter()
+        self.figures = set()
+        self._ids = itertools.count(1)
+        self.TKCanvas = FakeTkCanvas(self.calls)
+
+    @property
+    def draw_calls(self):
+        return sum(self.calls.values())
+
+    def _add_figure(self, kind):
+        self.calls[kind] += 1
+        figure = next(self._ids)
+        self.figures.add(figure)
+        return figure
+
+    def _convert_xy_to_canvas_xy(self, x_in, y_in):
+        return x_in, self.canvas_size[1] - y_in
+
+    def draw_circle(self, center_location, radius, fill_color=None, line_color='black', line_width=1):
+        return self._add_figure("draw_circle")
+
+    def draw_line(self, point_from, point_to, color='black', width=1):
+        return self._add_figure("draw_line")
+
+    def draw_lines(self, points, color='black', width=1):
+        return self._add_figure("draw_lines")
+
+    def delete_figure(self, figure):
+        self.calls["delete_figure"] += 1
+        self.figures.remove(figure)
+
+    def move_figure(self, figure, x_direction, y_direction):
+        self.calls["move_figure"] += 1
+
+    def move(self, x_direction, y_direction):
+        self.calls["move"] += 1
+
+    def send_figure_to_back(self, figure):
+        self.calls["send_figure_to_back"] += 1
+
+    def erase(self):
+        self.calls["erase"] += 1
+        self.figures.clear()
+
+class FakeElement():
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def update(self, value=None, values=None, **kwargs):
+        if values is not None:
+            self.value = values
+        elif value is not None:
+            self.value = value
+
+class FakeWindow(dict):
+    """
+    Window whose elements spring into existence when first used.
+    """
+
+    def __missing__(self, key):
+        element = FakeElement([])
+        self[key] = element
+        return element
+
+def make_event_handler(canvas_size=(800, 800)):
+    """
+    Event handler wired to fake windows.
+
+    Returns
+    -------
+    :class:`polyply_gui.events.EventHandler`
+    FakeWindow
+        main window
+    FakeCanvas
+    """
+    from polyply_gui.events import EventHandler
+    main_window = FakeWindow()
+    canvas = FakeCanvas(canvas_size)
+    graph_viewer = FakeWindow(graph_event=canvas)
+    return EventHandler(main_window, graph_viewer, canvas_size), main_window, canvas
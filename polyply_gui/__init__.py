@@ -12,22 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pbr.version
+import os
+import importlib.util
 #from .log_helpers import StyleAdapter, get_logger
 
 #__version__ = pbr.version.VersionInfo('polyply_gui').release_string()
 
-# Find the data directory once.
-try:
-    import pkg_resources
-except ImportError:
-    import os
-    IMG_PATH = os.path.join(os.path.dirname(__file__), 'images')
-#    TEST_DATA = os.path.join(os.path.dirname(__file__), 'tests/test_data')
-#    del os
-else:
-    IMG_PATH = pkg_resources.resource_filename('polyply_gui', 'images')
-#    TEST_DATA = pkg_resources.resource_filename('polyply', 'tests/test_data')
-    del pkg_resources
+# Find the data directory once. Neither pkg_resources nor polyply
+# get imported here, as both are slow to import.
+IMG_PATH = os.path.join(os.path.dirname(__file__), 'images')
+#TEST_DATA = os.path.join(os.path.dirname(__file__), 'tests/test_data')
 
-del pbr
+def _find_polyply_data():
+    """
+    Locate the polyply data directory without importing polyply.
+    """
+    spec = importlib.util.find_spec('polyply')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(list(spec.submodule_search_locations)[0], 'data')
+
+POLYPLY_DATA_PATH = _find_polyply_data()
+
+del importlib
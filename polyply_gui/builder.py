@@ -0,0 +1,445 @@
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .molecule_graph import MoleculeGraph
+from .polyply_runner import gen_itp_from_graph
+from .seq_io import write_seq_graph, read_seq_block
+from .loaders import load_residue_graph
+from .tacticity import sample_tacticity
+from .history import History, Edit
+from .linking import rule_pairs, parse_blocks
+from .layout_cache import save_layout, load_layout, place_beside
+
+# rough memory an undo entry keeps alive per residue and per entry
+_RESIDUE_NBYTES = 160
+_EDIT_NBYTES = 256
+# removed residues no edit can restore that are kept in the graph
+# before it is compacted, at least
+_COMPACT_MIN_RESIDUES = 4096
+
+class GraphBuilder():
+    """
+    GUI independent core for building the residue graph of a
+    molecule block by block. The :class:`polyply_gui.events.EventHandler`
+    translates window input into calls of this class and the
+    `polyply_build` command line tool drives it from spec files.
+    Blocks and residues are counted from 1 in all arguments,
+    like they are shown to the user. Random attributes are drawn
+    from a generator seeded with `seed`.
+
+    Every edit is journaled in a :class:`polyply_gui.history.History`
+    capped at `max_history_bytes`, so it can be undone and redone.
+    The journal also covers the layout in `coords`, if the user
+    of the builder keeps one there.
+
+    Removed blocks stay in the graph while an edit can restore them.
+    Once the removed residues no edit can restore outnumber all
+    others, the graph is compacted, which renumbers the residues;
+    `coords` and the history follow and `on_relabel`, if set, is
+    called with the new id of every old residue id.
+
+    With a :class:`polyply_gui.journal.SessionJournal` as `session`
+    every edit is also saved to disk as it happens.
+    """
+
+    def __init__(self, force_field=None, seed=None, max_history_bytes=64 * 2**20):
+        self.graph = MoleculeGraph()
+        self.force_field = force_field
+        self.rng = np.random.default_rng(seed)
+        self.history = History(max_bytes=max_history_bytes)
+        # node to coordinate mapping of the current layout
+        self.coords = None
+        # block id -> name and size shown in the sequence list
+        self.labels = {}
+        self.session = None
+        self.on_relabel = None
+
+    @property
+    def seq_list(self):
+        return [" ".join([str(idx + 1), *self.labels[block_id]])
+                for idx, block_id in enumerate(self.graph.block_ids)]
+
+    def _record(self, op, **args):
+        if self.session is not None:
+            self.session.record(self, op, args)
+
+    def set_force_field(self, force_field):
+        self.force_field = force_field
+        self._record("set_force_field", force_field=force_field)
+
+    def _block_id(self, block_idx):
+        return self.graph.block_ids[block_idx - 1]
+
+    def residue(self, block_idx, resid):
+        """
+        Node of the `resid`-th residue of the `block_idx`-th block.
+        """
+        return self.graph.residue(self._block_id(block_idx), resid - 1)
+
+    def residues(self, block_idx, resids):
+        """
+        Nodes of many residues given by arrays of block and resid,
+        all checked against the block ranges at once.
+        """
+        block_idx = np.asarray(block_idx, dtype=np.int64)
+        resids = np.asarray(resids, dtype=np.int64)
+        blocks = list(self.graph.blocks.values())
+        starts = np.array([block.start for block in blocks] + [0], dtype=np.int64)
+        sizes = np.array([len(block) for block in blocks] + [0], dtype=np.int64)
+        invalid = (block_idx < 1) | (block_idx > len(blocks))
+        # missing blocks look up the empty padding entry
+        rows = np.where(invalid, len(blocks) + 1, block_idx) - 1
+        invalid |= (resids < 1) | (resids > sizes[rows])
+        if invalid.any():
+            first = np.flatnonzero(invalid)[0]
+            raise IndexError("block {} has no residue {}".format(block_idx[first], resids[first]))
+        return starts[rows] + resids - 1
+
+    def _pop_coords(self, nodes):
+        if self.coords is None:
+            return {}
+        return {node: self.coords.pop(node) for node in nodes if node in self.coords}
+
+    def _put_coords(self, coords):
+        if coords and self.coords is not None:
+            self.coords.update(coords)
+
+    def _removal(self, block_id, description):
+        """
+        Journal entry toggling a block between removed and restored;
+        `undo` removes the block and `redo` restores it.
+        """
+        state = {}
+        def _remove():
+            block = state["block"] = self.graph.remove_block(block_id)
+            # by position in the block, which compacting keeps
+            state["coords"] = {node - block.start: coord for node, coord
+                               in self._pop_coords(block.nodes).items()}
+        def _restore():
+            block = state.pop("block")
+            self.graph.restore_block(block)
+            self._put_coords({block.start + idx: coord for idx, coord in state.pop("coords").items()})
+        n_res = len(self.graph.blocks[block_id])
+        return Edit(description, _remove, _restore, _EDIT_NBYTES + _RESIDUE_NBYTES * n_res,
+                    state=state)
+
+    def _push(self, edit):
+        """
+        Add `edit` to the history and compact the graph if the
+        blocks only the dropped entries could restore take too
+        much room.
+        """
+        if not self.history.push(edit):
+            return
+        keep = [entry.state["block"] for entry in self.history.entries() if "block" in entry.state]
+        n_kept = sum(len(block) for block in keep)
+        n_dropped = self.graph.n_removed - n_kept
+        if n_dropped > max(self.graph.n_residues + n_kept, _COMPACT_MIN_RESIDUES):
+            self.compact(keep)
+
+    def compact(self, keep=()):
+        """
+        Drop the removed blocks apart from those in `keep` from the
+        graph and relabel the residues in `coords` and the history.
+        """
+        relabel = self.graph.compact(keep)
+        for entry in self.history.entries():
+            if entry.nodes is not None:
+                entry.nodes[...] = relabel[entry.nodes]
+        if self.coords is not None:
+            self.coords = {int(relabel[node]): coord for node, coord in self.coords.items()
+                           if relabel[node] >= 0}
+        if self.on_relabel is not None:
+            self.on_relabel(relabel)
+
+    def _added(self, block_id, label, description):
+        self.labels[block_id] = label
+        self._push(self._removal(block_id, description))
+        return block_id
+
+    def add_block(self, monomer, n_mon, branching=1, tacticity=None, probability=0.5, seed=None):
+        """
+        Add a tree of `n_mon` generations and branching degree
+        `branching`, i.e. a linear chain of `n_mon` monomers for
+        a branching of 1.
+
+        The tacticity of the new residues is sampled following one
+        of :data:`polyply_gui.tacticity.TACTICITIES`, using
+        `probability` for the bernoulli and markov statistics and a
+        generator seeded with `seed` if given.
+
+        Returns
+        -------
+        int
+            block id
+        """
+        from polyply.src.gen_seq import _branched_graph
+        new_graph = _branched_graph(monomer, int(branching), int(n_mon))
+        block_id = self.graph.add_block_from_graph(new_graph, name=monomer)
+        if tacticity:
+            rng = np.random.default_rng(seed) if seed is not None else self.rng
+            nodes = self.graph.block_nodes(block_id)
+            self.graph.set_attribute("tacticity", nodes,
+                                     sample_tacticity(len(nodes), tacticity, rng, probability))
+        self._added(block_id, (monomer, str(n_mon)), "add " + monomer)
+        self._record("add_block", monomer=monomer, n_mon=n_mon, branching=branching,
+                     tacticity=tacticity, probability=probability, seed=seed)
+        return block_id
+
+    def locate(self, node):
+        """
+        Block and resid of a node, both counting from 1.
+        """
+        block_id = self.graph.block_of([node])[0]
+        block_idx = self.graph.block_ids.index(block_id) + 1
+        return block_idx, node - self.graph.blocks[block_id].start + 1
+
+    def link_nodes(self, nodeA, nodeB):
+        """
+        Link two residues given by their nodes. Returns False and
+        records no edit if they are linked already.
+        """
+        if not self.graph.add_edge(nodeA, nodeB):
+            return False
+        nodes = np.array([nodeA, nodeB], dtype=np.int64)
+        self._push(Edit("link", lambda: self.graph.remove_edge(*nodes.tolist()),
+                        lambda: self.graph.add_edge(*nodes.tolist()), _EDIT_NBYTES, nodes=nodes))
+        if self.session is not None:
+            blockA, residA = self.locate(nodeA)
+            blockB, residB = self.locate(nodeB)
+            self._record("link", blockA=blockA, residA=residA, blockB=blockB, residB=residB)
+        return True
+
+    def link(self, blockA, residA, blockB, residB):
+        """
+        Link two residues and return their nodes.
+        """
+        nodeA = self.residue(blockA, residA)
+        nodeB = self.residue(blockB, residB)
+        self.link_nodes(nodeA, nodeB)
+        return nodeA, nodeB
+
+    def link_pairs(self, pairs):
+        """
+        Link many residues as a single edit, which is undone as a
+        whole. All pairs are checked before anything is linked;
+        pairs that are linked already are skipped.
+
+        Parameters
+        ----------
+        pairs: array like
+            (K, 4) block and resid of both residues per row,
+            see :mod:`polyply_gui.linking`
+
+        Returns
+        -------
+        np.ndarray
+            (K, 2) the nodes of every pair
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 4)
+        nodes = np.column_stack([self.residues(pairs[:, 0], pairs[:, 1]),
+                                 self.residues(pairs[:, 2], pairs[:, 3])])
+        edges = self.graph.add_edges(nodes)
+        if not len(edges):
+            return nodes
+        def _unlink():
+            for ndxA, ndxB in edges.tolist():
+                self.graph.remove_edge(ndxA, ndxB)
+        self._push(Edit("link {} pairs".format(len(edges)), _unlink,
+                        lambda: self.graph.add_edges(edges),
+                        _EDIT_NBYTES + edges.nbytes, nodes=edges))
+        self._record("link_pairs", pairs=pairs.tolist())
+        return nodes
+
+    def unlink(self, blockA, residA, blockB, residB):
+        nodeA = self.residue(blockA, residA)
+        nodeB = self.residue(blockB, residB)
+        self.graph.remove_edge(nodeA, nodeB)
+        nodes = np.array([nodeA, nodeB], dtype=np.int64)
+        self._push(Edit("unlink", lambda: self.graph.add_edge(*nodes.tolist()),
+                        lambda: self.graph.remove_edge(*nodes.tolist()), _EDIT_NBYTES, nodes=nodes))
+        self._record("unlink", blockA=blockA, residA=residA, blockB=blockB, residB=residB)
+        return nodeA, nodeB
+
+    def remove_block(self, block_idx):
+        """
+        Remove the `block_idx`-th block; the others move up.
+        """
+        block_id = self._block_id(block_idx)
+        # the entry of an added block, inverted
+        edit = self._removal(block_id, "remove " + self.labels[block_id][0])
+        edit.undo()
+        edit.undo, edit.redo = edit.redo, edit.undo
+        self._push(edit)
+        self._record("remove_block", block_idx=block_idx)
+
+    def undo(self):
+        """
+        Revert the latest edit and return its description,
+        or None if there is nothing to undo.
+        """
+        if not self.history.can_undo():
+            return None
+        description = self.history.undo().description
+        self._record("undo")
+        return description
+
+    def redo(self):
+        """
+        Repeat the latest undone edit and return its description,
+        or None if there is nothing to redo.
+        """
+        if not self.history.can_redo():
+            return None
+        description = self.history.redo().description
+        self._record("redo")
+        return description
+
+    def _load_seq_file(self, path):
+        resnames, edges, attributes = read_seq_block(path, attributes=list(self.graph.columns))
+        name = path.name.split(".")[0]
+        positions = load_layout(path, resnames, edges)
+        block_id = self.graph.add_block(resnames, edges, name=name, attributes=attributes)
+        if positions is not None:
+            self._place_saved(block_id, positions)
+        return self._added(block_id, (name, str(len(resnames))), "load " + name)
+
+    def _place_saved(self, block_id, positions):
+        """
+        Put the residues of a loaded block at their saved positions,
+        next to the layout of the other blocks.
+        """
+        known = ~np.isnan(positions).any(axis=1)
+        if not known.any():
+            return
+        coords, positions = place_beside(self.coords or {}, positions)
+        nodes = np.asarray(self.graph.block_nodes(block_id))
+        coords.update(zip(nodes[known].tolist(), positions[known]))
+        self.coords = coords
+
+    def load_file(self, path, molecule=None):
+        """
+        Add the residue graph of a molecule in a topology or
+        coordinate file, by default the first one, or of a saved
+        graph as block. See :mod:`polyply_gui.loaders`.
+        """
+        path = Path(path)
+        if path.name.endswith((".json", ".json.gz")):
+            block_id = self._load_seq_file(path)
+        else:
+            mol_name, new_graph = load_residue_graph(path, molecule)
+            block_id = self.graph.add_block_from_graph(new_graph, name=mol_name)
+            self._added(block_id, (mol_name, str(len(new_graph.nodes))), "load " + mol_name)
+        self._record("load_file", path=str(path), molecule=molecule)
+        return block_id
+
+    def write_seq_file(self, path, compact=False):
+        """
+        Write the graph as node-link json; see
+        :func:`polyply_gui.seq_io.write_seq_graph`. The layout in
+        `coords`, if any, is saved next to it, see
+        :mod:`polyply_gui.layout_cache`.
+        """
+        write_seq_graph(self.graph, path, compact=compact)
+        if self.coords:
+            nodes = self.graph.node_array()
+            positions = np.array([self.coords.get(node, (np.nan, np.nan)) for node in nodes.tolist()],
+                                 dtype=float).reshape(-1, 2)
+            save_layout(path, self.graph.columns["resname"].decode(nodes),
+                        self.graph.compact_edges(), positions)
+
+    def gen_itp(self, outpath, stream=None):
+        """
+        Write the itp of the graph as it is, without saving it first;
+        see :func:`polyply_gui.polyply_runner.gen_itp_from_graph`.
+        """
+        return gen_itp_from_graph(self.graph, outpath, self.force_field, stream=stream)
+
+def build_from_spec(spec, outdir="."):
+    """
+    Build a molecule from a declarative spec and write its
+    sequence graph and, if a force field is given, its itp.
+
+    A spec is a dict like::
+
+        {"name": "PS-b-PEO",
+         "force_field": "2016H66",
+         "seed": 42,
+         "blocks": [{"monomer": "PS", "n_mon": 10, "tacticity": "atactic"},
+                    {"monomer": "PS", "n_mon": 10, "tacticity": "markov",
+                     "probability": 0.2},
+                    {"monomer": "PEO", "n_mon": 5, "repeat": 3},
+                    {"monomer": "PEO", "n_mon": 3, "branching": 2},
+                    {"file": "ligand.itp", "molecule": "LIG"}],
+         "links": [[1, 10, 2, 1],
+                   {"block": 1, "to": "4-6", "step": 2, "resname": "PS"}]}
+
+    Blocks are added in order; `repeat` adds copies of a block, each
+    linked from its last to the next copy's first residue. Links give
+    block and resid of both residues counting from 1, with the blocks
+    numbered after expanding repeats, or a rule of
+    :func:`polyply_gui.linking.rule_pairs` with `block` and `to` for
+    `blockA` and `blocksB`; all links are added as one edit. The output files default to
+    `<name>.json` and `<name>.itp` in `outdir` and can be set with
+    `seq_file` and `itp_file`; `compact` selects the compact seq
+    file format.
+
+    Returns
+    -------
+    dict
+        summary of the build
+    """
+    name = spec.get("name", "molecule")
+    builder = GraphBuilder(force_field=spec.get("force_field"), seed=spec.get("seed"))
+    for block in spec["blocks"]:
+        if "file" in block:
+            builder.load_file(block["file"], molecule=block.get("molecule"))
+            continue
+        for copy in range(block.get("repeat", 1)):
+            builder.add_block(block["monomer"], block["n_mon"],
+                              branching=block.get("branching", 1),
+                              tacticity=block.get("tacticity"),
+                              probability=block.get("probability", 0.5),
+                              seed=block.get("seed"))
+            if copy > 0:
+                block_idx = len(builder.graph.blocks)
+                last = len(builder.graph.block_nodes(builder._block_id(block_idx - 1)))
+                builder.link(block_idx - 1, last, block_idx, 1)
+    pairs = [np.zeros((0, 4), dtype=np.int64)]
+    for link in spec.get("links", []):
+        if isinstance(link, dict):
+            pairs.append(rule_pairs(builder, link["block"], parse_blocks(str(link["to"])),
+                                    residB=link.get("resid", 1), step=link.get("step", 1),
+                                    start=link.get("start", 1), resname=link.get("resname")))
+        else:
+            pairs.append(np.array([link], dtype=np.int64))
+    builder.link_pairs(np.concatenate(pairs))
+
+    os.makedirs(outdir, exist_ok=True)
+    seq_path = os.path.join(outdir, spec.get("seq_file", name + ".json"))
+    builder.write_seq_file(seq_path, compact=spec.get("compact", False))
+    summary = {"name": name,
+               "n_residues": len(builder.graph),
+               "seq_file": seq_path,
+               "itp_file": None,
+               "log": []}
+    if builder.force_field:
+        itp_path = os.path.join(outdir, spec.get("itp_file", name + ".itp"))
+        summary["log"] = builder.gen_itp(itp_path)
+        summary["itp_file"] = itp_path
+    return summary
+
+def build_specs(specs, outdir=".", nprocs=1):
+    """
+    Build many specs, distributing them over `nprocs` processes.
+
+    Returns
+    -------
+    list[dict]
+        the summaries in the order of `specs`
+    """
+    if nprocs == 1:
+        return [build_from_spec(spec, outdir) for spec in specs]
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        return list(executor.map(build_from_spec, specs, [outdir] * len(specs)))
@@ -0,0 +1,93 @@
+import os
+import io
+import pickle
+import threading
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+def user_cache_dir(name):
+    """
+    Directory `name` of polyply_gui in the user cache directory,
+    which is $XDG_CACHE_HOME or ~/.cache.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return Path(cache_home).joinpath('polyply_gui', name)
+
+def _list_defaultdict():
+    return defaultdict(list)
+
+def _nested_defaultdict(items):
+    return defaultdict(_list_defaultdict, items)
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickler for :class:`vermouth.forcefield.ForceField` objects and
+    the molecules made from them. The molecules store their log
+    entries in a defaultdict with a lambda as default factory, which
+    is replaced by a module level function.
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, defaultdict) and getattr(obj.default_factory, '__name__', '') == '<lambda>':
+            return _nested_defaultdict, (dict(obj),)
+        return NotImplemented
+
+def write_pickle(path, obj):
+    """
+    Pickle `obj` to `path`, creating its directory. The pickle is
+    written to a temporary file of this process first and then
+    moved to `path`, so that processes writing the same file at
+    once and readers never see a partial pickle.
+
+    Raises
+    ------
+    OSError
+        if the file cannot be written
+    """
+    path = Path(path)
+    buffer = io.BytesIO()
+    _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.{}.tmp'.format(os.getpid()))
+    try:
+        with open(tmp_path, 'wb') as file_handle:
+            file_handle.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+class LRUCache():
+    """
+    Thread-safe mapping of at most `maxsize` items, which drops the
+    least recently used item when full.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        The item stored under `key`, which becomes the most recently
+        used, or `default`.
+        """
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
@@ -0,0 +1,124 @@
+import time
+import PySimpleGUI as sg
+from .profiling import span, get_profiler
+
+class EventDispatcher():
+    """
+    Reads the events of all open windows and calls the method of
+    the event handler with the same name as the event.
+
+    Drag events on the graph viewer are coalesced: queued drag events
+    only update the pending mouse position, which is rendered once the
+    queue is drained and at most `max_fps` times per second. Releasing
+    the mouse renders the final position and an exact redraw. While
+    background jobs are around, their output is polled every
+    `poll_interval` ms, and journal entries of the session that are
+    waiting to be written are flushed once they are due.
+
+    With profiling enabled every handler call is timed, and at most
+    every `report_interval` s the latency summary is written to the
+    command log.
+    """
+
+    def __init__(self, event_handler, main_window, max_fps=30, poll_interval=100, report_interval=10):
+        self.event_handler = event_handler
+        self.main_window = main_window
+        self.frame_time = 1. / max_fps
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.last_report = time.perf_counter()
+        self.reported_spans = 0
+        self.last_render = 0.
+        # window and values of the latest drag event not rendered yet
+        self.pending_drag = None
+
+    def _timeout(self):
+        """
+        Time in ms to wait for the next event; with a pending
+        drag we only wait until the next frame is due.
+        """
+        timeouts = []
+        if self.event_handler.jobs.jobs:
+            timeouts.append(self.poll_interval)
+        session = self.event_handler.session
+        if session is not None and session.pending:
+            timeouts.append(int(session.due() * 1000))
+        if self.pending_drag is not None:
+            remaining = self.frame_time - (time.perf_counter() - self.last_render)
+            timeouts.append(max(0, int(remaining * 1000)))
+        return min(timeouts) if timeouts else None
+
+    def _call(self, name, window, event, values):
+        with span(name, "event"):
+            getattr(self.event_handler, name)(window, event, values)
+
+    def _render_drag(self):
+        window, values = self.pending_drag
+        self.pending_drag = None
+        self.last_render = time.perf_counter()
+        self._call('graph_event', window, 'graph_event', values)
+
+    def _report(self):
+        """
+        Write the latency summary to the command log, if there
+        is a profiler with new spans and the last report is long
+        enough ago.
+        """
+        profiler = get_profiler()
+        now = time.perf_counter()
+        if profiler is None or profiler.n_spans == self.reported_spans \
+           or now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        self.reported_spans = profiler.n_spans
+        lines = profiler.summary()
+        if lines:
+            self.event_handler.update_log(self.main_window, None,
+                                          {"update_log": ["profile: " + line for line in lines]})
+
+    def dispatch(self, window, event, values):
+        """
+        Handle a single event.
+        """
+        if event == 'graph_event':
+            self.pending_drag = (window, values)
+            # don't let a continuous stream of events starve the view
+            if time.perf_counter() - self.last_render > 2 * self.frame_time:
+                self._render_drag()
+        elif event == sg.TIMEOUT_KEY:
+            if self.pending_drag is not None:
+                self._render_drag()
+            if self.event_handler.jobs.jobs:
+                self._call('poll_jobs', window, event, values)
+            session = self.event_handler.session
+            if session is not None and session.due() == 0:
+                self._call('flush_session', window, event, values)
+        elif event == 'graph_event+UP':
+            if self.pending_drag is not None:
+                self._render_drag()
+            self._call('end_drag', window, event, values)
+        else:
+            # anything else sees the view at the latest drag position
+            if self.pending_drag is not None:
+                self._render_drag()
+            if not hasattr(self.event_handler, event):
+                raise IOError("unkown event triggered. Bailing out.")
+            self._call(event, window, event, values)
+
+    def run(self):
+        """
+        Event loop until the main window is closed.
+        """
+        while True:
+            window, event, values = sg.read_all_windows(timeout=self._timeout())
+
+            if event == "Exit" or event == sg.WIN_CLOSED:
+                window.close()
+                if window == self.main_window:     # if closing win 1, exit program
+                    self.event_handler.jobs.shutdown()
+                    if self.event_handler.session is not None:
+                        self.event_handler.session.close()
+                    break
+            else:
+                self.dispatch(window, event, values)
+                self._report()
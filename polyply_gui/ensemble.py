@@ -0,0 +1,162 @@
+"""
+Ensembles of chains with a distribution of lengths, written as a
+seq file and, given a force field, an itp per chain.
+
+All chains are cut from one template of the longest chain, and each
+chain draws its tacticity from its own seed spawned from the seed of
+the ensemble, so the output does not depend on the number of
+processes it is written with.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .molecule_graph import MoleculeGraph
+from .polyply_runner import gen_itp_from_graph
+from .seq_io import write_seq_graph
+from .tacticity import sample_tacticity
+
+def _monodisperse(n_chains, mean, dispersity, rng):
+    return np.full(n_chains, int(round(mean)))
+
+def _poisson(n_chains, mean, dispersity, rng):
+    # shifted to not yield empty chains, keeping the mean
+    return 1 + rng.poisson(mean - 1, n_chains)
+
+def _schulz_zimm(n_chains, mean, dispersity, rng):
+    if dispersity is None or dispersity <= 1:
+        raise ValueError("the Schulz-Zimm distribution needs a dispersity above 1")
+    shape = 1. / (dispersity - 1.)
+    return np.maximum(np.rint(rng.gamma(shape, mean / shape, n_chains)), 1).astype(int)
+
+def _flory(n_chains, mean, dispersity, rng):
+    return rng.geometric(1. / mean, n_chains)
+
+# the distributions map the number of chains, the number average
+# length, the dispersity Mw/Mn (where it is a parameter) and a random
+# generator to an array of chain lengths
+LENGTH_DISTRIBUTIONS = {"monodisperse": _monodisperse,
+                        "poisson": _poisson,
+                        "schulz_zimm": _schulz_zimm,
+                        "flory": _flory,}
+
+def sample_lengths(n_chains, distribution, mean, dispersity=None, rng=None):
+    """
+    Number of residues of `n_chains` chains following one of
+    :data:`LENGTH_DISTRIBUTIONS` with number average `mean`.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    return LENGTH_DISTRIBUTIONS[distribution](n_chains, mean, dispersity, rng)
+
+def _tree_size(branching, generations):
+    if branching == 1:
+        return generations
+    return (branching**generations - 1) // (branching - 1)
+
+class ChainTemplate():
+    """
+    Residues and edges of the longest chain of an ensemble, from
+    which the others are cut. The residues are in breadth first
+    order, so any first n of them are connected, and the edges are
+    sorted by their later residue, so the edges between the first
+    n residues are the first n-1 edges.
+    """
+
+    def __init__(self, monomer, n_max, branching=1):
+        from polyply.src.gen_seq import _branched_graph
+        generations = 1
+        while _tree_size(branching, generations) < n_max:
+            generations += 1
+        graph = _branched_graph(monomer, branching, generations)
+        edges = np.sort(np.array(graph.edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        self.edges = edges[np.argsort(edges[:, 1], kind='stable')]
+        self.resnames = np.array([resname for _, resname in graph.nodes(data="resname")], dtype=object)
+
+    def chain(self, n_res):
+        """
+        Resnames and (K, 2) edges of the chain of `n_res` residues.
+        """
+        return self.resnames[:n_res], self.edges[:np.searchsorted(self.edges[:, 1], n_res)]
+
+# template and settings of the ensemble written by this process
+_WORKER = {}
+
+def _init_worker(template, settings):
+    _WORKER["template"] = template
+    _WORKER["settings"] = settings
+
+def _write_chain(task):
+    idx, n_res, seed = task
+    settings = _WORKER["settings"]
+    resnames, edges = _WORKER["template"].chain(n_res)
+    attributes = {}
+    if settings["tacticity"]:
+        attributes["tacticity"] = sample_tacticity(n_res, settings["tacticity"],
+                                                   np.random.default_rng(seed),
+                                                   settings["probability"])
+    graph = MoleculeGraph()
+    graph.add_block(resnames, edges, name=settings["monomer"], attributes=attributes)
+
+    name = "{}_{:0{}d}".format(settings["name"], idx + 1, settings["width"])
+    seq_path = os.path.join(settings["outdir"], name + ".json")
+    write_seq_graph(graph, seq_path, compact=settings["compact"])
+    summary = {"name": name, "n_residues": int(n_res), "seq_file": seq_path, "itp_file": None, "log": []}
+    if settings["force_field"]:
+        summary["itp_file"] = os.path.join(settings["outdir"], name + ".itp")
+        # every chain is a block of its own, which no fragment cache helps
+        summary["log"] = gen_itp_from_graph(graph, summary["itp_file"], settings["force_field"],
+                                            name=name, fragments=False)
+    return summary
+
+def build_ensemble(spec, outdir=".", nprocs=1):
+    """
+    Write an ensemble of chains described by a spec like::
+
+        {"name": "PS",
+         "monomer": "PS",
+         "n_chains": 100,
+         "distribution": "schulz_zimm",
+         "mean": 50,
+         "dispersity": 1.2,
+         "tacticity": "bernoulli",
+         "probability": 0.7,
+         "seed": 42,
+         "force_field": "2016H66"}
+
+    The lengths are drawn from one of :data:`LENGTH_DISTRIBUTIONS`
+    and count residues; with a `branching` above 1 the chains are
+    trees cut from the template in breadth first order. Chain files
+    are named `<name>_<n>` and written by `nprocs` processes;
+    `compact` selects the compact seq file format.
+
+    Returns
+    -------
+    dict
+        the lengths statistics and the summaries of all chains
+    """
+    seed_sequence = np.random.SeedSequence(spec.get("seed"))
+    length_seed, chain_seed = seed_sequence.spawn(2)
+    n_chains = spec["n_chains"]
+    lengths = sample_lengths(n_chains, spec.get("distribution", "monodisperse"), spec["mean"],
+                             spec.get("dispersity"), np.random.default_rng(length_seed))
+    template = ChainTemplate(spec["monomer"], int(lengths.max()), spec.get("branching", 1))
+    settings = {"name": spec.get("name", spec["monomer"]),
+                "monomer": spec["monomer"],
+                "tacticity": spec.get("tacticity"),
+                "probability": spec.get("probability", 0.5),
+                "compact": spec.get("compact", False),
+                "force_field": spec.get("force_field"),
+                "outdir": outdir,
+                "width": len(str(n_chains))}
+    os.makedirs(outdir, exist_ok=True)
+    tasks = list(zip(range(n_chains), lengths.tolist(), chain_seed.spawn(n_chains)))
+    if nprocs == 1:
+        _init_worker(template, settings)
+        chains = list(map(_write_chain, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=nprocs, initializer=_init_worker,
+                                 initargs=(template, settings)) as executor:
+            chains = list(executor.map(_write_chain, tasks, chunksize=max(1, n_chains // (4 * nprocs))))
+
+    mn = lengths.mean()
+    mw = (lengths**2).sum() / lengths.sum()
+    return {"name": settings["name"], "mn": mn, "mw": mw, "dispersity": mw / mn, "chains": chains}
@@ -1,48 +1,52 @@
 import os
-import PySimpleGUI as sg
+import copy
+import time
+import numpy as np
 import os.path
 from pathlib import Path
-import json
-import numpy as np
-import networkx as nx
-from networkx.readwrite import json_graph
-import vermouth
-from vermouth.gmx.itp_read import read_itp
-from vermouth.gmx.gro import read_gro
-from vermouth.pdb.pdb import read_pdb
-from vermouth.graph_utils import make_residue_graph
-import polyply
-from polyply import DATA_PATH
-from polyply.src.load_library import load_library
-from polyply.src.gen_seq import _branched_graph, _random_replace_nodes_attribute
-from .windows import ChainArchitechtureWindow, AddConnectionWindow
-from .graph_drawing import draw_graph
-from .polyply_runner import run_gen_itp
-
-PARSERS = {"itp": read_itp,}
+from .windows import ChainArchitechtureWindow, AddConnectionWindow, BatchLinkWindow
+from .graph_drawing import draw_graph, GraphScene
+from .polyply_runner import gen_itp_from_graph
+from .jobs import JobRunner
+from .ff_cache import ForceFieldCache
+from .builder import GraphBuilder
+from .linking import rule_pairs, parse_blocks, parse_pairs, read_pairs
+from .profiling import get_profiler
 
 class EventHandler():
     """
     Class for handling the bookkeeping behind the different
     events in the polyply GUI. Each event is implemented as
     a class method, which take the window and the event
-    that triggered them as input.
+    that triggered them as input. Building the graph itself
+    is left to a :class:`polyply_gui.builder.GraphBuilder`.
     """
 
-    def __init__(self, base_window, graph_viewer, canvas_size):
-        self.graph = nx.Graph()
-        self.blocks = []
+    def __init__(self, base_window, graph_viewer, canvas_size, ff_cache=None,
+                 initial_layout="multilevel", session=None):
+        self.builder = GraphBuilder()
         self.base_window = base_window
         self.graph_viewer = graph_viewer
-        self.force_field = None
+        self.library = None
+        self.ff_cache = ff_cache if ff_cache is not None else ForceFieldCache()
         self.monomers = []
-        self.seq_list = []
         self.canvas_size = canvas_size
         self.canvas_center = (canvas_size[0]/2., canvas_size[1]/2.)
         self.zoom_factor = 0
         self.seq_path = None
         self.itp_path = None
-        self.coords = None
+        self.scene = GraphScene(graph_viewer['graph_event'], self.canvas_center)
+        self.builder.on_relabel = self.scene.relabel
+        # layout of large new blocks; None grows them node by node
+        self.initial_layout = initial_layout
+        # mouse location and view offset where the current drag started
+        self.drag_start = None
+        # releasing the mouse within this many pixels of where it was
+        # pressed is a click rather than a drag
+        self.click_tolerance = 3
+        self.jobs = JobRunner()
+        # autosave of the session; see polyply_gui.journal
+        self.session = session
         self.arch_args = {"tree_block": {'title':'tree block' ,
                                      'combo1_title': "monomer type",
                                      'combo1_values': list(),
@@ -84,10 +88,50 @@ class EventHandler():
                                    'in2_value': "",
                                    'in2_visible': False,}}
 
+    @property
+    def graph(self):
+        return self.builder.graph
+
+    @property
+    def seq_list(self):
+        return self.builder.seq_list
+
+    @property
+    def coords(self):
+        return self.builder.coords
+
+    @coords.setter
+    def coords(self, coords):
+        self.builder.coords = coords
+
+    @property
+    def force_field(self):
+        return self.builder.force_field
+
     def set_force_field(self, window, event, values):
-        self.force_field = window["set_force_field"].get()
-        library = load_library("libs", [self.force_field], [])
-        self.monomers = list(library.blocks.keys())
+        self.builder.set_force_field(window["set_force_field"].get())
+        self.library = self.ff_cache.get(self.force_field)
+        self.monomers = list(self.library.blocks.keys())
+
+    def restore_session(self):
+        """
+        Rebuild the graph of the last session from its checkpoint and
+        journal, then save every further edit to it.
+        """
+        n_replayed = self.session.restore(self.builder)
+        self.builder.session = self.session
+        if self.force_field:
+            self.base_window["set_force_field"].update(value=self.force_field)
+            self.library = self.ff_cache.get(self.force_field)
+            self.monomers = list(self.library.blocks.keys())
+        if self.graph.blocks:
+            self.base_window["-SEQ-"].update(self.seq_list)
+            self._draw()
+            message = "restored {} blocks, {} edits replayed".format(len(self.graph.blocks), n_replayed)
+            self.update_log(self.base_window, None, {"update_log": [message]})
+
+    def flush_session(self, window, event, values):
+        self.session.flush()
 
     def open_architecture_window(self, window, event, values):
         window_args = self.arch_args[event]
@@ -124,121 +168,240 @@ class EventHandler():
         new_window = AddConnectionWindow(title="remove links",
                                          combo1_visible=False,
                                          in1_title="remove",
-                                         in1_key="remove_block").create_window()
+                                         in1_key="remove_edge").create_window()
+
+    def open_batch_link_window(self, window, event, values):
+        new_window = BatchLinkWindow(title="batch link").create_window()
+
+    def _draw(self, update_nodes=None):
+        """
+        Place new or changed residues and update the graph viewer.
+        """
+        canvas = self.graph_viewer['graph_event']
+        self.coords = draw_graph(canvas, self.graph, canvas_center=self.canvas_center,
+                                 coordinates=self.coords, layout="incremental",
+                                 update_nodes=update_nodes, scene=self.scene,
+                                 blocks=self.graph.block_ranges(),
+                                 initial_layout=self.initial_layout)
+
+    def _resids(self, values):
+        return [int(values[key]) for key in ("idA", "residA", "idB", "residB")]
 
     def add_block(self, window, event, values):
-        block_count = len(self.blocks) + 1
         # get the user input
         n_mon = values['-NMON-']
         branching_f = values['-BRANCH-']
         monomer = window['-MONOMERS-'].get()
-        # update the sequence list
-        seq_element = " ".join([str(block_count), monomer, n_mon])
-        self.seq_list.append(seq_element)
-        self.base_window["-SEQ-"].update(self.seq_list)
-        # update nx-graph
-        last = len(self.graph.nodes)
-        new_graph = _branched_graph(monomer, int(branching_f), int(n_mon))
-        # set the tacticity attribute
-        if self.force_field not in ['martini3', 'martini2']:
+        tacticity, probability, seed = None, 0.5, None
+        if self.force_field not in ['martini3', 'martini2'] and window['tacticity'].get():
             tacticity = window['tacticity'].get()[0]
-            if tacticity == 'atactic':
-                print(tacticity)
-                self.graph = _random_replace_nodes_attribute(self.graph,
-                                                             attribute_values=["R", "S"],
-                                                             weights=[0.5, 0.5],
-                                                             attribute='tacticity',
-                                                             nodes=[],
-                                                             seed=None)
-            elif tacticity == 'isotactic-R':
-                nx.set_node_attributes(self.graph, 'R', 'tacticity')
-            elif tacticity == 'isotactic-S':
-                nx.set_node_attributes(self.graph, 'S', 'tacticity')
-
-        self.graph = nx.disjoint_union(self.graph, new_graph)
-        self.blocks.append(range(last, len(self.graph)))
+            probability = float(values['-PROB-'] or 0.5)
+            seed = int(values['-SEED-']) if values['-SEED-'] else None
+        self.builder.add_block(monomer, n_mon, branching_f, tacticity,
+                               probability=probability, seed=seed)
+        self.base_window["-SEQ-"].update(self.seq_list)
         # draw the residue graph
-        canvas = self.graph_viewer['graph_event']
-        self.coords = draw_graph(canvas, self.graph, canvas_center=self.canvas_center)
+        self._draw()
+
+    def _draw_link(self, nodeA, nodeB):
+        # only the linked block gets placed anew next to its partner
+        blockA, blockB = self.graph.block_of([nodeA, nodeB])
+        update_nodes = list(self.graph.block_nodes(blockB)) if blockA != blockB else []
+        self._draw(update_nodes=update_nodes)
 
     def conncet_blocks(self, window, event, values):
-        idxA = int(values["idA"]) - 1
-        idxB = int(values["idB"]) - 1
-        residA = int(values["residA"]) - 1
-        residB = int(values["residB"]) - 1
-        nodeA = self.blocks[idxA][residA]
-        nodeB = self.blocks[idxB][residB]
-        self.graph.add_edge(nodeA, nodeB)
-        canvas = self.graph_viewer['graph_event']
-        self.coords = draw_graph(canvas, self.graph, canvas_center=self.canvas_center, coordinates=self.coords)
+        try:
+            nodeA, nodeB = self.builder.link(*self._resids(values))
+        except (IndexError, KeyError, ValueError) as error:
+            self.update_log(self.base_window, event, {"update_log": ["cannot link: {}".format(error)]})
+            return
+        self._draw_link(nodeA, nodeB)
+
+    def link_selected(self, window, event, values):
+        selected = [node for node in self.scene.selected if node in self.graph]
+        if len(selected) != 2:
+            self.update_log(self.base_window, event, {"update_log": ["select two residues to link"]})
+            return
+        if not self.builder.link_nodes(*selected):
+            self.update_log(self.base_window, event, {"update_log": ["the residues are linked already"]})
+            return
+        self.scene.select([])
+        self._draw_link(*selected)
+
+    def _batch_pairs(self, values):
+        """
+        Pairs given in the batch link window: those of the rule
+        if a block is given, the pasted ones and the file's.
+        """
+        pairs = [parse_pairs(values.get('-PAIRS-') or "")]
+        if values.get('-BLOCKA-'):
+            pairs.append(rule_pairs(self.builder, int(values['-BLOCKA-']),
+                                    parse_blocks(values.get('-BLOCKSB-') or ""),
+                                    residB=int(values.get('-RESIDB-') or 1),
+                                    step=int(values.get('-STEP-') or 1),
+                                    start=int(values.get('-START-') or 1),
+                                    resname=values.get('-RESNAME-') or None))
+        if values.get('-PAIRSFILE-'):
+            pairs.append(read_pairs(values['-PAIRSFILE-']))
+        return np.concatenate(pairs)
+
+    def batch_link(self, window, event, values):
+        n_edges = self.graph.number_of_edges()
+        try:
+            nodes = self.builder.link_pairs(self._batch_pairs(values))
+        except (IOError, IndexError, KeyError, ValueError) as error:
+            self.update_log(self.base_window, event, {"update_log": ["cannot link: {}".format(error)]})
+            return
+        message = "added {} links".format(self.graph.number_of_edges() - n_edges)
+        self.update_log(self.base_window, event, {"update_log": [message]})
+        # the blocks grafted onto others get placed anew next to
+        # their partners, all in one layout update and redraw
+        blocksA, blocksB = self.graph.block_of(nodes[:, 0]), self.graph.block_of(nodes[:, 1])
+        moved = np.setdiff1d(blocksB, blocksA)
+        update_nodes = [node for block_id in moved.tolist() for node in self.graph.block_nodes(block_id)]
+        self._draw(update_nodes=update_nodes)
 
     def remove_edge(self, window, event, values):
-        idxA = int(values["idA"])
-        idxB = int(values["idB"])
-        residA = int(values["residA"])
-        residB = int(values["residB"])
-        nodeA = blocks[idxA][residA]
-        nodeB = blocks[idxB][residB]
-        graph.remove_edge(nodeA, nodeB)
-        canvas = self.graph_viewer['graph_event']
-        self.coords = draw_graph(canvas, graph, canvas_center=self.canvas_center, coordinates=self.coords)
+        try:
+            self.builder.unlink(*self._resids(values))
+        except (IndexError, KeyError, ValueError) as error:
+            self.update_log(self.base_window, event, {"update_log": ["cannot unlink: {}".format(error)]})
+            return
+        self._draw()
 
     def remove_block(self, window, event, values):
-        seq_idx = int(window["-SEQ-"].get()[0].split()[0]) - 1
-        nodes  = self.blocks[seq_idx]
-        for node in nodes:
-            self.graph.remove_node(node)
-        del self.blocks[seq_idx]
-        del self.seq_list[seq_idx]
-        for idx, item in enumerate(self.seq_list):
-            jdx, monomer, n_mon = item.split()
-            self.seq_list[idx] = " ".join([str(idx), monomer, n_mon])
+        try:
+            self.builder.remove_block(int(window["-SEQ-"].get()[0].split()[0]))
+        except (IndexError, KeyError, ValueError) as error:
+            self.update_log(self.base_window, event, {"update_log": ["cannot remove block: {}".format(error)]})
+            return
         window["-SEQ-"].update(self.seq_list)
-        canvas = self.graph_viewer['graph_event']
-        self.coords = draw_graph(canvas, self.graph, canvas_center=self.canvas_center, coordinates=self.coords)
+        self._draw()
+
+    def undo(self, window, event, values):
+        description = self.builder.undo()
+        if description:
+            self.update_log(self.base_window, event, {"update_log": ["undo " + description]})
+            self.base_window["-SEQ-"].update(self.seq_list)
+            self._draw()
+
+    def redo(self, window, event, values):
+        description = self.builder.redo()
+        if description:
+            self.update_log(self.base_window, event, {"update_log": ["redo " + description]})
+            self.base_window["-SEQ-"].update(self.seq_list)
+            self._draw()
 
     def write_seq_file(self, window, event, values):
         self.seq_path = values['write_seq_file']
         if self.seq_path:
-            g_json = json_graph.node_link_data(self.graph)
-            with open(self.seq_path, "w") as file_handle:
-                json.dump(g_json, file_handle, indent=2)
+            self.builder.write_seq_file(self.seq_path, compact=values.get('-COMPACT-', False))
 
     def zoom_in(self, window, event, values):
-        canvas = self.graph_viewer['graph_event']
         self.zoom_factor += -0.12
-        self.coords = draw_graph(canvas, self.graph, gen_coords=False,
-                   canvas_center=self.canvas_center,
-                   padding=self.zoom_factor, coordinates=self.coords)
+        self.scene.zoom(self.zoom_factor)
 
     def zoom_out(self, window, event, values):
-        canvas = self.graph_viewer['graph_event']
         self.zoom_factor += 0.12
-        self.coords = draw_graph(canvas,
-                                 self.graph,
-                                 canvas_center=self.canvas_center,
-                                 gen_coords=False,
-                                 padding=self.zoom_factor,
-                                 coordinates=self.coords)
+        self.scene.zoom(self.zoom_factor)
 
     def graph_event(self, window, event, values):
-        canvas = self.graph_viewer['graph_event']
-        xloc, yloc = values['graph_event']
-        deltax, deltay = self.canvas_center[0] - xloc, self.canvas_center[1] - yloc
-        self.coords = draw_graph(canvas,
-                                 self.graph,
-                                 gen_coords=False,
-                                 padding=self.zoom_factor,
-                                 canvas_center=self.canvas_center,
-                                 move=(deltax, deltay),
-                                 coordinates=self.coords)
+        location = values['graph_event']
+        if self.drag_start is None:
+            # the mouse was just pressed
+            self.drag_start = (location, self.scene.move)
+            return
+        (xstart, ystart), (movex, movey) = self.drag_start
+        self.scene.pan((movex + xstart - location[0], movey + ystart - location[1]))
+
+    def end_drag(self, window, event, values):
+        """
+        Mouse release on the graph viewer: a click selects the residue
+        under the mouse, the end of a drag redraws the view exactly.
+        """
+        if self.drag_start is None:
+            return
+        location = values['graph_event']
+        (xstart, ystart), _ = self.drag_start
+        if abs(location[0] - xstart) + abs(location[1] - ystart) <= self.click_tolerance:
+            self.drag_start = None
+            self.pick_node(location)
+            return
+        self.graph_event(window, event, values)
+        self.drag_start = None
+        self.scene.redraw()
+
+    def pick_node(self, location):
+        """
+        Toggle the selection of the residue at `location`; clicking
+        next to all residues clears the selection. At most the two
+        latest residues stay selected.
+        """
+        node = self.scene.pick(location)
+        selected = [node for node in self.scene.selected if node in self.graph]
+        if node is None:
+            selected = []
+        elif node in selected:
+            selected.remove(node)
+        else:
+            selected = selected[-1:] + [node]
+            block_idx, resid = self.builder.locate(node)
+            message = "selected block {} resid {} ({})".format(block_idx, resid,
+                                                               self.graph.nodes[node].get("resname"))
+            self.update_log(self.base_window, None, {"update_log": [message]})
+        self.scene.select(selected)
+
+    def set_layout(self, window, event, values):
+        layout = values['set_layout']
+        self.initial_layout = None if layout == "incremental" else layout
+
+    def relayout(self, window, event, values):
+        """
+        Lay out the whole graph anew.
+        """
+        self.coords = None
+        self._draw()
+
+    def redraw(self, window, event, values):
+        self.scene.redraw()
 
     def gen_itp(self, window, event, values):
         self.itp_path = values['gen_itp']
         if self.itp_path:
-            output = run_gen_itp(self.seq_path, self.itp_path, self.force_field)
-            values['update_log'] = output
+            # the pool pickles the arguments later on, so it gets a
+            # snapshot of the graph; workers keep the library between jobs
+            job_id = self.jobs.submit(gen_itp_from_graph, copy.deepcopy(self.builder.graph),
+                                      force_field=self.force_field, output=self.itp_path,
+                                      description=os.path.basename(self.itp_path))
+            values['update_log'] = ["job {} started: {}".format(job_id, self.itp_path)]
             self.update_log(window, event, values)
+            self.base_window["-JOBS-"].update([str(job) for job in self.jobs.jobs.values()])
+
+    def poll_jobs(self, window, event, values):
+        lines, finished = self.jobs.poll()
+        log = ["[job {}] {}".format(job_id, line) for job_id, line in lines if line]
+        profiler = get_profiler()
+        for job in finished:
+            # the time from submitting to noticing the job is done
+            if profiler is not None and not job.cancelled:
+                profiler.record("job " + job.name, job.submitted,
+                                time.perf_counter() - job.submitted, "jobs")
+            if job.cancelled:
+                log.append("job {} cancelled".format(job.job_id))
+            elif job.future.exception():
+                log.append("job {} failed: {}".format(job.job_id, job.future.exception()))
+            else:
+                log.append("job {} finished".format(job.job_id))
+        if log:
+            self.update_log(self.base_window, event, {"update_log": log})
+        if finished:
+            self.base_window["-JOBS-"].update([str(job) for job in self.jobs.jobs.values()])
+
+    def cancel_job(self, window, event, values):
+        selected = window["-JOBS-"].get()
+        if selected:
+            job_id = int(selected[0].split()[0])
+            self.jobs.cancel(job_id)
 
     def update_log(self, window, event, values):
         log = window["update_log"].get()
@@ -248,23 +411,12 @@ class EventHandler():
     def load_file(self, window, event, values):
         path = Path(values['load_file'])
         if path.is_file():
-            with open(path) as _file:
-                lines = _file.readlines()
-            file_extension = path.suffix.casefold()[1:]
-            force_field = vermouth.forcefield.ForceField("dummy")
-            PARSERS[file_extension](lines, force_field)
-            mol_name = list(force_field.blocks.keys())[0]
-            molecule = force_field.blocks[mol_name]
-            molecule.make_edges_from_interaction_type('bonds')
-            new_graph = make_residue_graph(molecule)
-            last = len(self.graph.nodes)
-            self.graph = nx.disjoint_union(self.graph, new_graph)
-            self.blocks.append(range(last, len(self.graph)))
-            # update sequence list
-            block_count = len(self.blocks) + 1
-            seq_element = " ".join([str(block_count), mol_name, str(len(new_graph.nodes))])
-            self.seq_list.append(seq_element)
+            molecule = values.get('-MOLNAME-') or None
+            try:
+                self.builder.load_file(path, molecule=molecule)
+            except (IOError, KeyError, ValueError) as error:
+                self.update_log(self.base_window, event, {"update_log": ["cannot load {}: {}".format(path, error)]})
+                return
             self.base_window["-SEQ-"].update(self.seq_list)
             # draw the residue graph
-            canvas = self.graph_viewer['graph_event']
-            self.coords = draw_graph(canvas, self.graph, canvas_center=self.canvas_center, coordinates=self.coords)
+            self._draw()
@@ -0,0 +1,121 @@
+import pickle
+import hashlib
+import threading
+from collections import defaultdict
+from pathlib import Path
+from . import POLYPLY_DATA_PATH
+from .profiling import span
+from .cache_utils import user_cache_dir, write_pickle, LRUCache
+
+def library_key(name, data_path=POLYPLY_DATA_PATH):
+    """
+    Hash of the paths, sizes and modification times of all files
+    making up library `name`. Any change to the library files
+    changes the key.
+    """
+    directory = Path(data_path).joinpath(name)
+    digest = hashlib.sha1(name.encode())
+    for path in sorted(directory.iterdir()):
+        stat = path.stat()
+        digest.update("{} {} {}".format(path, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+def _load_library(name):
+    """
+    Read library `name` from the polyply data files.
+    """
+    try:
+        from polyply.src.load_library import load_ff_library
+    except ImportError:
+        # polyply before 1.5
+        from polyply.src.load_library import load_library
+        return load_library("libs", [name], [])
+    return load_ff_library("libs", [name], [])
+
+class ForceFieldCache():
+    """
+    Cache of loaded force-field libraries.
+
+    Libraries are kept in an in-memory LRU of at most `maxsize`
+    :class:`vermouth.forcefield.ForceField` objects. Below that is an
+    on-disk cache of pickled libraries, keyed by the paths and mtimes
+    of the library files, so parsing only happens when a library is
+    new or has changed. Libraries can be preloaded in a background
+    thread.
+    """
+
+    def __init__(self, maxsize=4, cache_dir=None, data_path=POLYPLY_DATA_PATH):
+        self.cache_dir = Path(cache_dir) if cache_dir else user_cache_dir('force_fields')
+        self.data_path = data_path
+        self._force_fields = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._name_locks = defaultdict(threading.Lock)
+
+    def _disk_path(self, name):
+        return self.cache_dir.joinpath("{}-{}.pickle".format(name, library_key(name, self.data_path)))
+
+    def _read_disk(self, name):
+        path = self._disk_path(name)
+        try:
+            with open(path, 'rb') as file_handle:
+                return pickle.load(file_handle)
+        except Exception:
+            # a stale or damaged pickle can fail in many ways, all
+            # of which mean reading the library files again
+            return None
+
+    def _write_disk(self, name, force_field):
+        path = self._disk_path(name)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # remove stale versions of this library
+            for old_path in path.parent.glob("{}-*.pickle".format(name)):
+                if old_path.stem.rsplit('-', 1)[0] == name:
+                    old_path.unlink()
+            # workers may write the same library at once
+            write_pickle(path, force_field)
+        except OSError:
+            # the disk cache is optional
+            pass
+
+    def get(self, name):
+        """
+        Return the force-field library `name`, loading it from the
+        disk cache or the library files if it is not in memory.
+        """
+        force_field = self._force_fields.get(name)
+        if force_field is not None:
+            return force_field
+        with self._lock:
+            name_lock = self._name_locks[name]
+
+        # a second request waits for the first one loading the library
+        with name_lock:
+            force_field = self._force_fields.get(name)
+            if force_field is not None:
+                return force_field
+            with span("read ff cache", "force_field", library=name):
+                force_field = self._read_disk(name)
+            if force_field is None:
+                with span("load_library", "force_field", library=name):
+                    force_field = _load_library(name)
+                self._write_disk(name, force_field)
+
+            self._force_fields.put(name, force_field)
+        return force_field
+
+    def preload(self, names):
+        """
+        Load the libraries `names` in a background thread.
+
+        Returns
+        -------
+        :class:`threading.Thread`
+        """
+        def _preload():
+            for name in names:
+                self.get(name)
+
+        thread = threading.Thread(target=_preload, name="ff-preload", daemon=True)
+        thread.start()
+        return thread
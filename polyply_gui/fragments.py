@@ -0,0 +1,356 @@
+"""
+Itp generation from cached fragments of the blocks of a
+:class:`polyply_gui.molecule_graph.MoleculeGraph`, so that after an
+edit only the blocks it touched are parameterized again.
+
+Applying the links of the force field takes most of the time of
+polyply's gen_itp, since every link is matched against the whole
+residue graph. Here every block is mapped and linked on its own
+into a fragment, which is cached under a hash of its resnames,
+attributes, edges and the force field. Merging the fragments in
+block order numbers atoms, resids and charge groups like mapping
+the whole graph at once does.
+
+The links between blocks are applied by a second run on the
+residues around them only. The halo are all residues up to `radius`
+bonds away from a residue linked to another block, where `radius`
+is the largest number of residues a force-field link spans less
+one, or the largest nrexcl if that is more. Every link matching a
+residue of the halo lies within the residues up to 3 `radius` bonds
+away, on which the second run is done for each of its connected
+parts. These are cached like the blocks, with their resids counted
+from their first residue. Interactions, edges and atom attributes
+with all atoms in the halo are taken from that run, all others from
+the fragments.
+"""
+import json
+import pickle
+import hashlib
+from pathlib import Path
+import numpy as np
+import networkx as nx
+from .cache_utils import user_cache_dir, write_pickle, LRUCache
+from .molecule_graph import split_resnames
+
+def supports_fragments(force_field):
+    """
+    Whether the links of `force_field` can be applied per block:
+    links that remove atoms, apply by atom id or depend on the
+    molecule meta data need the whole molecule.
+    """
+    for link in force_field.links:
+        if link.molecule_meta:
+            return False
+        for node in link.nodes:
+            if link.nodes[node].get('replace', {}).get('atomname', False) is None:
+                return False
+    return True
+
+def is_connected(graph):
+    """
+    Whether the residues of `graph` form a single molecule. polyply
+    maps the parts of a disconnected graph in its own way, and fails
+    on residues without edges, so these graphs are not linked from
+    fragments.
+    """
+    seq_graph = nx.Graph()
+    seq_graph.add_nodes_from(range(len(graph)))
+    seq_graph.add_edges_from(graph.compact_edges().tolist())
+    return nx.is_connected(seq_graph)
+
+def link_radius(force_field):
+    """
+    The `radius` of the halo, see the module documentation.
+    """
+    from vermouth.graph_utils import make_residue_graph
+    n_residues = [len(make_residue_graph(link, attrs=('order',))) for link in force_field.links]
+    nrexcl = [block.nrexcl or 0 for block in force_field.blocks.values()]
+    return max(max(n_residues, default=1) - 1, max(nrexcl, default=0), 1)
+
+class FragmentCache():
+    """
+    Fragments in an in-memory LRU of at most `maxsize` entries and,
+    for force fields loaded from a library, pickled in `cache_dir`,
+    where they are shared by all processes and kept between
+    sessions. The disk cache keeps the `max_files` newest fragments.
+    """
+
+    def __init__(self, maxsize=256, cache_dir=None, max_files=4096):
+        self.cache_dir = Path(cache_dir) if cache_dir else user_cache_dir('fragments')
+        self.max_files = max_files
+        self._fragments = LRUCache(maxsize)
+        self._n_writes = 0
+
+    def _disk_path(self, key):
+        return self.cache_dir.joinpath(key + ".pickle")
+
+    def get(self, key, force_field, persistent=True):
+        """
+        The fragment stored under `key` for `force_field`, or None.
+        """
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            if not persistent:
+                return None
+            try:
+                with open(self._disk_path(key), 'rb') as file_handle:
+                    fragment = pickle.load(file_handle)
+            except Exception:
+                # a damaged or stale pickle is linked anew
+                return None
+            self._fragments.put(key, fragment)
+        fragment._force_field = force_field
+        return fragment
+
+    def put(self, key, fragment, persistent=True):
+        self._fragments.put(key, fragment)
+        if persistent:
+            self._write_disk(key, fragment)
+
+    def _write_disk(self, key, fragment):
+        path = self._disk_path(key)
+        # the force field is large and comes from its own cache
+        force_field = fragment._force_field
+        fragment._force_field = None
+        try:
+            write_pickle(path, fragment)
+            self._n_writes += 1
+            if self._n_writes % 64 == 0:
+                self._prune()
+        except OSError:
+            # the disk cache is optional
+            pass
+        finally:
+            fragment._force_field = force_field
+
+    def _prune(self):
+        paths = sorted(self.cache_dir.glob("*.pickle"), key=lambda path: path.stat().st_mtime)
+        for path in paths[:max(0, len(paths) - self.max_files)]:
+            path.unlink()
+
+def block_key(force_field_key, exclusions, first, resnames, attributes, edges):
+    """
+    Hash of everything the fragment of a block depends on.
+    """
+    digest = hashlib.sha1(json.dumps([force_field_key, exclusions, first, resnames,
+                                      sorted(attributes.items())]).encode())
+    digest.update(np.ascontiguousarray(edges, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+def map_residues(meta_molecule, force_field, first=None):
+    """
+    Map the residues of `meta_molecule` to the blocks of the force
+    field like :class:`polyply.src.map_to_molecule.MapToMolecule`,
+    for residues that are single blocks, but keeping the resids of
+    the residues even if they have gaps. Like polyply does for the
+    first residue of a molecule, the residue graph of the node
+    `first` lacks the residue attributes.
+    """
+    from polyply.src.map_to_molecule import _assert_blocks_in_FF
+    nodes = sorted(meta_molecule.nodes, key=lambda node: meta_molecule.nodes[node]["resid"])
+    _assert_blocks_in_FF([meta_molecule.nodes[node]["resname"] for node in nodes], force_field)
+    molecule = None
+    for node in nodes:
+        attributes = meta_molecule.nodes[node]
+        block = force_field.blocks[attributes["resname"]]
+        if molecule is None:
+            molecule = block.to_molecule()
+            atoms = list(molecule.nodes)
+        else:
+            atoms = list(molecule.merge_molecule(block).values())
+        for atom in atoms:
+            molecule.nodes[atom]["resid"] = attributes["resid"]
+        if node == first:
+            residue = molecule.copy()
+        else:
+            residue = nx.Graph()
+            for atom in atoms:
+                residue.add_node(atom, **molecule.nodes[atom])
+                residue.nodes[atom].update({key: value for key, value in attributes.items()
+                                            if key not in ("graph", "seqID")})
+        attributes["graph"] = residue
+    meta_molecule.molecule = molecule
+    return meta_molecule
+
+def _link(seq_graph, force_field, name, first):
+    """
+    Mapped and linked molecule of a residue graph.
+    """
+    from polyply import MetaMolecule, ApplyLinks
+    meta_molecule = MetaMolecule(seq_graph, force_field=force_field, mol_name=name)
+    meta_molecule = map_residues(meta_molecule, force_field, first)
+    return ApplyLinks().run_molecule(meta_molecule).molecule
+
+def _cached_link(cache, key, persistent, force_field, name, resnames, attributes, edges,
+                 resids=None, first=None):
+    """
+    The fragment of the residues `resnames` with the `attributes`
+    and `edges` of a part of the graph, from `cache` or linked.
+    """
+    fragment = cache.get(key, force_field, persistent)
+    if fragment is None:
+        seq_graph = nx.Graph()
+        for idx, resname in enumerate(resnames):
+            resid = idx + 1 if resids is None else resids[idx]
+            seq_graph.add_node(idx, resname=resname, resid=resid,
+                               **{attribute: column[idx] for attribute, column in attributes.items()
+                                  if column[idx] is not None})
+        seq_graph.add_edges_from(edges.tolist())
+        fragment = _link(seq_graph, force_field, name, first)
+        cache.put(key, fragment, persistent)
+    return fragment
+
+def _residue_atoms(molecule):
+    """
+    Atoms of every resid, in order.
+    """
+    atoms = {}
+    for atom in sorted(molecule.nodes):
+        atoms.setdefault(molecule.nodes[atom]["resid"], []).append(atom)
+    return atoms
+
+def _within(n_residues, edges, seeds, radius):
+    reached = np.zeros(n_residues, dtype=bool)
+    reached[seeds] = True
+    for _ in range(radius):
+        hit = reached[edges[:, 0]] | reached[edges[:, 1]]
+        reached[edges[hit].ravel()] = True
+    return reached
+
+def _apply_halo(molecule, atoms, halo_molecule, offset, halo_resids):
+    """
+    Replace everything of `molecule` with all atoms in the residues
+    `halo_resids` by what the run on the halo gave, whose resids
+    are `offset` less. `atoms` are the atoms of every resid of
+    `molecule`.
+    """
+    correspondence = {}
+    for resid, residue_atoms in _residue_atoms(halo_molecule).items():
+        if len(residue_atoms) != len(atoms[resid + offset]):
+            raise ValueError("residue {} changed its atoms".format(resid + offset))
+        correspondence.update(zip(residue_atoms, atoms[resid + offset]))
+    in_halo = {atom for resid in halo_resids for atom in atoms[resid]}
+
+    for inter_type, interactions in list(molecule.interactions.items()):
+        molecule.interactions[inter_type] = [interaction for interaction in interactions
+                                             if not in_halo.issuperset(interaction.atoms)]
+    for inter_type, interactions in halo_molecule.interactions.items():
+        for interaction in interactions:
+            atoms_ = tuple(correspondence[atom] for atom in interaction.atoms)
+            if in_halo.issuperset(atoms_):
+                molecule.add_interaction(inter_type, atoms_, interaction.parameters, interaction.meta)
+
+    for halo_atom, atom in correspondence.items():
+        if atom in in_halo:
+            molecule.nodes[atom].update({key: value for key, value in halo_molecule.nodes[halo_atom].items()
+                                         if key not in ("resid", "charge_group")})
+    for atomA, atomB in halo_molecule.edges:
+        atomA, atomB = correspondence[atomA], correspondence[atomB]
+        if atomA in in_halo and atomB in in_halo:
+            molecule.add_edge(atomA, atomB)
+    molecule.citations.update(halo_molecule.citations)
+    for loglevel, entries in halo_molecule.log_entries.items():
+        for entry, fmt_args in entries.items():
+            for fmt_arg in fmt_args:
+                fmt_arg = {key: correspondence[atom] for key, atom in fmt_arg.items()}
+                if in_halo.issuperset(fmt_arg.values()):
+                    molecule.log_entries[loglevel][entry].append(fmt_arg)
+
+def link_blocks(graph, force_field, name, cache, force_field_key, persistent=True):
+    """
+    The meta molecule of `graph` with the mapped and linked molecule
+    stitched from the fragments of its blocks, see the module
+    documentation. Like polyply's mapping, this tags the force-field
+    blocks if their nrexcl differ.
+
+    Parameters
+    ----------
+    graph: :class:`polyply_gui.molecule_graph.MoleculeGraph`
+    force_field: :class:`vermouth.forcefield.ForceField`
+    name: str
+    cache: :class:`FragmentCache`
+    force_field_key: str
+        identifies the force field in the cache keys
+    persistent: bool
+        whether fragments of this force field go to the disk cache
+
+    Returns
+    -------
+    :class:`polyply.src.meta_molecule.MetaMolecule`
+    """
+    from vermouth.molecule import Molecule
+    from polyply import MetaMolecule
+    from polyply.src.map_to_molecule import tag_exclusions, _assert_blocks_in_FF
+
+    nodes = graph.node_array()
+    n_residues = len(nodes)
+    edges = graph.compact_edges()
+    sizes = np.array([len(block) for block in graph.blocks.values()], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    block_row = np.repeat(np.arange(len(sizes)), sizes)
+    columns = graph.decode(nodes)
+    # blocks of differing nrexcl are tagged for the whole molecule,
+    # as mapping it at once would
+    resnames = sorted(set(columns["resname"]))
+    _assert_blocks_in_FF(resnames, force_field)
+    nrexcls = {force_field.blocks[resname].nrexcl for resname in resnames}
+    tag_exclusions(dict(enumerate(resnames)), force_field)
+    exclusions = min(nrexcls) if len(nrexcls) > 1 else None
+
+    internal = block_row[edges[:, 0]] == block_row[edges[:, 1]]
+    internal_edges = edges[internal]
+    order = np.argsort(block_row[internal_edges[:, 0]], kind='stable')
+    internal_edges = internal_edges[order]
+    edge_starts = np.searchsorted(block_row[internal_edges[:, 0]], np.arange(len(sizes) + 1))
+
+    molecule = Molecule(force_field=force_field)
+    for row, (start, size) in enumerate(zip(starts.tolist(), sizes.tolist())):
+        local_edges = internal_edges[edge_starts[row]:edge_starts[row+1]] - start
+        resnames, attributes = split_resnames({attribute: column[start:start+size]
+                                               for attribute, column in columns.items()})
+        # the first residue of the molecule is special, see map_residues
+        first = 0 if row == 0 else None
+        key = block_key(force_field_key, exclusions, first, resnames, attributes, local_edges)
+        fragment = _cached_link(cache, key, persistent, force_field, name,
+                                resnames, attributes, local_edges, first=first)
+        if row == 0:
+            molecule.meta = dict(fragment.meta)
+        molecule.merge_molecule(fragment)
+
+    seq_graph = graph.to_networkx(compact=True)
+    for node, attributes in seq_graph.nodes(data=True):
+        attributes["resid"] = node + 1
+    meta_molecule = MetaMolecule(seq_graph, force_field=force_field, mol_name=name)
+    meta_molecule.molecule = molecule
+
+    atoms = _residue_atoms(molecule)
+    crossing = edges[~internal]
+    if len(crossing):
+        radius = link_radius(force_field)
+        halo = _within(n_residues, edges, crossing.ravel(), radius)
+        context = _within(n_residues, edges, crossing.ravel(), 3 * radius)
+        # links do not reach across separate parts of the context,
+        # which are linked one by one to keep every run small; alike
+        # parts, like the junctions of repeated blocks, are cached
+        for part in nx.connected_components(seq_graph.subgraph(np.flatnonzero(context).tolist())):
+            part = np.array(sorted(part), dtype=np.int64)
+            offset = int(part[0])
+            local = np.full(n_residues, -1, dtype=np.int64)
+            local[part] = np.arange(len(part))
+            part_edges = local[edges]
+            part_edges = part_edges[(part_edges >= 0).all(axis=1)]
+            resnames, attributes = split_resnames({attribute: [column[node] for node in part.tolist()]
+                                                   for attribute, column in columns.items()})
+            resids = (part - offset + 1).tolist()
+            first = 0 if offset == 0 else None
+            key = block_key(force_field_key, exclusions, first, resnames,
+                            dict(attributes, resid=resids), part_edges)
+            halo_molecule = _cached_link(cache, key, persistent, force_field, name, resnames,
+                                         attributes, part_edges, resids=resids, first=first)
+            _apply_halo(molecule, atoms, halo_molecule, offset,
+                        (part[halo[part]] + 1).tolist())
+
+    # the residue graphs used for the terminal modifications
+    for node in {0, n_residues - 1}:
+        meta_molecule.nodes[node]["graph"] = molecule.subgraph(atoms[node + 1]).copy()
+    return meta_molecule
@@ -1,7 +1,9 @@
+from collections import deque
+from itertools import islice
 import networkx as nx
 import numpy as np
-import PySimpleGUI as sg
-import time
+from .spatial_index import GridIndex
+from .profiling import span
 
 def _scale_coords(coords, canvas_center, padding=0.12, move=(0., 0.)):
     """
@@ -13,6 +15,864 @@ def _scale_coords(coords, canvas_center, padding=0.12, move=(0., 0.)):
         out_coords.append(center+coord*scale_factor-offset)
     return tuple(out_coords)
 
+def _scale_array(coords, canvas_center, padding=0.12, move=(0., 0.)):
+    """
+    :func:`_scale_coords` of an (N, 2) array of coordinates at once.
+    """
+    center = np.asarray(canvas_center, dtype=float)
+    return center + np.asarray(coords, dtype=float) * (center - padding * center) - np.asarray(move, dtype=float)
+
+def _kamada_kawai_layout(graph, coordinates=None, nodes=None, **kwargs):
+    """
+    Full Kamada-Kawai layout of `graph`. Note that the `nodes`
+    argument is ignored, as all nodes get new positions.
+    """
+    if not isinstance(graph, nx.Graph):
+        graph = graph.to_networkx(compact=False)
+    return nx.kamada_kawai_layout(graph, pos=coordinates)
+
+def _edge_length(graph, coords, moving, context):
+    """
+    Estimate the ideal edge length from the already placed
+    edges around `context` or, for new components, a sample of
+    the placed nodes. If there are none, fall back to the
+    typical spacing of `graph` in a unit box.
+    """
+    lengths = []
+    for node in context or islice(coords, 64):
+        for neighbour in graph.neighbors(node):
+            if neighbour in coords and neighbour not in moving:
+                lengths.append(np.linalg.norm(coords[node] - coords[neighbour]))
+    if lengths:
+        return max(np.median(lengths), 1e-3)
+    return 2. / np.sqrt(len(graph.nodes))
+
+def _step(origin, direction, length, rng):
+    """
+    Position one `length` away from `origin` along `direction`
+    rotated by a random angle of at most 60 degrees.
+    """
+    angle = rng.uniform(-np.pi/3, np.pi/3)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)],
+                         [np.sin(angle), np.cos(angle)]])
+    direction = direction / max(np.linalg.norm(direction), 1e-12)
+    return origin + length * (rotation @ direction)
+
+def _seed_positions(graph, coords, moving, length, rng):
+    """
+    Give every node in `moving` without coordinates a starting
+    position. Nodes are walked breadth first from their placed
+    neighbours and put one edge length away, roughly continuing the
+    direction of their parent. Components without any placed node
+    start to the right of the current drawing.
+    """
+    if coords:
+        drawn = np.array(list(coords.values()))
+        right = drawn[:, 0].max()
+        ycenter = drawn[:, 1].mean()
+        center = drawn.mean(axis=0)
+    else:
+        right, ycenter = -length, 0.
+        center = np.zeros(2)
+
+    # start from the nodes hooked onto the existing drawing
+    anchored = [node for node in moving
+                if any(neighbour in coords for neighbour in graph.neighbors(node))]
+    directions = {}
+    for root in anchored + moving:
+        if root in coords:
+            continue
+        anchor = next((node for node in graph.neighbors(root) if node in coords), None)
+        if anchor is None:
+            coords[root] = np.array([right + length, ycenter])
+            directions[root] = np.array([1., 0.])
+        else:
+            direction = directions.get(anchor)
+            if direction is None:
+                # away from the placed neighbours of the anchor or,
+                # if it has none, from the center of the drawing
+                placed = [coords[node] for node in graph.neighbors(anchor) if node in coords]
+                direction = coords[anchor] - (np.mean(placed, axis=0) if placed else center)
+            if not np.any(direction):
+                direction = rng.normal(size=2)
+            coords[root] = _step(coords[anchor], direction, length, rng)
+            directions[root] = coords[root] - coords[anchor]
+
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for neighbour in graph.neighbors(node):
+                if neighbour not in coords:
+                    coords[neighbour] = _step(coords[node], directions[node], length, rng)
+                    directions[neighbour] = coords[neighbour] - coords[node]
+                    right = max(right, coords[neighbour][0])
+                    queue.append(neighbour)
+        right = max(right, coords[root][0])
+
+def _relax_positions(graph, coords, moving, context, length, iterations, relax):
+    """
+    Fruchterman-Reingold like force steps acting only on `moving`
+    nodes. Nodes in `context` repel and attract the moving nodes, but
+    are pinned or only displaced by a fraction `relax` of their force.
+    """
+    order = list(moving) + list(context)
+    index = {node: idx for idx, node in enumerate(order)}
+    positions = np.array([coords[node] for node in order], dtype=float)
+    n_moving = len(moving)
+
+    pairs = set()
+    for node in moving:
+        idx = index[node]
+        for neighbour in graph.neighbors(node):
+            jdx = index[neighbour]
+            pairs.add((min(idx, jdx), max(idx, jdx)))
+    pairs = np.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+    weights = np.full(len(order), relax)
+    weights[:n_moving] = 1.
+    n_rows = len(order) if relax > 0 else n_moving
+    chunk = max(1, 2**20 // max(len(order), 1))
+
+    for step in range(iterations):
+        temperature = length * (1. - step / iterations)
+        displacement = np.zeros_like(positions)
+        for start in range(0, n_rows, chunk):
+            rows = positions[start:start+chunk]
+            dist2 = (rows[:, :1] - positions[:, 0])**2 + (rows[:, 1:] - positions[:, 1])**2
+            weight = length**2 / np.maximum(dist2, 1e-9 * length**2)
+            weight[np.arange(len(rows)), np.arange(start, start+len(rows))] = 0.
+            displacement[start:start+chunk] += rows * weight.sum(axis=1)[:, None] - weight @ positions
+        if len(pairs):
+            delta = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+            force = delta * (np.linalg.norm(delta, axis=1) / length)[:, None]
+            np.add.at(displacement, pairs[:, 0], -force)
+            np.add.at(displacement, pairs[:, 1], force)
+        norm = np.maximum(np.linalg.norm(displacement, axis=1), 1e-12)
+        displacement *= (np.minimum(norm, temperature) / norm)[:, None]
+        positions += displacement * weights[:, None]
+
+    for node, idx in index.items():
+        if weights[idx] > 0:
+            coords[node] = positions[idx]
+
+def _graph_arrays(graph):
+    """
+    The nodes of `graph` as list and its edges as (E, 2) array
+    of indices into that list.
+    """
+    if hasattr(graph, "compact_edges"):
+        return graph.node_array().tolist(), graph.compact_edges()
+    nodes = list(graph.nodes)
+    index = {node: idx for idx, node in enumerate(nodes)}
+    edges = [(index[ndxA], index[ndxB]) for ndxA, ndxB in graph.edges]
+    return nodes, np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+def _neighbour_pairs(positions, cutoff):
+    """
+    All pairs of points closer than `cutoff`, found by binning the
+    points into square cells of that size and only comparing points
+    in the same or adjacent cells.
+    """
+    cells = np.floor((positions - positions.min(axis=0)) / cutoff).astype(np.int64)
+    # pad the rows so that neighbouring cells never wrap around
+    stride = cells[:, 1].max() + 3
+    cell_ids = cells[:, 0] * stride + cells[:, 1] + 1
+    order = np.argsort(cell_ids, kind='stable')
+    sorted_ids = cell_ids[order]
+    sources, targets = [], []
+    # every pair of adjacent cells is visited once
+    for offset in (0, stride - 1, stride, stride + 1, 1):
+        starts = np.searchsorted(sorted_ids, cell_ids + offset, side='left')
+        counts = np.searchsorted(sorted_ids, cell_ids + offset, side='right') - starts
+        source = np.repeat(np.arange(len(positions)), counts)
+        target = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                       + np.repeat(starts, counts)]
+        if offset == 0:
+            keep = source < target
+            source, target = source[keep], target[keep]
+        sources.append(source)
+        targets.append(target)
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    close = ((positions[sources] - positions[targets])**2).sum(axis=1) < cutoff**2
+    return sources[close], targets[close]
+
+def _force_steps(positions, edges, length, iterations, temperature, cutoff=None):
+    """
+    Fruchterman-Reingold steps on all `positions` in place. Nodes
+    repel each other, or only those closer than `cutoff` if given,
+    and edges attract their nodes; moves are capped by a temperature
+    cooling down from `temperature`.
+    """
+    n_nodes = len(positions)
+    if cutoff is None:
+        sources, targets = np.triu_indices(n_nodes, 1)
+    for step in range(iterations):
+        if cutoff is not None:
+            sources, targets = _neighbour_pairs(positions, cutoff)
+        delta = positions[sources] - positions[targets]
+        dist2 = np.maximum((delta**2).sum(axis=1), 1e-9 * length**2)
+        force = delta * (length**2 / dist2)[:, None]
+        delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+        spring = delta * (np.sqrt((delta**2).sum(axis=1)) / length)[:, None]
+        displacement = np.empty_like(positions)
+        for dim in range(2):
+            displacement[:, dim] = (np.bincount(sources, force[:, dim], n_nodes)
+                                    - np.bincount(targets, force[:, dim], n_nodes)
+                                    - np.bincount(edges[:, 0], spring[:, dim], n_nodes)
+                                    + np.bincount(edges[:, 1], spring[:, dim], n_nodes))
+        norm = np.maximum(np.sqrt((displacement**2).sum(axis=1)), 1e-12)
+        cap = temperature * (1. - step / iterations)
+        positions += displacement * (np.minimum(norm, cap) / norm)[:, None]
+
+def _coarsen(n_nodes, edges, weights, rng, rounds=3):
+    """
+    Contract a matching of the graph, preferring to merge light
+    nodes. In every round each unmatched node proposes its edge of
+    highest random priority and edges proposed from both ends match.
+
+    Returns
+    -------
+    np.ndarray
+        coarse node of every node
+    int
+        number of coarse nodes
+    """
+    matched = np.zeros(n_nodes, dtype=bool)
+    parent = np.arange(n_nodes)
+    for _ in range(rounds):
+        free = edges[~matched[edges[:, 0]] & ~matched[edges[:, 1]]]
+        free = free[free[:, 0] != free[:, 1]]
+        if not len(free):
+            break
+        priority = rng.random(len(free)) / (weights[free[:, 0]] + weights[free[:, 1]])
+        best = np.zeros(n_nodes)
+        np.maximum.at(best, free[:, 0], priority)
+        np.maximum.at(best, free[:, 1], priority)
+        pairs = free[(best[free[:, 0]] == priority) & (best[free[:, 1]] == priority)]
+        matched[pairs.ravel()] = True
+        parent[pairs[:, 1]] = pairs[:, 0]
+    coarse_nodes, parent = np.unique(parent, return_inverse=True)
+    return parent.reshape(-1), len(coarse_nodes)
+
+def _multilevel_positions(n_nodes, edges, rng, coarsest=50, dense=300, iterations=30):
+    """
+    Multilevel force layout of a graph given as arrays.
+
+    The graph is coarsened by matchings until at most `coarsest`
+    nodes are left or it stops shrinking. The coarsest graph is
+    laid out with repulsion between all nodes, and every finer level
+    starts from the positions of its coarse nodes and is refined by
+    `iterations` force steps with grid based repulsion between close
+    nodes only (all pairs below `dense` nodes). As the levels shrink
+    geometrically, the cost grows about linearly with the graph.
+
+    Returns
+    -------
+    np.ndarray
+        (N, 2) positions
+    float
+        the edge length of the layout
+    """
+    levels = []
+    weights = np.ones(n_nodes)
+    size, level_edges = n_nodes, edges
+    while size > coarsest:
+        parent, coarse_size = _coarsen(size, level_edges, weights, rng)
+        if coarse_size > 0.95 * size:
+            break
+        levels.append((parent, size, level_edges))
+        weights = np.bincount(parent, weights, coarse_size)
+        level_edges = np.unique(np.sort(parent[level_edges], axis=1), axis=0)
+        level_edges = level_edges[level_edges[:, 0] != level_edges[:, 1]]
+        size = coarse_size
+
+    length = 1.
+    extent = np.sqrt(size) * length
+    positions = rng.uniform(-extent / 2, extent / 2, size=(size, 2))
+    cutoff = None if size <= dense else 2 * length
+    _force_steps(positions, level_edges, length, 10 * iterations, extent / 4, cutoff)
+    for parent, fine_size, fine_edges in reversed(levels):
+        # keep the area per node about constant
+        length *= np.sqrt(size / fine_size)
+        positions = positions[parent] + rng.normal(scale=0.1 * length, size=(fine_size, 2))
+        cutoff = None if fine_size <= dense else 2 * length
+        _force_steps(positions, fine_edges, length, iterations, length, cutoff)
+        size = fine_size
+    return positions, length
+
+def multilevel_layout(graph, coordinates=None, nodes=None, seed=None, **kwargs):
+    """
+    Lay out all nodes of `graph` with a multilevel force layout, which
+    scales about linearly with the size of the graph in contrast to
+    Kamada-Kawai. Like :func:`_kamada_kawai_layout`, `coordinates`
+    and `nodes` are ignored. See :func:`_multilevel_positions`.
+    """
+    nodes, edges = _graph_arrays(graph)
+    if not nodes:
+        return {}
+    positions, _ = _multilevel_positions(len(nodes), edges, np.random.default_rng(seed))
+    return dict(zip(nodes, nx.rescale_layout(positions, scale=1)))
+
+def _place_component(graph, coords, component, length, initial_layout, rng):
+    """
+    Lay out the new nodes of `component`, a :class:`networkx.Graph`,
+    on their own with the `initial_layout` and add them to `coords`.
+    A component linked to placed nodes of `graph` is turned away from
+    the drawing at its link; others go right of the drawing.
+    """
+    nodes = list(component.nodes)
+    component_coords = LAYOUTS[initial_layout](component)
+    positions = np.array([component_coords[node] for node in nodes])
+    lengths = [np.linalg.norm(component_coords[ndxA] - component_coords[ndxB])
+               for ndxA, ndxB in islice(component.edges, 64)]
+    if lengths:
+        positions *= length / max(np.median(lengths), 1e-12)
+
+    placed = np.array(list(coords.values())).reshape(-1, 2)
+    linked = next(((idx, anchor) for idx, node in enumerate(nodes)
+                   for anchor in graph.neighbors(node) if anchor in coords), None)
+    if linked is None:
+        right = placed[:, 0].max() if len(placed) else 0.
+        ycenter = placed[:, 1].mean() if len(placed) else 0.
+        positions += [right + length - positions[:, 0].min(), ycenter - positions[:, 1].mean()]
+    else:
+        idx, anchor = linked
+        outward = coords[anchor] - placed.mean(axis=0)
+        if not np.any(outward):
+            outward = rng.normal(size=2)
+        inward = positions.mean(axis=0) - positions[idx]
+        angle = np.arctan2(outward[1], outward[0]) - np.arctan2(inward[1], inward[0])
+        rotation = np.array([[np.cos(angle), -np.sin(angle)],
+                             [np.sin(angle), np.cos(angle)]])
+        positions = (positions - positions[idx]) @ rotation.T
+        positions += _step(coords[anchor], outward, length, rng)
+    coords.update(zip(nodes, positions))
+
+def _components(graph, nodes):
+    """
+    Connected components of the part of `graph` spanned by `nodes`,
+    each as :class:`networkx.Graph`.
+    """
+    subgraph = nx.Graph()
+    subgraph.add_nodes_from(nodes)
+    subgraph.add_edges_from((ndxA, ndxB) for ndxA, ndxB in graph.edges(nbunch=nodes)
+                            if ndxA in subgraph and ndxB in subgraph)
+    return [subgraph.subgraph(component) for component in nx.connected_components(subgraph)]
+
+def incremental_layout(graph, coordinates=None, nodes=None, iterations=50, relax=0., seed=None,
+                       initial_layout=None, initial_size=100):
+    """
+    Extend an existing layout by placing only the nodes that changed.
+    Nodes that already have coordinates stay pinned, unless `relax` is
+    larger than zero, in which case the placed neighbours of the new nodes
+    follow a fraction of their forces. The cost of each call scales with
+    the number of new nodes and a fixed iteration budget instead of the
+    size of the whole graph.
+
+    Parameters
+    ----------
+    graph: :class:`networkx.Graph`
+    coordinates: dict
+        node to coordinate mapping of the current layout
+    nodes: list
+        nodes to (re)place; defaults to all nodes without coordinates
+    iterations: int
+        number of force steps
+    relax: float
+        fraction of the force applied to pinned neighbours
+    seed: int
+    initial_layout: str
+        one of :data:`LAYOUTS`; if given, connected groups of at
+        least `initial_size` new nodes are laid out on their own
+        with it and then attached to the drawing as a whole, instead
+        of being grown node by node, which is slow for large groups
+    initial_size: int
+
+    Returns
+    -------
+    dict
+        node to coordinate mapping of all nodes in `graph`
+    """
+    coords = {} if coordinates is None else coordinates
+    if coords.keys() - graph.nodes:
+        coords = {node: pos for node, pos in coords.items() if node in graph}
+    else:
+        coords = dict(coords)
+
+    if nodes is None:
+        moving = [node for node in graph.nodes if node not in coords]
+    else:
+        moving = [node for node in nodes if node in graph]
+        for node in moving:
+            coords.pop(node, None)
+    if not moving:
+        return coords
+
+    moving_set = set(moving)
+    context = {neighbour for node in moving for neighbour in graph.neighbors(node)
+               if neighbour not in moving_set}
+    rng = np.random.default_rng(seed)
+    length = _edge_length(graph, coords, moving_set, context)
+    if initial_layout is not None and len(moving) >= initial_size:
+        for component in _components(graph, moving):
+            if len(component) >= initial_size:
+                _place_component(graph, coords, component, length, initial_layout, rng)
+        moving = [node for node in moving if node not in coords]
+        moving_set = set(moving)
+        context = {neighbour for node in moving for neighbour in graph.neighbors(node)
+                   if neighbour not in moving_set}
+    if moving:
+        _seed_positions(graph, coords, moving, length, rng)
+        _relax_positions(graph, coords, moving, context, length, iterations, relax)
+
+    # keep the drawing within the unit box like the full layouts; leave
+    # some room so that the next few blocks don't trigger a rescale
+    positions = np.array(list(coords.values()))
+    if np.abs(positions).max() > 1.:
+        positions = nx.rescale_layout(positions, scale=0.75)
+        coords = dict(zip(coords.keys(), positions))
+    return coords
+
+LAYOUTS = {"kamada_kawai": _kamada_kawai_layout,
+           "incremental": incremental_layout,
+           "multilevel": multilevel_layout,}
+
+def style_table(graph, nodes, colors, methods):
+    """
+    The fill color and canvas method of the pictograms of `nodes`
+    based on their resname. Styles are looked up once per resname,
+    for a :class:`polyply_gui.molecule_graph.MoleculeGraph` straight
+    from the codes of its resname column.
+
+    Returns
+    -------
+    list
+        (color, method name) of every distinct resname
+    np.ndarray
+        the index of the style of every node
+    """
+    if hasattr(graph, "columns"):
+        column = graph.columns["resname"]
+        resnames = column.categories + [None]
+        codes = column.codes[np.asarray(nodes, dtype=np.int64)]
+        # unset resnames, coded -1, get the style of None
+        codes = np.where(codes < 0, len(resnames) - 1, codes)
+    else:
+        index = {}
+        codes = np.array([index.setdefault(graph.nodes[node].get("resname"), len(index))
+                          for node in nodes], dtype=np.int64)
+        resnames = list(index)
+    styles = [(colors.get(resname, 'gray'), methods.get(resname, 'draw_circle')) for resname in resnames]
+    return styles, codes
+
+def _edge_array(graph, nodes=None):
+    """
+    The edges of `graph`, or only those touching `nodes`, as (E, 2) array.
+    """
+    if hasattr(graph, "edge_array"):
+        return graph.edge_array(nodes)
+    edges = graph.edges() if nodes is None else graph.edges(nodes)
+    return np.array(list(edges)).reshape(-1, 2)
+
+def _polylines(edges, max_edges=256):
+    """
+    Split the rows of `edges` into runs in which every edge starts
+    where the one before ends, such as the residues of a chain, so
+    each run can be drawn as one line through its nodes. Runs are
+    cut after `max_edges` edges to bound what is redrawn when one
+    of their nodes moves.
+
+    Returns
+    -------
+    np.ndarray
+        the first row of every run and, last, the number of rows
+    """
+    if not len(edges):
+        return np.zeros(1, dtype=np.int64)
+    rows = np.arange(len(edges))
+    starts = np.ones(len(edges), dtype=bool)
+    starts[1:] = edges[1:, 0] != edges[:-1, 1]
+    run_start = np.maximum.accumulate(np.where(starts, rows, 0))
+    starts |= (rows - run_start) % max_edges == 0
+    return np.append(np.flatnonzero(starts), len(edges))
+
+def _edge_key(ndxA, ndxB):
+    """
+    Orientation independent key of an edge.
+    """
+    return (ndxA, ndxB) if ndxA <= ndxB else (ndxB, ndxA)
+
+def _draw_lines(canvas, edges, coords, location):
+    """
+    Draw `edges` with as few lines as :func:`_polylines` allows,
+    below the node pictograms, where `location` maps an (N, 2)
+    array of layout coordinates to the canvas.
+
+    Returns
+    -------
+    list
+        the figure id and the rows of `edges` of every line
+    """
+    if not len(edges):
+        return []
+    nodes, inverse = np.unique(edges, return_inverse=True)
+    points = location(np.array([coords[node] for node in nodes.tolist()], dtype=float))
+    points = points[inverse.reshape(-1)].reshape(-1, 2, 2)
+    bounds = _polylines(edges)
+    lines = []
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        line = np.concatenate([points[start:stop, 0], points[stop-1:stop, 1]]).tolist()
+        figure = canvas.draw_lines(line, color='black')
+        # keep lines below the node pictograms
+        canvas.send_figure_to_back(figure)
+        lines.append((figure, range(start, stop)))
+    return lines
+
+def _scale_figures(canvas, origin, factor):
+    """
+    Scale all figures on `canvas` by `factor` around `origin`,
+    which is given in the user coordinates of the graph element.
+    """
+    xorigin, yorigin = canvas._convert_xy_to_canvas_xy(*origin)
+    canvas.TKCanvas.scale('all', xorigin, yorigin, factor, factor)
+
+class GraphScene():
+    """
+    Retained drawing of a graph on a :class:`sg.Graph` canvas.
+
+    The scene keeps the figure ids returned by the canvas for every
+    node and edge. Edges are drawn as few multi-segment lines, one
+    per run of chained edges; a line is redrawn as a whole once any
+    of its edges changes. Panning moves all figures at once, zooming
+    scales the stored figures and structural edits only create or
+    delete the figures of the nodes and edges that changed.
+
+    Only nodes inside the canvas get figures; they are looked up in a
+    :class:`GridIndex` over the layout coordinates. Once nodes become
+    smaller than `lod_radius` pixels and the blocks are known, every
+    block is drawn as a single super-node instead, with one line for
+    each pair of linked blocks.
+
+    Nodes can be picked by their location on the canvas, which is
+    mapped back to layout coordinates and looked up in the same
+    index, so the index stays valid under pan and zoom. Selected
+    nodes are highlighted by a ring.
+    """
+
+    def __init__(self,
+                 canvas,
+                 canvas_center,
+                 padding=0.12,
+                 radius_scale=80,
+                 colors={},
+                 methods={},
+                 lod_radius=1.):
+        self.canvas = canvas
+        self.canvas_center = canvas_center
+        self.padding = padding
+        self.move = (0, 0)
+        self.radius_scale = radius_scale
+        self.colors = colors
+        self.methods = methods
+        self.lod_radius = lod_radius
+        self.graph = None
+        self.coords = {}
+        self.blocks = []
+        self.index = None
+        self.radius = None
+        self.lod = False
+        # node -> (figure id, coordinate it was drawn at)
+        self.node_figures = {}
+        # edge key -> figure id of the line the edge is part of
+        self.edge_figures = {}
+        # figure id of a line -> keys of its edges
+        self.line_edges = {}
+        # block index -> figure id of the super-node
+        self.block_figures = {}
+        # block index pair -> figure id of the aggregate edge
+        self.block_edge_figures = {}
+        self.selected = []
+        self.selection_figures = []
+
+    @property
+    def scale(self):
+        """
+        Ratio of the current zoom to the default padding.
+        """
+        return (1 - self.padding) / (1 - 0.12)
+
+    def _location(self, coord):
+        return _scale_coords(coord, self.canvas_center, padding=self.padding, move=self.move)
+
+    def _locations(self, coords):
+        return _scale_array(coords, self.canvas_center, padding=self.padding, move=self.move)
+
+    def to_layout(self, location):
+        """
+        Layout coordinate of a `location` on the canvas at the
+        current pan and zoom; the inverse of :meth:`_location`.
+        """
+        center = np.asarray(self.canvas_center, dtype=float)
+        return (np.asarray(location, dtype=float) - center + self.move) / ((1 - self.padding) * center)
+
+    def pick(self, location, tolerance=2):
+        """
+        The node drawn at `location`, i.e. within its radius plus
+        `tolerance` pixels, or None. While blocks are shown as
+        super-nodes, no nodes can be picked.
+        """
+        if self.index is None or self.lod or not len(self.index):
+            return None
+        pixel_scale = (1 - self.padding) * np.asarray(self.canvas_center, dtype=float)
+        max_dist = (self.radius * self.scale + tolerance) / pixel_scale.min()
+        idx = self.index.nearest(self.to_layout(location), max_dist)
+        return None if idx is None else self.index.keys[idx]
+
+    def select(self, nodes):
+        """
+        Highlight `nodes` as selected.
+        """
+        self.selected = list(nodes)
+        self._draw_selection()
+
+    def _draw_selection(self):
+        for figure in self.selection_figures:
+            self.canvas.delete_figure(figure)
+        self.selection_figures = []
+        if self.lod or self.radius is None:
+            return
+        for node in self.selected:
+            if node in self.coords:
+                figure = self.canvas.draw_circle(radius=self.radius * self.scale + 3,
+                                                 center_location=self._location(self.coords[node]),
+                                                 fill_color=None, line_color='red', line_width=2)
+                self.selection_figures.append(figure)
+
+    def _use_lod(self):
+        return bool(self.blocks) and self.radius * self.scale < self.lod_radius
+
+    def _visible_nodes(self):
+        """
+        Nodes whose pictogram overlaps with the canvas.
+        """
+        if self.index is None:
+            return set(self.graph.nodes)
+        center = np.asarray(self.canvas_center, dtype=float)
+        factor = (1 - self.padding) * center
+        margin = self.radius * self.scale
+        cornerA = (np.asarray(self.move) - center - margin) / factor
+        cornerB = (np.asarray(self.move) + center + margin) / factor
+        lower, upper = np.minimum(cornerA, cornerB), np.maximum(cornerA, cornerB)
+        if self.index.covers(lower, upper):
+            return set(self.index.keys)
+        return {self.index.keys[idx] for idx in self.index.query_box(lower, upper)}
+
+    def _draw_nodes(self, nodes):
+        """
+        Draw the pictograms of `nodes`.
+        """
+        if not nodes:
+            return
+        coords = [self.coords[node] for node in nodes]
+        locations = self._locations(np.array(coords, dtype=float)).tolist()
+        styles, codes = style_table(self.graph, nodes, self.colors, self.methods)
+        methods = [(getattr(self.canvas, method), color) for color, method in styles]
+        radius = self.radius * self.scale
+        for node, coord, location, code in zip(nodes, coords, locations, codes.tolist()):
+            method, color = methods[code]
+            figure = method(radius=radius, center_location=location, fill_color=color)
+            self.node_figures[node] = (figure, coord)
+
+    def _draw_edges(self, edges, keys):
+        """
+        Draw the rows of `edges`, whose keys are `keys`, as lines.
+        """
+        for figure, rows in _draw_lines(self.canvas, edges, self.coords, self._locations):
+            line_keys = keys[rows.start:rows.stop]
+            self.line_edges[figure] = line_keys
+            self.edge_figures.update(dict.fromkeys(line_keys, figure))
+
+    def _delete_lines(self, keys):
+        """
+        Delete the lines that draw any of the edges `keys`, along
+        with the other edges on these lines.
+        """
+        figures = {self.edge_figures.get(key) for key in keys}
+        figures.discard(None)
+        for figure in figures:
+            self.canvas.delete_figure(figure)
+            for key in self.line_edges.pop(figure):
+                del self.edge_figures[key]
+
+    def _draw_blocks(self):
+        """
+        Draw every block as one super-node at the centroid of its
+        residues and one line per pair of linked blocks.
+        """
+        members = [(idx, [node for node in block if node in self.coords])
+                   for idx, block in enumerate(self.blocks)]
+        members = [(idx, nodes) for idx, nodes in members if nodes]
+        if not members:
+            return
+        sizes = np.array([len(nodes) for _, nodes in members])
+        nodes = np.concatenate([nodes for _, nodes in members])
+        coords = np.array([self.coords[node] for node in nodes.tolist()], dtype=float)
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        locations = self._locations(np.add.reduceat(coords, offsets) / sizes[:, None]).tolist()
+
+        row_of = np.full(nodes.max() + 1, -1, dtype=np.int64)
+        row_of[nodes] = np.repeat(np.arange(len(members)), sizes)
+        edges = _edge_array(self.graph)
+        edges = edges[(edges <= nodes.max()).all(axis=1)]
+        pairs = row_of[edges]
+        pairs = pairs[(pairs >= 0).all(axis=1) & (pairs[:, 0] != pairs[:, 1])]
+        for rowA, rowB in np.unique(np.sort(pairs, axis=1), axis=0).tolist():
+            figure = self.canvas.draw_line(point_from=locations[rowA], point_to=locations[rowB],
+                                           color='black')
+            self.block_edge_figures[(members[rowA][0], members[rowB][0])] = figure
+
+        styles, codes = style_table(self.graph, nodes[offsets], self.colors, self.methods)
+        radii = np.maximum(2 * self.lod_radius, self.radius * self.scale * np.sqrt(sizes))
+        for (idx, _), location, code, radius in zip(members, locations, codes.tolist(), radii.tolist()):
+            color, method = styles[code]
+            figure = getattr(self.canvas, method)(radius=radius, center_location=location,
+                                                  fill_color=color)
+            self.block_figures[idx] = figure
+
+    def _sync_nodes(self, moved=(), view_only=False):
+        """
+        Create and delete node and edge figures such that exactly
+        the visible nodes and their edges are drawn. Edges of `moved`
+        nodes are drawn anew. With `view_only` the graph is the one
+        drawn last, so nothing changes as long as the same nodes are
+        visible.
+        """
+        visible = self._visible_nodes()
+        if view_only and visible == self.node_figures.keys():
+            return
+        for node in self.node_figures.keys() - visible:
+            self.canvas.delete_figure(self.node_figures.pop(node)[0])
+
+        if len(visible) == len(self.graph.nodes):
+            edges = _edge_array(self.graph)
+        else:
+            edges = _edge_array(self.graph, visible)
+        keys = list(map(tuple, np.sort(edges, axis=1).tolist()))
+        stale = self.edge_figures.keys() - set(keys)
+        if moved:
+            touched = np.isin(edges, np.fromiter(moved, dtype=np.int64)).any(axis=1)
+            stale.update(key for key, is_touched in zip(keys, touched.tolist()) if is_touched)
+        self._delete_lines(stale)
+        if self.edge_figures:
+            new = np.fromiter((key not in self.edge_figures for key in keys), dtype=bool, count=len(keys))
+            edges = edges[new]
+            keys = [key for key, is_new in zip(keys, new.tolist()) if is_new]
+        self._draw_edges(edges, keys)
+
+        self._draw_nodes(list(visible - self.node_figures.keys()))
+
+    def redraw(self):
+        """
+        Erase the canvas and draw all figures anew at the exact
+        current view.
+        """
+        self.canvas.erase()
+        self.node_figures = {}
+        self.edge_figures = {}
+        self.line_edges = {}
+        self.block_figures = {}
+        self.block_edge_figures = {}
+        self.selection_figures = []
+        if not self.graph or not len(self.graph.nodes):
+            return
+        self.radius = 1/np.sqrt(len(self.graph.nodes)) * self.radius_scale
+        self.lod = self._use_lod()
+        if self.lod:
+            self._draw_blocks()
+        else:
+            self._sync_nodes()
+        self._draw_selection()
+
+    def relabel(self, relabel):
+        """
+        Follow a renumbering of the nodes, given as array of the new
+        id of every old one, or -1 for removed ones. The figures are
+        drawn anew by the next :meth:`render`.
+        """
+        self.selected = [int(relabel[node]) for node in self.selected if relabel[node] >= 0]
+        self.radius = None
+
+    def render(self, graph, coords, blocks=None):
+        """
+        Bring the figures in sync with `graph` and `coords`. Only
+        figures of added, removed or moved nodes and of their edges
+        are touched. When the node count changed so much that the
+        node radius is off by more than 25%, everything is redrawn,
+        as are the super-nodes when the blocks are shown.
+        """
+        self.graph = graph
+        self.coords = coords
+        if blocks is not None:
+            self.blocks = blocks
+        self.index = GridIndex(coords.keys(), list(coords.values())) if coords else None
+        if not len(graph.nodes):
+            self.redraw()
+            return
+        radius = 1/np.sqrt(len(graph.nodes)) * self.radius_scale
+        if self.radius is None or not 0.8 < radius / self.radius < 1.25\
+            or self.lod or self._use_lod():
+            self.redraw()
+            return
+
+        moved = set()
+        pixel_scale = (1 - self.padding) * np.asarray(self.canvas_center)
+        for node, (figure, drawn_at) in self.node_figures.items():
+            coord = coords.get(node)
+            if coord is None or coord is drawn_at or np.array_equal(coord, drawn_at):
+                continue
+            deltax, deltay = (coord - drawn_at) * pixel_scale
+            self.canvas.move_figure(figure, deltax, deltay)
+            self.node_figures[node] = (figure, coord)
+            moved.add(node)
+        self._sync_nodes(moved)
+        self._draw_selection()
+
+    def _update_view(self):
+        """
+        Follow up on a pan or zoom: switch the level of detail if
+        needed and draw the nodes that came into view.
+        """
+        if self.graph is None or self.radius is None:
+            return
+        if self._use_lod() != self.lod:
+            self.redraw()
+        elif not self.lod:
+            self._sync_nodes(view_only=True)
+
+    def pan(self, move):
+        """
+        Shift the view to the offset `move` by moving all figures at once.
+        """
+        deltax, deltay = self.move[0] - move[0], self.move[1] - move[1]
+        self.move = tuple(move)
+        self.canvas.move(deltax, deltay)
+        self._update_view()
+
+    def zoom(self, padding):
+        """
+        Change the zoom to `padding` by scaling all stored figures around
+        the current center of the drawing.
+        """
+        old_scale = 1 - self.padding
+        self.padding = padding
+        factor = (1 - padding) / old_scale if old_scale else 0
+        if factor <= 0:
+            self.redraw()
+            return
+        origin = (self.canvas_center[0] - self.move[0], self.canvas_center[1] - self.move[1])
+        _scale_figures(self.canvas, origin, factor)
+        self._update_view()
+
 def draw_graph(canvas,
                graph,
                canvas_center,
@@ -22,39 +882,56 @@ def draw_graph(canvas,
                radius_scale=80,
                colors={},
                methods={},
-               coordinates=None):
+               coordinates=None,
+               layout="kamada_kawai",
+               update_nodes=None,
+               scene=None,
+               blocks=None,
+               initial_layout=None):
     """
     Draw a graph anew on an existing canvas object.
     To zoom in add a negative padding to the coordinates and to zoom out
-    a higher than default padding.
+    a higher than default padding. The `layout` selects the method used
+    to generate coordinates; with 'incremental' only the `update_nodes`
+    (or all nodes without coordinates) are placed, large groups of new
+    nodes with the `initial_layout` if given. If a :class:`GraphScene`
+    is given, the canvas is not erased but only the changed figures are
+    updated; the view is then defined by the scene, which may
+    collapse the `blocks` into super-nodes when zoomed out.
     """
-    # erease old canvas
-    canvas.erase()
     # get the layout
     if gen_coords:
-        coord_dict = nx.kamada_kawai_layout(graph, pos=coordinates)
+        with span("layout", "draw_graph", layout=layout):
+            options = {"initial_layout": initial_layout} if initial_layout else {}
+            coord_dict = LAYOUTS[layout](graph, coordinates=coordinates, nodes=update_nodes, **options)
     else:
         coord_dict = coordinates
+    if scene is not None:
+        with span("render", "draw_graph"):
+            scene.render(graph, coord_dict, blocks=blocks)
+        return coord_dict
+    with span("draw", "draw_graph"):
+        _draw_all(canvas, graph, coord_dict, canvas_center, move, padding, radius_scale, colors, methods)
+    return coord_dict
+
+def _draw_all(canvas, graph, coord_dict, canvas_center, move, padding, radius_scale, colors, methods):
+    """
+    Erase the canvas and draw every node and edge of `graph`.
+    """
+    # erease old canvas
+    canvas.erase()
     radius = 1/np.sqrt(len(graph.nodes)) * radius_scale
+    def _locations(coords):
+        return _scale_array(coords, canvas_center, padding=padding, move=move)
     # draw lines connecting nodes
-    for ndxA, ndxB in graph.edges():
-        coordA = _scale_coords(coord_dict[ndxA], canvas_center, padding=padding, move=move)
-        coordB = _scale_coords(coord_dict[ndxB], canvas_center, padding=padding, move=move)
-        canvas.draw_line(point_from=coordA, point_to=coordB, color='black')
+    _draw_lines(canvas, _edge_array(graph), coord_dict, _locations)
     # draw node pictograms
-    for node, coord in coord_dict.items():
-        location = _scale_coords(coord, canvas_center, padding=padding, move=move)
-
-        # use custom node color
-        try:
-            color=colors[graph.nodes[node]["resname"]]
-        except KeyError:
-            color='gray'
-
-        # use custom node drawing method
-        try:
-           method = getattr(canvas, methods[graph.nodes[node]["resname"]])
-           method(radius=radius, center_location=location, fill_color=color)
-        except KeyError:
-           canvas.draw_circle(radius=radius, center_location=location, fill_color=color)
-    return coord_dict
+    nodes = list(coord_dict)
+    if not nodes:
+        return
+    locations = _locations(np.array(list(coord_dict.values()), dtype=float)).tolist()
+    styles, codes = style_table(graph, nodes, colors, methods)
+    methods = [(getattr(canvas, method), color) for color, method in styles]
+    for location, code in zip(locations, codes.tolist()):
+        method, color = methods[code]
+        method(radius=radius, center_location=location, fill_color=color)
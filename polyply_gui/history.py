@@ -0,0 +1,96 @@
+from collections import deque
+
+class Edit():
+    """
+    Journal entry of one edit: functions to revert and to repeat
+    it, and an estimate of the memory the entry keeps alive. The
+    functions find the residues they act on in the array `nodes`,
+    which is relabelled in place when the graph is compacted, and
+    keep what they need between calls in the dict `state`.
+    """
+
+    def __init__(self, description, undo, redo, nbytes=0, nodes=None, state=None):
+        self.description = description
+        self.undo = undo
+        self.redo = redo
+        self.nbytes = nbytes
+        self.nodes = nodes
+        self.state = state if state is not None else {}
+
+class History():
+    """
+    Undo and redo stacks of :class:`Edit` entries.
+
+    An entry does not copy the editor state but only holds what is
+    needed to invert its edit, e.g. the tombstoned block of a removal,
+    so it costs memory in proportion to what changed. Once the entries
+    hold more than `max_bytes`, the oldest undo entries are dropped.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.undo_stack = deque()
+        self.redo_stack = []
+
+    def push(self, edit):
+        """
+        Record a new edit; this clears the redo stack.
+
+        Returns
+        -------
+        list[:class:`Edit`]
+            the entries dropped from the redo stack and the cap
+        """
+        self.undo_stack.append(edit)
+        self.nbytes += edit.nbytes
+        dropped = self.redo_stack
+        self.redo_stack = []
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            dropped.append(self.undo_stack.popleft())
+        for entry in dropped:
+            self.nbytes -= entry.nbytes
+        return dropped
+
+    def entries(self):
+        """
+        All entries that can still be undone or redone.
+        """
+        return list(self.undo_stack) + self.redo_stack
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        """
+        Revert the latest edit.
+
+        Returns
+        -------
+        :class:`Edit`
+        """
+        edit = self.undo_stack.pop()
+        edit.undo()
+        self.redo_stack.append(edit)
+        return edit
+
+    def redo(self):
+        """
+        Repeat the latest undone edit.
+
+        Returns
+        -------
+        :class:`Edit`
+        """
+        edit = self.redo_stack.pop()
+        edit.redo()
+        self.undo_stack.append(edit)
+        return edit
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
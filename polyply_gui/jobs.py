@@ -0,0 +1,202 @@
+import io
+import os
+import time
+import itertools
+import logging
+import contextlib
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+# queue for log lines; set in every worker process by the initializer
+_LOG_QUEUE = None
+# cancel flags of the jobs by job id modulo their number; shared
+# with the worker processes through the initializer
+_N_FLAGS = 4096
+_CANCELLED = None
+
+def _init_worker(log_queue, cancelled):
+    global _LOG_QUEUE, _CANCELLED
+    _LOG_QUEUE = log_queue
+    _CANCELLED = cancelled
+
+class _QueueStream(io.TextIOBase):
+    """
+    File like object that puts every complete line written
+    to it on the log queue, tagged with the job id.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            _LOG_QUEUE.put((self.job_id, line))
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            _LOG_QUEUE.put((self.job_id, self.buffer))
+            self.buffer = ""
+
+class _QueueHandler(logging.Handler):
+    """
+    Logging handler forwarding records to a :class:`_QueueStream`.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def emit(self, record):
+        self.stream.write(self.format(record) + '\n')
+
+def _run_job(job_id, function, args, kwargs, output=None):
+    """
+    Run `function` in a worker process while streaming its stderr,
+    stdout and log records to the log queue. With an `output` path
+    the function writes to a temporary file as `outpath`, which
+    replaces `output` only if the job was not cancelled meanwhile.
+    """
+    stream = _QueueStream(job_id)
+    handler = _QueueHandler(stream)
+    logger = logging.getLogger()
+    logger.addHandler(handler)
+    if output is not None:
+        tmp_path = "{}.{}.tmp".format(output, os.getpid())
+        kwargs = dict(kwargs, outpath=tmp_path)
+    try:
+        with contextlib.redirect_stderr(stream), contextlib.redirect_stdout(stream):
+            result = function(*args, stream=stream, **kwargs)
+        if output is not None and not _CANCELLED[job_id % _N_FLAGS]:
+            os.replace(tmp_path, output)
+        return result
+    finally:
+        logger.removeHandler(handler)
+        stream.flush()
+        if output is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class Job():
+    """
+    Bookkeeping of a submitted job.
+    """
+
+    def __init__(self, job_id, description, future, name=""):
+        self.job_id = job_id
+        self.description = description
+        self.future = future
+        self.name = name
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+
+    def __str__(self):
+        return "{} {}".format(self.job_id, self.description)
+
+class JobRunner():
+    """
+    Runs jobs such as itp generation in a pool of worker processes,
+    so that they neither block the GUI nor share global state with it.
+    Every job gets an id and its output is streamed line by line through
+    a queue, which the GUI drains with :meth:`poll`.
+
+    Jobs that have not started yet are cancelled right away. A running
+    polyply call cannot be interrupted; its job is flagged as cancelled
+    and any further output and result are discarded, including the
+    file it was to write if submitted with an `output` path.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._cancelled = set()
+        self._executor = None
+        self._log_queue = None
+        self._cancel_flags = None
+
+    def _start(self):
+        # the pool is only started once the first job comes in
+        context = multiprocessing.get_context('spawn')
+        self._log_queue = context.Queue()
+        self._cancel_flags = context.RawArray('b', _N_FLAGS)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=context,
+                                             initializer=_init_worker,
+                                             initargs=(self._log_queue, self._cancel_flags))
+
+    def submit(self, function, *args, description="", output=None, **kwargs):
+        """
+        Run `function(*args, stream=stream, **kwargs)` in the pool,
+        where `stream` is a file like object that feeds the log. If
+        the function writes the file `output`, it is passed as
+        keyword `outpath`, see :func:`_run_job`.
+
+        Returns
+        -------
+        int
+            the job id
+        """
+        if self._executor is None:
+            self._start()
+        job_id = next(self._ids)
+        self._cancel_flags[job_id % _N_FLAGS] = 0
+        future = self._executor.submit(_run_job, job_id, function, args, kwargs, output)
+        self.jobs[job_id] = Job(job_id, description, future, name=function.__name__)
+        return job_id
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Returns True if the job was not running yet.
+        """
+        job = self.jobs[job_id]
+        job.cancelled = True
+        self._cancelled.add(job_id)
+        self._cancel_flags[job_id % _N_FLAGS] = 1
+        return job.future.cancel()
+
+    def active(self):
+        """
+        The jobs that have not finished yet.
+        """
+        return [job for job in self.jobs.values() if not job.future.done()]
+
+    def poll(self):
+        """
+        Collect the log lines produced since the last call and
+        the jobs that finished in the meantime.
+
+        Returns
+        -------
+        list[tuple(int, str)]
+            job id and log line
+        list[Job]
+            finished jobs, which are removed from the runner
+        """
+        lines = []
+        if self._log_queue is not None:
+            while True:
+                try:
+                    job_id, line = self._log_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job_id not in self._cancelled:
+                    lines.append((job_id, line))
+
+        finished = [job for job in self.jobs.values() if job.future.done()]
+        for job in finished:
+            del self.jobs[job.job_id]
+        return lines, finished
+
+    def shutdown(self):
+        if self._executor is not None:
+            # cancel_futures of shutdown needs python 3.9
+            for job in self.jobs.values():
+                job.future.cancel()
+            self._executor.shutdown(wait=False)
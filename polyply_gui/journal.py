@@ -0,0 +1,324 @@
+"""
+Autosave of the building session as a checkpoint plus a journal.
+
+Every edit of a :class:`polyply_gui.builder.GraphBuilder` appends its
+operation and arguments as one json line to `journal.jsonl`. Lines
+are buffered and written with an fsync once `batch_size` of them are
+pending or the oldest waited `max_delay` s. Every `checkpoint_every`
+entries the whole session is written to `checkpoint.json` and the
+journal starts over, so recovering never replays a long history.
+
+Entries are numbered and the checkpoint stores the number of the
+last entry it includes; a journal left over from a crash between
+writing the checkpoint and clearing the journal is thus skipped.
+A torn last line of a crash during a write is dropped.
+
+Residues are addressed by block and resid, like the user sees them,
+and random attributes come from the generator of the builder, whose
+state is in the checkpoint, so replaying the journal on the restored
+checkpoint repeats the session. Operations the replay can not repeat
+are written as checkpoint instead: loading a file, which may have
+changed since, and undoing or redoing edits from before the latest
+checkpoint.
+
+A session directory is saved to by one process at a time, which
+holds an exclusive lock on its `lock` file.
+"""
+import os
+import json
+import time
+from pathlib import Path
+import numpy as np
+from .cache_utils import user_cache_dir
+from .molecule_graph import split_resnames
+
+# operations whose replay depends on more than the session
+_CHECKPOINT_OPS = {"load_file"}
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _try_lock(file_handle):
+    """
+    Take an exclusive lock on the open `file_handle` without waiting.
+    Raises OSError if another process holds it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # windows
+        import msvcrt
+        msvcrt.locking(file_handle.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(file_handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def snapshot(builder):
+    """
+    Everything needed to restore the state of a builder, apart from
+    its undo history, as json compatible dict.
+    """
+    graph = builder.graph
+    blocks = []
+    for block_id, block in graph.blocks.items():
+        resnames, attributes = split_resnames(graph.decode(np.arange(block.start, block.stop)))
+        blocks.append({"name": block.name,
+                       "label": list(builder.labels[block_id]),
+                       "resnames": resnames,
+                       "attributes": attributes,
+                       "edges": graph.block_edges(block_id).tolist()})
+
+    # links as block and resid counting from 1
+    links = graph.link_array()
+    block_idx = np.zeros(max(graph.blocks, default=-1) + 1, dtype=np.int64)
+    block_idx[graph.block_ids] = np.arange(1, len(graph.blocks) + 1)
+    starts = np.array([block.start for block in graph.blocks.values()], dtype=np.int64)
+    rows = block_idx[graph.block_of(links)]
+    resids = links - starts[rows - 1] + 1
+    pairs = np.stack([rows, resids], axis=-1).reshape(-1, 4)
+
+    state = {"force_field": builder.force_field,
+             "rng": builder.rng.bit_generator.state,
+             "blocks": blocks,
+             "links": pairs.tolist(),
+             "positions": None}
+    if builder.coords:
+        positions = [builder.coords.get(node) for node in graph.node_array().tolist()]
+        state["positions"] = [None if position is None else [float(position[0]), float(position[1])]
+                              for position in positions]
+    return state
+
+def restore_snapshot(builder, state):
+    """
+    Rebuild the state of a :func:`snapshot` in an empty builder.
+    The restored blocks can not be undone.
+    """
+    builder.force_field = state["force_field"]
+    builder.rng.bit_generator.state = state["rng"]
+    for block in state["blocks"]:
+        block_id = builder.graph.add_block(block["resnames"], block["edges"], name=block["name"],
+                                           attributes=block["attributes"])
+        builder.labels[block_id] = tuple(block["label"])
+    pairs = np.array(state["links"], dtype=np.int64).reshape(-1, 4)
+    if len(pairs):
+        builder.graph.add_edges(np.column_stack([builder.residues(pairs[:, 0], pairs[:, 1]),
+                                                 builder.residues(pairs[:, 2], pairs[:, 3])]))
+    if state["positions"] is not None:
+        builder.coords = {node: np.array(position) for node, position
+                          in zip(builder.graph.node_array().tolist(), state["positions"])
+                          if position is not None}
+
+class SessionJournal():
+    """
+    Checkpoint and journal of the session kept in `directory`.
+    See the module documentation for the format.
+    """
+
+    def __init__(self, directory=None, batch_size=16, max_delay=2., checkpoint_every=1000):
+        self.directory = Path(directory) if directory else user_cache_dir('session')
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.checkpoint_every = checkpoint_every
+        self.seq = 0
+        self.n_entries = 0
+        # lines not written yet and when the first of them came in
+        self.pending = []
+        self.pending_since = None
+        # edits the replay of the journal could undo and redo
+        self.undoable = 0
+        self.redoable = 0
+        self._file = None
+        self._lock_file = None
+
+    @property
+    def checkpoint_path(self):
+        return self.directory.joinpath("checkpoint.json")
+
+    @property
+    def journal_path(self):
+        return self.directory.joinpath("journal.jsonl")
+
+    @property
+    def lock_path(self):
+        return self.directory.joinpath("lock")
+
+    def lock(self):
+        """
+        Take the lock of the session directory, which is kept until
+        :meth:`close`, before restoring or saving to it.
+
+        Returns
+        -------
+        bool
+            False if another process holds the lock
+        """
+        if self._lock_file is not None:
+            return True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        file_handle = open(self.lock_path, "a")
+        try:
+            _try_lock(file_handle)
+        except OSError:
+            file_handle.close()
+            return False
+        self._lock_file = file_handle
+        return True
+
+    def _open(self):
+        if self._file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.journal_path, "a")
+        return self._file
+
+    def _replayable(self, op):
+        """
+        Update the undo and redo counts the replay would have after
+        `op` and tell whether it can repeat it.
+        """
+        if op == "undo":
+            if not self.undoable:
+                return False
+            self.undoable -= 1
+            self.redoable += 1
+        elif op == "redo":
+            if not self.redoable:
+                return False
+            self.redoable -= 1
+            self.undoable += 1
+        elif op in _CHECKPOINT_OPS:
+            return False
+        elif op != "set_force_field":
+            self.undoable += 1
+            self.redoable = 0
+        return True
+
+    def record(self, builder, op, args):
+        """
+        Journal the operation `op`, a method of `builder`, that was
+        just called with the keyword arguments `args`.
+        """
+        # the first edit of a session without checkpoint starts one
+        if not self._replayable(op) or self.seq == 0 or self.n_entries >= self.checkpoint_every:
+            self.checkpoint(builder)
+            return
+        self.seq += 1
+        self.n_entries += 1
+        self.pending.append(json.dumps({"seq": self.seq, "op": op, "args": args}) + "\n")
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if len(self.pending) >= self.batch_size or self.due() == 0:
+            self.flush()
+
+    def due(self):
+        """
+        Seconds until the pending lines have to be written, or None
+        if there are none.
+        """
+        if not self.pending:
+            return None
+        return max(0., self.max_delay - (time.monotonic() - self.pending_since))
+
+    def flush(self):
+        """
+        Write and fsync the pending lines.
+        """
+        if not self.pending:
+            return
+        file_handle = self._open()
+        file_handle.write("".join(self.pending))
+        file_handle.flush()
+        os.fsync(file_handle.fileno())
+        self.pending = []
+        self.pending_since = None
+
+    def checkpoint(self, builder):
+        """
+        Write the state of `builder` as new checkpoint and start an
+        empty journal.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pending = []
+        self.pending_since = None
+        self.seq += 1
+        state = snapshot(builder)
+        state["seq"] = self.seq
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file_handle:
+            json.dump(state, file_handle)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        _fsync_dir(self.directory)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, "w")
+        os.fsync(self._file.fileno())
+        self.n_entries = 0
+        self.undoable = 0
+        self.redoable = 0
+
+    def _entries(self, after):
+        try:
+            with open(self.journal_path) as file_handle:
+                lines = file_handle.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn write of a crash, nothing valid follows
+                return
+            if entry["seq"] > after:
+                yield entry
+
+    def restore(self, builder):
+        """
+        Replay the checkpoint and journal into the empty `builder`
+        and compact them into a new checkpoint. The edits of the
+        journal can be undone afterwards. Replaying stops at the
+        first entry that fails.
+
+        Returns
+        -------
+        int
+            the number of replayed journal entries
+        """
+        try:
+            with open(self.checkpoint_path) as file_handle:
+                state = json.load(file_handle)
+        except (OSError, ValueError):
+            state = None
+        if state is not None:
+            restore_snapshot(builder, state)
+            self.seq = state["seq"]
+
+        n_replayed = 0
+        for entry in self._entries(self.seq):
+            try:
+                getattr(builder, entry["op"])(**entry["args"])
+            except (IndexError, KeyError, ValueError):
+                break
+            self.seq = entry["seq"]
+            n_replayed += 1
+        self.checkpoint(builder)
+        return n_replayed
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            # closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,146 @@
+"""
+Layouts saved next to seq files, so that a reopened graph does
+not need to be laid out again.
+
+The positions are written to a `<seq file>.layout.npz` sidecar
+together with Weisfeiler-Lehman labels of the residues. A label
+summarizes the resnames within a few bonds of a residue, and the
+sorted labels hash the whole graph. If the graph loaded has the
+hash of the saved one, its positions are reused as they are.
+Otherwise residues get the position of the saved residue with the
+same label, where the n-th residue of a label is matched to the
+n-th saved one in residue order; the rest is left to the layout.
+"""
+import hashlib
+import numpy as np
+
+WL_ITERATIONS = 3
+
+def _mix(values):
+    """
+    splitmix64 finalizer, spreading the bits of uint64 values.
+    """
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+def _string_hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "little")
+
+def node_labels(resnames, edges, iterations=WL_ITERATIONS):
+    """
+    Weisfeiler-Lehman labels of all residues. Starting from the
+    resname, every iteration combines the label of a residue with
+    the multiset of the labels of its neighbours.
+
+    Parameters
+    ----------
+    resnames: list[str]
+    edges: array like
+        (E, 2) residue indices from 0
+    iterations: int
+
+    Returns
+    -------
+    np.ndarray
+        uint64 label per residue
+    """
+    uniques, inverse = np.unique(np.asarray(resnames, dtype=object).astype(str), return_inverse=True)
+    labels = np.array([_string_hash(value) for value in uniques.tolist()],
+                      dtype=np.uint64)[inverse.reshape(-1)]
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    for _ in range(iterations):
+        # a sum of mixed labels does not depend on the neighbour order
+        neighbours = np.zeros(len(labels), dtype=np.uint64)
+        np.add.at(neighbours, sources, _mix(labels)[targets])
+        labels = _mix(labels ^ _mix(neighbours))
+    return labels
+
+def graph_hash(labels):
+    return hashlib.sha1(np.sort(labels).tobytes()).hexdigest()
+
+def _occurrence_keys(labels):
+    """
+    Labels made unique by combining them with how many residues
+    before had the same label.
+    """
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    ranks = np.empty(len(labels), dtype=np.uint64)
+    ranks[order] = np.arange(len(labels)) - np.repeat(starts, np.diff(np.r_[starts, len(labels)]))
+    return _mix(labels ^ _mix(ranks))
+
+def layout_path(seq_path):
+    return str(seq_path) + ".layout.npz"
+
+def save_layout(seq_path, resnames, edges, positions):
+    """
+    Write the (N, 2) `positions` of the graph saved at `seq_path`;
+    residues without position are NaN.
+    """
+    labels = node_labels(resnames, edges)
+    # np.savez appends .npz to paths without it
+    with open(layout_path(seq_path), "wb") as file_handle:
+        np.savez_compressed(file_handle, graph_hash=np.array(graph_hash(labels)),
+                            labels=labels, positions=np.asarray(positions, dtype=float))
+
+def load_layout(seq_path, resnames, edges):
+    """
+    Saved positions of the residues of a graph read from `seq_path`.
+
+    Returns
+    -------
+    np.ndarray or None
+        (N, 2) positions with NaN for residues that could not be
+        matched, or None without a readable layout file
+    """
+    try:
+        with np.load(layout_path(seq_path)) as data:
+            saved_hash = str(data["graph_hash"])
+            saved_labels = data["labels"]
+            saved_positions = data["positions"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+    labels = node_labels(resnames, edges)
+    if saved_hash == graph_hash(labels) and np.array_equal(saved_labels, labels):
+        return saved_positions
+
+    positions = np.full((len(labels), 2), np.nan)
+    _, saved_rows, rows = np.intersect1d(_occurrence_keys(saved_labels), _occurrence_keys(labels),
+                                         return_indices=True)
+    positions[rows] = saved_positions[saved_rows]
+    return positions
+
+def place_beside(coords, positions, gap=0.2):
+    """
+    Move `positions` of new residues next to the layout `coords` of
+    the others and scale both into the unit box if they leave it.
+
+    Returns
+    -------
+    dict
+        the rescaled `coords`
+    np.ndarray
+        the moved `positions`
+    """
+    if coords:
+        placed = np.array(list(coords.values()))
+        offset = np.array([placed[:, 0].max() + gap - np.nanmin(positions[:, 0]),
+                           placed[:, 1].mean() - np.nanmean(positions[:, 1])])
+        positions = positions + offset
+    else:
+        placed = np.zeros((0, 2))
+    both = np.concatenate([placed, positions[~np.isnan(positions).any(axis=1)]])
+    if len(both) and np.abs(both).max() > 1.:
+        # like networkx.rescale_layout with a scale of 0.75
+        center = both.mean(axis=0)
+        factor = 0.75 / np.abs(both - center).max()
+        coords = {node: (coord - center) * factor for node, coord in coords.items()}
+        positions = (positions - center) * factor
+    return coords, positions
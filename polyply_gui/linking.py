@@ -0,0 +1,75 @@
+"""
+Patterns of many links, e.g. to graft side chains onto a backbone.
+All functions return (K, 4) arrays with block and resid of both
+residues of every pair, counting from 1, which are applied at once
+by :meth:`polyply_gui.builder.GraphBuilder.link_pairs`.
+"""
+import re
+import numpy as np
+
+def parse_blocks(text):
+    """
+    Block numbers from text like '2 3 7-10', where a range
+    includes both ends.
+    """
+    blocks = []
+    for item in text.replace(",", " ").split():
+        first, _, last = item.partition("-")
+        blocks.extend(range(int(first), int(last or first) + 1))
+    return blocks
+
+def rule_pairs(builder, blockA, blocksB, residB=1, step=1, start=1, resname=None):
+    """
+    Link the residues of block `blockA` picked by a rule to residue
+    `residB` of the blocks `blocksB`.
+
+    The residues of `blockA` are every `step`-th one from resid
+    `start` on, of those only the ones named `resname` if given.
+    The n-th of them is linked to the n-th block of `blocksB`, up
+    to the shorter of both; a single block in `blocksB` is linked
+    to all of them.
+
+    Returns
+    -------
+    np.ndarray
+        (K, 4) pairs
+    """
+    if not 1 <= blockA <= len(builder.graph.blocks):
+        raise IndexError("there is no block {}".format(blockA))
+    block_id = builder._block_id(blockA)
+    nodes = builder.graph.block_nodes(block_id)[start-1::step]
+    resids = np.arange(start, start + len(nodes) * step, step)
+    if resname is not None:
+        resnames = np.asarray(builder.graph.columns["resname"].decode(nodes), dtype=object)
+        resids = resids[resnames == resname]
+    blocksB = np.asarray(blocksB, dtype=np.int64)
+    if len(blocksB) == 1:
+        blocksB = np.repeat(blocksB, len(resids))
+    n_pairs = min(len(resids), len(blocksB))
+    return np.column_stack([np.full(n_pairs, blockA), resids[:n_pairs],
+                            blocksB[:n_pairs], np.full(n_pairs, residB)]).astype(np.int64)
+
+def parse_pairs(text):
+    """
+    Pairs from lines of 'blockA residA blockB residB', separated by
+    white space or commas, like the links of a build spec. Empty
+    lines and text after '#' are ignored.
+
+    Returns
+    -------
+    np.ndarray
+        (K, 4) pairs
+    """
+    pairs = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        fields = re.split(r"[\s,]+", line.split("#")[0].strip())
+        if fields == [""]:
+            continue
+        if len(fields) != 4:
+            raise ValueError("line {}: expected 4 numbers, not '{}'".format(line_number, line))
+        pairs.append([int(field) for field in fields])
+    return np.array(pairs, dtype=np.int64).reshape(-1, 4)
+
+def read_pairs(path):
+    with open(path) as file_handle:
+        return parse_pairs(file_handle.read())
@@ -0,0 +1,211 @@
+import os
+import re
+import hashlib
+from itertools import islice
+from pathlib import Path
+import networkx as nx
+from .cache_utils import LRUCache
+
+_SECTION = re.compile(r"^\s*\[\s*(\w+)\s*\]")
+
+def _section(line):
+    match = _SECTION.match(line)
+    return match.group(1).casefold() if match else None
+
+def _linear_residue_graph(residues):
+    """
+    Residue graph from (segment, resid, resname) tuples of consecutive
+    residues, connecting neighbours in the same segment.
+    """
+    graph = nx.Graph()
+    for idx, (segment, resid, resname) in enumerate(residues):
+        graph.add_node(idx, resid=resid, resname=resname)
+        if idx > 0 and residues[idx - 1][0] == segment:
+            graph.add_edge(idx - 1, idx)
+    return graph
+
+def _itp_molecule_lines(lines, molecule=None):
+    """
+    Lines of the first molecule named `molecule`, or of the first
+    molecule at all, preceded by the lines before the first
+    moleculetype. Reading stops at the end of that molecule and
+    the lines of other molecules are not kept.
+    """
+    preamble = []
+    current = None
+    name = None
+    for line in lines:
+        section = _section(line)
+        if section == "moleculetype":
+            if current is not None and name is not None and (molecule is None or name == molecule):
+                return name, preamble + current
+            current, name = [line], None
+            continue
+        if current is None:
+            preamble.append(line)
+            continue
+        if name is None:
+            tokens = line.split(';')[0].split()
+            if tokens and not tokens[0].startswith('#'):
+                name = tokens[0]
+                # skip everything up to the next moleculetype
+                if molecule is not None and name != molecule:
+                    current = []
+                    continue
+        if name is None or molecule is None or name == molecule:
+            current.append(line)
+    if current is not None and name is not None and (molecule is None or name == molecule):
+        return name, preamble + current
+    raise IOError("no molecule {} found".format(molecule) if molecule else "no molecule found")
+
+def _residue_graph(block, attributes=("chain", "resid", "resname")):
+    """
+    Residue graph of a vermouth block, with one node per set of atoms
+    sharing the `attributes`, linked if any of their atoms are bonded.
+    Unlike :func:`vermouth.graph_utils.make_residue_graph`, which
+    takes a subgraph per residue, this is linear in the block size.
+    """
+    graph = nx.Graph()
+    index = {}
+    residue_of = {}
+    for atom, atom_attributes in block.nodes(data=True):
+        key = tuple(atom_attributes.get(attribute) for attribute in attributes)
+        if key not in index:
+            index[key] = len(index)
+            graph.add_node(index[key], resid=atom_attributes.get("resid"),
+                           resname=atom_attributes.get("resname"))
+        residue_of[atom] = index[key]
+    graph.add_edges_from((residue_of[atomA], residue_of[atomB]) for atomA, atomB in block.edges
+                         if residue_of[atomA] != residue_of[atomB])
+    return graph
+
+def load_itp(lines, molecule=None):
+    """
+    Residue graph of a molecule in an itp file, connected by its bonds.
+    """
+    from vermouth.forcefield import ForceField
+    from vermouth.gmx.itp_read import read_itp
+    mol_name, mol_lines = _itp_molecule_lines(lines, molecule)
+    force_field = ForceField("dummy")
+    read_itp(mol_lines, force_field)
+    block = force_field.blocks[mol_name]
+    block.make_edges_from_interaction_type('bonds')
+    return mol_name, _residue_graph(block)
+
+def load_gro(lines, molecule=None):
+    """
+    Residue graph of a gro file. The file has no notion of molecules,
+    so all residues are taken as one unnamed chain.
+    """
+    if molecule is not None:
+        raise IOError("gro files have no molecule names")
+    try:
+        next(lines)
+        n_atoms = int(next(lines))
+    except StopIteration:
+        raise ValueError("truncated gro file") from None
+    residues = []
+    n_read = 0
+    for line in islice(lines, n_atoms):
+        residue = (0, int(line[0:5]), line[5:10].strip())
+        if not residues or residues[-1] != residue:
+            residues.append(residue)
+        n_read += 1
+    if n_read < n_atoms:
+        raise ValueError("truncated gro file: {} of {} atoms".format(n_read, n_atoms))
+    return None, _linear_residue_graph(residues)
+
+def load_pdb(lines, molecule=None):
+    """
+    Residue graph of one chain of the first model in a pdb file,
+    by default the first chain. Chains are named by their chain id
+    and end at chain id changes and TER records.
+    """
+    residues = []
+    segment = 0
+    last_chain = None
+    for line in lines:
+        record = line[:6].strip()
+        if record in ("ENDMDL", "END"):
+            break
+        if record == "TER":
+            segment += 1
+            last_chain = None
+            continue
+        if record not in ("ATOM", "HETATM"):
+            continue
+        chain = line[21].strip() or "A"
+        if last_chain is not None and chain != last_chain:
+            segment += 1
+        last_chain = chain
+        if residues and segment != residues[-1][0]:
+            break
+        if molecule is not None and chain != molecule:
+            continue
+        residue = (segment, int(line[22:26]), line[17:21].strip())
+        if not residues or residues[-1] != residue:
+            residues.append(residue)
+            name = chain
+    if not residues:
+        raise IOError("no molecule {} found".format(molecule) if molecule else "no molecule found")
+    return name, _linear_residue_graph(residues)
+
+LOADERS = {"itp": load_itp,
+           "gro": load_gro,
+           "pdb": load_pdb,}
+
+def _file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResidueGraphCache():
+    """
+    LRU cache of at most `maxsize` residue graphs read from topology
+    and coordinate files, keyed by the content hash of the file and
+    the molecule name. Files with unchanged path, size and mtime are
+    not hashed again. The returned graphs are shared and must not be
+    modified.
+    """
+
+    def __init__(self, maxsize=16):
+        self._graphs = LRUCache(maxsize)
+        self._digests = {}
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self._digests:
+            self._digests[stat_key] = _file_digest(path)
+        return self._digests[stat_key]
+
+    def get(self, path, molecule=None):
+        """
+        Name and residue graph of `molecule` in the file at `path`.
+        Unnamed molecules are named after the file.
+        """
+        path = Path(path)
+        key = (self._digest(path), molecule)
+        cached = self._graphs.get(key)
+        if cached is not None:
+            return cached
+
+        loader = LOADERS[path.suffix.casefold()[1:]]
+        with open(path) as file_handle:
+            mol_name, graph = loader(iter(file_handle), molecule)
+        mol_name = mol_name or path.stem
+
+        self._graphs.put(key, (mol_name, graph))
+        return mol_name, graph
+
+_CACHE = ResidueGraphCache()
+
+def load_residue_graph(path, molecule=None, cache=_CACHE):
+    """
+    Name and residue graph of `molecule` in the file at `path`,
+    by default the first molecule. The loader is picked from
+    :data:`LOADERS` by the file extension.
+    """
+    return cache.get(path, molecule)
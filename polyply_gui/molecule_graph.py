@@ -0,0 +1,577 @@
+from collections.abc import Set
+import numpy as np
+import networkx as nx
+
+def _grow(array, size):
+    """
+    Return `array` with room for at least `size` rows;
+    capacity is doubled to make appending amortized O(1).
+    """
+    if len(array) >= size:
+        return array
+    capacity = max(size, 2 * len(array), 16)
+    new_array = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    new_array[:len(array)] = array
+    return new_array
+
+def split_resnames(values):
+    """
+    Split decoded columns into the resnames and the columns of the
+    other attributes that are set for any residue, as
+    :meth:`MoleculeGraph.add_block` takes them.
+    """
+    values = dict(values)
+    resnames = values.pop("resname")
+    attributes = {attribute: column for attribute, column in values.items()
+                  if any(value is not None for value in column)}
+    return resnames, attributes
+
+class CategoricalColumn():
+    """
+    Compact storage of a string attribute per residue as integer
+    codes into a list of categories. A code of -1 means unset.
+    """
+
+    def __init__(self):
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.categories = []
+        self._index = {}
+
+    def reserve(self, size):
+        old_size = len(self.codes)
+        self.codes = _grow(self.codes, size)
+        self.codes[old_size:] = -1
+
+    def encode(self, values):
+        """
+        Integer codes of `values`, adding new categories as needed.
+        """
+        uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str),
+                                     return_inverse=True)
+        codes = np.empty(len(uniques), dtype=np.int32)
+        for idx, value in enumerate(uniques.tolist()):
+            if value not in self._index:
+                self._index[value] = len(self.categories)
+                self.categories.append(value)
+            codes[idx] = self._index[value]
+        return codes[inverse.reshape(-1)]
+
+    def set(self, nodes, values):
+        """
+        Set the attribute of `nodes` to `values`, which is either
+        a single value or one value per node.
+        """
+        nodes = np.asarray(nodes, dtype=int)
+        if values is None:
+            self.codes[nodes] = -1
+        elif isinstance(values, str):
+            self.codes[nodes] = self.encode([values])[0]
+        else:
+            values = np.asarray(values, dtype=object)
+            is_set = ~np.equal(values, None)
+            codes = np.full(len(values), -1, dtype=np.int32)
+            if is_set.any():
+                codes[is_set] = self.encode(values[is_set])
+            self.codes[nodes] = codes
+
+    def get(self, node):
+        code = self.codes[node]
+        return self.categories[code] if code >= 0 else None
+
+    def decode(self, nodes):
+        """
+        Values of `nodes` as list; unset values are None.
+        """
+        lookup = np.array(self.categories + [None], dtype=object)
+        return lookup[self.codes[nodes]].tolist()
+
+class Block():
+    """
+    Registry entry of a block. Its residues are the consecutive
+    ids from `start` to `stop` and its internal edges the rows
+    `edge_start` to `edge_stop` of the edge store.
+    """
+
+    def __init__(self, block_id, name, start, stop, edge_start, edge_stop):
+        self.block_id = block_id
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.edge_start = edge_start
+        self.edge_stop = edge_stop
+        # edge keys of links to and from this block
+        self.links = set()
+
+    @property
+    def nodes(self):
+        return range(self.start, self.stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+class NodeView(Set):
+    """
+    Read-only view of the residues in a :class:`MoleculeGraph`
+    mimicking the networkx node view.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+    def __iter__(self):
+        return iter(self._graph.node_array().tolist())
+
+    def __len__(self):
+        return self._graph.n_residues
+
+    def __contains__(self, node):
+        return self._graph.has_node(node)
+
+    def __getitem__(self, node):
+        return self._graph.node_attributes(node)
+
+class MoleculeGraph():
+    """
+    Residue graph of the molecule under construction organized
+    in blocks.
+
+    Residues get consecutive integer ids which are never reused,
+    so that the ids of a block and of its residues are stable under
+    removal of other blocks. Removed blocks stay in the stores until
+    :meth:`compact` drops them, which renumbers the residues but
+    keeps the block ids. Residue attributes are stored as
+    :class:`CategoricalColumn` objects and edges in an appendable
+    (N, 2) array, from which a CSR adjacency is built on demand.
+    Adding or removing a block costs time in proportion to the size
+    of that block. The networkx interface needed for drawing is
+    provided directly; a :class:`networkx.Graph` is only made by
+    :meth:`to_networkx`.
+    """
+
+    def __init__(self, attributes=("resname", "tacticity")):
+        self.columns = {attribute: CategoricalColumn() for attribute in attributes}
+        self.blocks = {}
+        self.n_residues = 0
+        self._size = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._block_of = np.zeros(0, dtype=np.int64)
+        self._edges = np.zeros((0, 2), dtype=np.int64)
+        self._edge_alive = np.zeros(0, dtype=bool)
+        self._n_edges = 0
+        # edge key -> row in the edge store for edges added by add_edge
+        self._links = {}
+        self._next_block = 0
+        self._csr = None
+
+    # networkx like interface
+    @property
+    def nodes(self):
+        return NodeView(self)
+
+    def __len__(self):
+        return self.n_residues
+
+    def __contains__(self, node):
+        return self.has_node(node)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def number_of_nodes(self):
+        return self.n_residues
+
+    @property
+    def n_removed(self):
+        """
+        Number of residues of removed blocks still in the stores.
+        """
+        return self._size - self.n_residues
+
+    def has_node(self, node):
+        try:
+            return 0 <= node < self._size and bool(self._alive[node])
+        except TypeError:
+            return False
+
+    def node_array(self):
+        """
+        Ids of all residues as array.
+        """
+        return np.flatnonzero(self._alive[:self._size])
+
+    def decode(self, nodes):
+        """
+        The values of every attribute column for `nodes`, as lists.
+        """
+        return {attribute: column.decode(nodes) for attribute, column in self.columns.items()}
+
+    def node_attributes(self, node):
+        if not self.has_node(node):
+            raise KeyError(node)
+        attributes = {}
+        for attribute, column in self.columns.items():
+            value = column.get(node)
+            if value is not None:
+                attributes[attribute] = value
+        return attributes
+
+    def edge_array(self, nbunch=None):
+        """
+        All edges as (E, 2) array; with `nbunch` only those touching
+        these nodes.
+        """
+        edges = self._edges[:self._n_edges][self._edge_alive[:self._n_edges]]
+        if nbunch is not None:
+            mask = np.zeros(self._size, dtype=bool)
+            mask[np.fromiter(nbunch, dtype=np.int64)] = True
+            edges = edges[mask[edges[:, 0]] | mask[edges[:, 1]]]
+        return edges
+
+    def compact_edges(self):
+        """
+        All edges as (E, 2) array with the residues numbered from 0
+        in the order of :meth:`node_array`, as they are exported.
+        """
+        relabel = np.zeros(self._size, dtype=np.int64)
+        relabel[self.node_array()] = np.arange(self.n_residues)
+        return relabel[self.edge_array()]
+
+    def edges(self, nbunch=None):
+        """
+        List of edges; with `nbunch` only those touching these nodes.
+        """
+        return list(map(tuple, self.edge_array(nbunch).tolist()))
+
+    def number_of_edges(self):
+        return int(self._edge_alive[:self._n_edges].sum())
+
+    def csr(self):
+        """
+        Adjacency in CSR form as `indptr` and `indices` arrays over
+        the residue ids; cached until the next edit.
+        """
+        if self._csr is None:
+            edges = self.edge_array()
+            sources = np.concatenate([edges[:, 0], edges[:, 1]])
+            targets = np.concatenate([edges[:, 1], edges[:, 0]])
+            order = np.argsort(sources, kind='stable')
+            indptr = np.zeros(self._size + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources, minlength=self._size), out=indptr[1:])
+            self._csr = (indptr, targets[order])
+        return self._csr
+
+    def neighbors(self, node):
+        if not self.has_node(node):
+            raise KeyError(node)
+        indptr, indices = self.csr()
+        return indices[indptr[node]:indptr[node+1]].tolist()
+
+    def has_edge(self, ndxA, ndxB):
+        return self.has_node(ndxA) and ndxB in self.neighbors(ndxA)
+
+    # block registry
+    @property
+    def block_ids(self):
+        """
+        Ids of all blocks in the order they were added.
+        """
+        return list(self.blocks)
+
+    def block_nodes(self, block_id):
+        return self.blocks[block_id].nodes
+
+    def block_edges(self, block_id):
+        """
+        Internal edges of a block that are not removed, as (K, 2)
+        block local residue indices.
+        """
+        block = self.blocks[block_id]
+        rows = slice(block.edge_start, block.edge_stop)
+        return self._edges[rows][self._edge_alive[rows]] - block.start
+
+    def link_array(self):
+        """
+        Edges between residues added after their blocks, as (K, 2)
+        array in the order they were added.
+        """
+        rows = np.fromiter(self._links.values(), dtype=np.int64, count=len(self._links))
+        return self._edges[np.sort(rows)].reshape(-1, 2)
+
+    def block_ranges(self):
+        """
+        Residue ids of every block in order.
+        """
+        return [block.nodes for block in self.blocks.values()]
+
+    def residue(self, block_id, resid):
+        """
+        Node id of the `resid`-th (starting at 0) residue of a block.
+        """
+        block = self.blocks[block_id]
+        if not 0 <= resid < len(block):
+            raise IndexError("block {} has no residue {}".format(block_id, resid + 1))
+        return block.start + resid
+
+    def block_of(self, nodes):
+        return self._block_of[nodes]
+
+    def _reserve(self, size):
+        self._alive = _grow(self._alive, size)
+        self._block_of = _grow(self._block_of, size)
+        for column in self.columns.values():
+            column.reserve(size)
+
+    def _append_edges(self, edges):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        start = self._n_edges
+        self._edges = _grow(self._edges, start + len(edges))
+        self._edge_alive = _grow(self._edge_alive, start + len(edges))
+        self._edges[start:start+len(edges)] = edges
+        self._edge_alive[start:start+len(edges)] = True
+        self._n_edges += len(edges)
+        self._csr = None
+        return start
+
+    def add_block(self, resnames, edges=(), name=None, attributes={}):
+        """
+        Append a block of residues.
+
+        Parameters
+        ----------
+        resnames: list[str]
+            resname of every residue of the block
+        edges: array like
+            (K, 2) edges as block local residue indices
+        name: str
+        attributes: dict[str, list[str]]
+            further attributes per residue
+
+        Returns
+        -------
+        int
+            the block id
+        """
+        start = self._size
+        stop = start + len(resnames)
+        self._reserve(stop)
+        self._alive[start:stop] = True
+        block_id = self._next_block
+        self._next_block += 1
+        self._block_of[start:stop] = block_id
+        self.columns["resname"].set(np.arange(start, stop), resnames)
+        for attribute, values in attributes.items():
+            self.columns[attribute].set(np.arange(start, stop), values)
+
+        edge_start = self._append_edges(np.asarray(edges, dtype=np.int64).reshape(-1, 2) + start)
+        self.blocks[block_id] = Block(block_id, name, start, stop, edge_start, self._n_edges)
+        self._size = stop
+        self.n_residues += stop - start
+        return block_id
+
+    def add_block_from_graph(self, graph, name=None):
+        """
+        Append the nodes and edges of a :class:`networkx.Graph`
+        as new block; node attributes named like a column are kept.
+        """
+        index = {node: idx for idx, node in enumerate(graph.nodes)}
+        resnames = [resname for _, resname in graph.nodes(data="resname")]
+        attributes = {}
+        for attribute in self.columns:
+            values = [value for _, value in graph.nodes(data=attribute)]
+            if attribute != "resname" and any(value is not None for value in values):
+                attributes[attribute] = values
+        edges = [(index[ndxA], index[ndxB]) for ndxA, ndxB in graph.edges]
+        return self.add_block(resnames, edges, name=name, attributes=attributes)
+
+    def remove_block(self, block_id):
+        """
+        Remove a block, its residues and all edges touching them.
+        Nothing is deleted from the stores, so the returned block
+        can be put back with :meth:`restore_block`.
+        """
+        block = self.blocks.pop(block_id)
+        self._alive[block.start:block.stop] = False
+        block.edge_mask = self._edge_alive[block.edge_start:block.edge_stop].copy()
+        self._edge_alive[block.edge_start:block.edge_stop] = False
+        block.link_rows = {}
+        for key in block.links:
+            block.link_rows[key] = self._links.pop(key)
+            self._edge_alive[block.link_rows[key]] = False
+            for node in key:
+                other = self._block_of[node]
+                if other != block_id and other in self.blocks:
+                    self.blocks[other].links.discard(key)
+        self.n_residues -= len(block)
+        self._csr = None
+        return block
+
+    def restore_block(self, block):
+        """
+        Put back a block returned by :meth:`remove_block` at its old
+        position, with the edges it had. Links to residues that are
+        gone stay removed.
+        """
+        self.blocks[block.block_id] = block
+        if block.block_id != max(self.blocks):
+            self.blocks = dict(sorted(self.blocks.items()))
+        self._alive[block.start:block.stop] = True
+        self._edge_alive[block.edge_start:block.edge_stop] = block.edge_mask
+        for key, row in block.link_rows.items():
+            if not self.has_node(key[0]) or not self.has_node(key[1]):
+                block.links.discard(key)
+                continue
+            self._links[key] = row
+            self._edge_alive[row] = True
+            for node in key:
+                self.blocks[self._block_of[node]].links.add(key)
+        self.n_residues += len(block)
+        self._csr = None
+
+    def compact(self, keep=()):
+        """
+        Drop the residues and edges of removed blocks from the stores,
+        apart from those of the removed blocks in `keep`, which can
+        still be restored. The residues are renumbered in order;
+        the blocks in the graph and in `keep` are updated in place.
+
+        Returns
+        -------
+        np.ndarray
+            the new id of every old residue id, -1 for dropped residues
+        """
+        blocks = sorted(list(self.blocks.values()) + list(keep), key=lambda block: block.start)
+        relabel = np.full(self._size, -1, dtype=np.int64)
+        rows = [np.fromiter(self._links.values(), dtype=np.int64, count=len(self._links))]
+        start = 0
+        for block in blocks:
+            relabel[block.start:block.stop] = np.arange(start, start + len(block))
+            block.start, block.stop = start, start + len(block)
+            start = block.stop
+            rows.append(np.arange(block.edge_start, block.edge_stop))
+            if block.block_id not in self.blocks:
+                rows.append(np.fromiter(block.link_rows.values(), dtype=np.int64,
+                                        count=len(block.link_rows)))
+        kept = relabel >= 0
+        self._alive = self._alive[:self._size][kept]
+        self._block_of = self._block_of[:self._size][kept]
+        for column in self.columns.values():
+            column.codes = column.codes[:self._size][kept]
+        self._size = start
+
+        # links of tombstones to dropped residues can not be restored
+        rows = np.concatenate(rows)
+        edges = relabel[self._edges[rows]]
+        rows = np.unique(rows[(edges >= 0).all(axis=1)])
+        row_relabel = np.full(self._n_edges, -1, dtype=np.int64)
+        row_relabel[rows] = np.arange(len(rows))
+        self._edges = relabel[self._edges[rows]]
+        self._edge_alive = self._edge_alive[rows]
+        self._n_edges = len(rows)
+
+        def _key(key):
+            return (int(relabel[key[0]]), int(relabel[key[1]]))
+
+        self._links = {_key(key): int(row_relabel[row]) for key, row in self._links.items()}
+        for block in blocks:
+            block.edge_start, block.edge_stop = np.searchsorted(rows, [block.edge_start, block.edge_stop]).tolist()
+            if block.block_id in self.blocks:
+                block.links = {_key(key) for key in block.links}
+            else:
+                link_rows = {_key(key): int(row_relabel[row]) for key, row in block.link_rows.items()}
+                block.link_rows = {key: row for key, row in link_rows.items() if min(key) >= 0}
+                block.links = {_key(key) for key in block.links} & set(block.link_rows)
+        self._csr = None
+        return relabel
+
+    def add_edge(self, ndxA, ndxB):
+        """
+        Link two residues; returns False if they are linked already.
+        """
+        if not self.has_node(ndxA) or not self.has_node(ndxB):
+            raise KeyError("cannot link missing residues {} and {}".format(ndxA, ndxB))
+        if self.has_edge(ndxA, ndxB):
+            return False
+        key = (min(ndxA, ndxB), max(ndxA, ndxB))
+        self._links[key] = self._append_edges([key])
+        for node in key:
+            self.blocks[self._block_of[node]].links.add(key)
+        return True
+
+    def add_edges(self, edges):
+        """
+        Link many pairs of residues at once. Pairs that are linked
+        already or given more than once are skipped.
+
+        Parameters
+        ----------
+        edges: array like
+            (K, 2) residue ids
+
+        Returns
+        -------
+        np.ndarray
+            (M, 2) the new edges, smaller id first
+        """
+        edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        valid = (edges >= 0) & (edges < self._size)
+        valid[valid] = self._alive[edges[valid]]
+        if not valid.all():
+            ndxA, ndxB = edges[~valid.all(axis=1)][0]
+            raise KeyError("cannot link missing residues {} and {}".format(ndxA, ndxB))
+        edges = np.unique(edges, axis=0)
+        existing = np.sort(self.edge_array(), axis=1)
+        is_new = ~np.isin(edges[:, 0] * self._size + edges[:, 1],
+                          existing[:, 0] * self._size + existing[:, 1])
+        edges = edges[is_new]
+        start = self._append_edges(edges)
+        for row, key in enumerate(map(tuple, edges.tolist()), start):
+            self._links[key] = row
+            for node in key:
+                self.blocks[self._block_of[node]].links.add(key)
+        return edges
+
+    def remove_edge(self, ndxA, ndxB):
+        key = (min(ndxA, ndxB), max(ndxA, ndxB))
+        if key in self._links:
+            self._edge_alive[self._links.pop(key)] = False
+            for node in key:
+                self.blocks[self._block_of[node]].links.discard(key)
+        else:
+            block = self.blocks[self._block_of[key[0]]]
+            rows = np.arange(block.edge_start, block.edge_stop)
+            edges = self._edges[rows]
+            hits = rows[(edges[:, 0] == key[0]) & (edges[:, 1] == key[1]) |
+                        (edges[:, 0] == key[1]) & (edges[:, 1] == key[0])]
+            if not len(hits) or not self._edge_alive[hits].any():
+                raise KeyError("no edge between {} and {}".format(ndxA, ndxB))
+            self._edge_alive[hits] = False
+        self._csr = None
+
+    def set_attribute(self, attribute, nodes, values):
+        """
+        Set a residue attribute of `nodes`; `values` is a single
+        value or one per node.
+        """
+        self.columns[attribute].set(nodes, values)
+
+    def to_networkx(self, compact=True):
+        """
+        Export to :class:`networkx.Graph`. With `compact` the residues
+        are relabelled from 0 in order of their ids, otherwise the ids
+        are kept.
+        """
+        nodes = self.node_array()
+        labels = np.arange(len(nodes)) if compact else nodes
+        columns = {attribute: column.decode(nodes) for attribute, column in self.columns.items()}
+        graph = nx.Graph()
+        for idx, label in enumerate(labels.tolist()):
+            graph.add_node(label, **{attribute: values[idx] for attribute, values in columns.items()
+                                     if values[idx] is not None})
+        relabel = np.full(self._size, -1, dtype=np.int64)
+        relabel[nodes] = labels
+        graph.add_edges_from(relabel[self.edge_array()].tolist())
+        return graph
@@ -1,31 +1,189 @@
-import os
 import io
+import sys
 import contextlib
-from polyply import gen_itp
 from pathlib import Path
+from .molecule_graph import MoleculeGraph
+from .seq_io import read_seq_block
 
-def run_gen_itp(graph_path, outpath, force_field):
+# libraries used by the itp generation of this process; worker
+# processes keep theirs between jobs
+_FF_CACHE = None
+# fragments of blocks for the incremental itp generation
+_FRAGMENTS = None
+
+def _force_field(force_field):
     """
-    Ugly workaround calss to call gen_itp from
-    the polyply library, capture the standard output
-    and return it.
+    The :class:`vermouth.forcefield.ForceField` itself, or the
+    library of that name from the cache of this process.
     """
+    global _FF_CACHE
+    if not isinstance(force_field, str):
+        return force_field
+    if _FF_CACHE is None:
+        from .ff_cache import ForceFieldCache
+        _FF_CACHE = ForceFieldCache()
+    return _FF_CACHE.get(force_field)
 
-    class input_polyply:
+def _seq_graph(graph):
+    """
+    Residue graph as polyply reads it from a seq file: residues
+    numbered from 0 in order, with resids counting from 1.
+    """
+    seq_graph = graph.to_networkx(compact=True)
+    for node, attributes in seq_graph.nodes(data=True):
+        attributes.setdefault("resid", node + 1)
+    return seq_graph
 
-        def __init__(self, **kwargs):
-            for key, value in kwargs.items():
-                setattr(self, key, value)
+@contextlib.contextmanager
+def _pristine_blocks(force_field):
+    """
+    Undo the tagging of the force-field blocks by polyply's mapping
+    after a run, so that a cached force field serves the next
+    molecule as if freshly loaded.
+    """
+    saved = {resname: (block.nrexcl, {atom: block.nodes[atom]["exclude"] for atom in block.nodes
+                                      if "exclude" in block.nodes[atom]})
+             for resname, block in force_field.blocks.items()}
+    try:
+        yield force_field
+    finally:
+        for resname, (nrexcl, excludes) in saved.items():
+            block = force_field.blocks[resname]
+            block.nrexcl = nrexcl
+            for atom in block.nodes:
+                block.nodes[atom].pop("exclude", None)
+                if atom in excludes:
+                    block.nodes[atom]["exclude"] = excludes[atom]
 
-    args = input_polyply(name="polyply-gui",
-                         inpath=None,
-                         verbosity=0,
-                         seq=None,
-                         seq_file=Path(graph_path),
-                         outpath=Path(outpath),
-                         lib=[force_field])
+def _fragment_cache():
+    global _FRAGMENTS
+    if _FRAGMENTS is None:
+        from .fragments import FragmentCache
+        _FRAGMENTS = FragmentCache()
+    return _FRAGMENTS
 
-    with contextlib.redirect_stderr(io.StringIO()) as output:
-        gen_itp(args)
+def _missing_edges(meta_molecule, molecule):
+    """
+    Residue edges without a bond between the atoms of the residues,
+    as found by polyply after gen_itp.
+    """
+    resid_edges = set()
+    for atomA, atomB in molecule.edges:
+        resids = (molecule.nodes[atomA]["resid"], molecule.nodes[atomB]["resid"])
+        resid_edges.add(frozenset(resids))
+    for nodeA, nodeB in meta_molecule.edges:
+        resA = meta_molecule.nodes[nodeA]
+        resB = meta_molecule.nodes[nodeB]
+        if frozenset((resA["resid"], resB["resid"])) not in resid_edges:
+            yield {"idxA": resA["resid"], "resA": resA["resname"],
+                   "idxB": resB["resid"], "resB": resB["resname"]}
+
+def _link_molecule(graph, force_field, force_field_key, name, fragments):
+    """
+    The mapped and linked meta molecule of `graph`, stitched from
+    cached fragments if possible.
+    """
+    from polyply import MetaMolecule, ApplyLinks, MapToMolecule
+    if fragments and isinstance(graph, MoleculeGraph) and len(graph):
+        from .fragments import supports_fragments, is_connected, link_blocks
+        if supports_fragments(force_field) and is_connected(graph):
+            persistent = force_field_key is not None
+            if not persistent:
+                force_field_key = "{}-{}".format(force_field.name, id(force_field))
+            return link_blocks(graph, force_field, name, _fragment_cache(),
+                               force_field_key, persistent=persistent)
+
+    meta_molecule = MetaMolecule(_seq_graph(graph), force_field=force_field, mol_name=name)
+    meta_molecule = MapToMolecule(force_field).run_molecule(meta_molecule)
+    return ApplyLinks().run_molecule(meta_molecule)
+
+def _write_itp(graph, outpath, force_field, name, force_field_key=None, fragments=True):
+    """
+    The steps of polyply's gen_itp following the reading of the
+    input, on a residue graph and a loaded force field.
+    """
+    import vermouth
+    from vermouth.citation_parser import citation_formatter
+    from polyply.src.apply_modifications import ApplyModifications
+    from polyply.src.gen_itp import LOGGER
+
+    with _pristine_blocks(force_field):
+        meta_molecule = _link_molecule(graph, force_field, force_field_key, name, fragments)
+        meta_molecule = ApplyModifications(modifications=[],
+                                           meta_molecule=meta_molecule).run_molecule(meta_molecule)
 
+    msg = "Missing a link between residue {idxA} {resA} and residue {idxB} {resB}."
+    for missing in _missing_edges(meta_molecule, meta_molecule.molecule):
+        LOGGER.warning(msg, **missing)
+
+    header = [' '.join(sys.argv) + "\n", "Please cite the following papers:"]
+    citation_map = dict(meta_molecule.molecule.force_field.citations)
+    citation_map.update(vermouth.data.COMMON_CITATIONS)
+    for citation in meta_molecule.molecule.citations:
+        header.append(citation_formatter(citation_map[citation]))
+    with open(outpath, "w") as file_handle:
+        vermouth.gmx.itp.write_molecule_itp(meta_molecule.molecule, file_handle,
+                                            moltype=name, header=header)
+
+    for loglevel, entries in meta_molecule.molecule.log_entries.items():
+        for entry, fmt_args in entries.items():
+            for fmt_arg in fmt_args:
+                fmt_arg = {str(k): meta_molecule.molecule.nodes[v] for k, v in fmt_arg.items()}
+                LOGGER.log(loglevel, entry, **fmt_arg, type='model')
+
+def gen_itp_from_graph(graph, outpath, force_field, name="polyply-gui", stream=None,
+                       fragments=True):
+    """
+    Write the itp of a residue graph without going through a seq
+    file. The force field is either a loaded
+    :class:`vermouth.forcefield.ForceField`, which is reused as is,
+    or the name of a library, which is loaded once per process.
+    The output of polyply is captured and returned as list of
+    lines, or written to `stream` as it is produced.
+
+    Unless `fragments` is False, the blocks of the graph are linked
+    from a cache of fragments, so regenerating the itp after an
+    edit only parameterizes the blocks it touched; see
+    :mod:`polyply_gui.fragments`. Fragments of libraries are cached
+    on disk and shared between processes.
+
+    Parameters
+    ----------
+    graph: :class:`polyply_gui.molecule_graph.MoleculeGraph`
+    outpath: str or :class:`pathlib.Path`
+    force_field: str or :class:`vermouth.forcefield.ForceField`
+    name: str
+        name of the molecule type
+    stream: file like
+    fragments: bool
+    """
+    force_field_key = None
+    if isinstance(force_field, str):
+        from .ff_cache import library_key
+        force_field_key = "{}-{}".format(force_field, library_key(force_field))
+    force_field = _force_field(force_field)
+    if stream is not None:
+        with contextlib.redirect_stderr(stream):
+            _write_itp(graph, outpath, force_field, name, force_field_key, fragments)
+        return []
+
+    with contextlib.redirect_stderr(io.StringIO()) as output:
+        _write_itp(graph, outpath, force_field, name, force_field_key, fragments)
     return output.getvalue().split('\n')
+
+def read_seq_file(path):
+    """
+    Read a seq file, plain or gzipped, into a
+    :class:`polyply_gui.molecule_graph.MoleculeGraph`.
+    """
+    graph = MoleculeGraph()
+    resnames, edges, attributes = read_seq_block(path, attributes=list(graph.columns))
+    graph.add_block(resnames, edges, name=Path(path).name.split(".")[0], attributes=attributes)
+    return graph
+
+def run_gen_itp(graph_path, outpath, force_field, stream=None):
+    """
+    Generate the itp of the seq file at `graph_path`; see
+    :func:`gen_itp_from_graph`.
+    """
+    return gen_itp_from_graph(read_seq_file(graph_path), outpath, force_field, stream=stream)
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import defaultdict, deque
+import numpy as np
+
+# upper edges of the latency histogram bins in ms
+HISTOGRAM_BINS = (1, 4, 16, 64, 256, np.inf)
+
+class Profiler():
+    """
+    Records the duration of named spans, e.g. event handlers or
+    the layout and drawing phases of an update.
+
+    The latest `window` durations of every name are kept for rolling
+    statistics and histograms. All spans, up to `max_events`, are
+    kept as complete events of the Chrome trace format, which can be
+    opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self, window=200, max_events=100000):
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.n_spans = 0
+
+    def record(self, name, start, duration, category="", **args):
+        """
+        Record a span that started at `start` (perf_counter) and
+        took `duration` seconds.
+        """
+        self.latencies[name].append(duration)
+        self.n_spans += 1
+        self.events.append({"name": name,
+                            "cat": category,
+                            "ph": "X",
+                            "ts": (start - self.origin) * 1e6,
+                            "dur": duration * 1e6,
+                            "pid": self.pid,
+                            "tid": threading.get_ident(),
+                            "args": args})
+
+    @contextlib.contextmanager
+    def span(self, name, category="", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, category, **args)
+
+    def histogram(self, name):
+        """
+        Counts of the recent durations of `name` per bin
+        of :data:`HISTOGRAM_BINS`.
+        """
+        durations = np.fromiter(self.latencies[name], dtype=float) * 1000
+        return np.bincount(np.searchsorted(HISTOGRAM_BINS, durations),
+                           minlength=len(HISTOGRAM_BINS))
+
+    def summary(self):
+        """
+        One line per span name with the median, 95th percentile and
+        maximum of the recent durations and their histogram.
+        """
+        labels = ["<{}ms".format(edge) for edge in HISTOGRAM_BINS[:-1]]
+        labels.append(">{}ms".format(HISTOGRAM_BINS[-2]))
+        lines = []
+        for name, durations in sorted(self.latencies.items()):
+            if not durations:
+                continue
+            durations_ms = np.fromiter(durations, dtype=float) * 1000
+            p50, p95 = np.percentile(durations_ms, [50, 95])
+            histogram = " ".join("{}:{}".format(label, count) for label, count
+                                 in zip(labels, self.histogram(name)) if count)
+            lines.append("{} n={} p50={:.1f}ms p95={:.1f}ms max={:.1f}ms [{}]".format(
+                         name, len(durations), p50, p95, durations_ms.max(), histogram))
+        return lines
+
+    def write_trace(self, path):
+        """
+        Write the recorded spans as Chrome trace json.
+        """
+        with open(path, "w") as file_handle:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, file_handle)
+
+# the profiler spans are recorded to; profiling is off while it is None
+_PROFILER = None
+
+def enable(profiler=None):
+    """
+    Start recording spans to `profiler`, or a new one.
+
+    Returns
+    -------
+    :class:`Profiler`
+    """
+    global _PROFILER
+    _PROFILER = profiler if profiler is not None else Profiler()
+    return _PROFILER
+
+def disable():
+    global _PROFILER
+    _PROFILER = None
+
+def get_profiler():
+    return _PROFILER
+
+def span(name, category="", **args):
+    """
+    Context manager timing a span with the enabled profiler,
+    which does nothing while profiling is off.
+    """
+    if _PROFILER is None:
+        return contextlib.nullcontext()
+    return _PROFILER.span(name, category, **args)
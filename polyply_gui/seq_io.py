@@ -0,0 +1,179 @@
+import gzip
+import json
+import networkx as nx
+from networkx.readwrite import json_graph
+import numpy as np
+from .molecule_graph import split_resnames
+
+# name of the edge list in node-link data; networkx renamed it from
+# "links" to "edges", so we write what the installed version reads
+EDGES_KEY = "edges" if "edges" in json_graph.node_link_data(nx.Graph()) else "links"
+_HEADER = '{"directed":false,"multigraph":false,"graph":{},"nodes":[\n'
+_SEPARATOR = '],"%s":[\n'
+
+def _open(path, mode):
+    """
+    Open `path` as text file, gzip compressed if it ends in .gz.
+    """
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def _write_records(file_handle, records):
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    first = True
+    for record in records:
+        file_handle.write(("" if first else ",\n") + dumps(record))
+        first = False
+    file_handle.write("\n")
+
+def write_records(path, nodes, edges):
+    """
+    Stream node and edge records to a compact node-link file, with
+    one record per line. `nodes` yields dicts with an "id" and the
+    node attributes and `edges` yields (source, target) pairs.
+    """
+    with _open(path, "w") as file_handle:
+        file_handle.write(_HEADER)
+        _write_records(file_handle, nodes)
+        file_handle.write(_SEPARATOR % EDGES_KEY)
+        _write_records(file_handle, ({"source": ndxA, "target": ndxB} for ndxA, ndxB in edges))
+        file_handle.write("]}\n")
+
+def _graph_nodes(graph, chunk_size):
+    nodes = graph.node_array()
+    for start in range(0, len(nodes), chunk_size):
+        chunk = nodes[start:start+chunk_size]
+        columns = {attribute: column.decode(chunk) for attribute, column in graph.columns.items()}
+        for idx in range(len(chunk)):
+            record = {attribute: values[idx] for attribute, values in columns.items()
+                      if values[idx] is not None}
+            record["id"] = start + idx
+            yield record
+
+def _graph_edges(graph, chunk_size):
+    nodes = graph.node_array()
+    relabel = np.full(nodes[-1] + 1 if len(nodes) else 0, -1, dtype=np.int64)
+    relabel[nodes] = np.arange(len(nodes))
+    edges = graph.edge_array()
+    for start in range(0, len(edges), chunk_size):
+        yield from map(tuple, relabel[edges[start:start+chunk_size]].tolist())
+
+def write_seq_graph(graph, path, compact=False, chunk_size=65536):
+    """
+    Write a :class:`polyply_gui.molecule_graph.MoleculeGraph` as
+    node-link json with residues relabelled from 0, which can be
+    read by gen_itp. By default the file is written like polyply
+    writes it. With `compact` the records are streamed from the
+    graph arrays in chunks of `chunk_size` without indentation,
+    so no intermediate copy of the graph is made. Paths ending
+    in .gz are gzip compressed.
+    """
+    if compact:
+        write_records(path, _graph_nodes(graph, chunk_size), _graph_edges(graph, chunk_size))
+        return
+    g_json = json_graph.node_link_data(graph.to_networkx())
+    with _open(path, "w") as file_handle:
+        json.dump(g_json, file_handle, indent=2)
+
+def iter_records(path):
+    """
+    Iterate the records of a node-link file.
+
+    Compact files are streamed line by line; any other node-link
+    json, such as written by gen_seq, is loaded at once. Edge lists
+    named "links" and "edges" are both understood.
+
+    Yields
+    ------
+    str
+        "node" or "edge"
+    dict
+        the record
+    """
+    with _open(path, "r") as file_handle:
+        if file_handle.readline() != _HEADER:
+            file_handle.seek(0)
+            data = json.load(file_handle)
+            for record in data["nodes"]:
+                yield "node", record
+            for record in data.get("links", data.get("edges", [])):
+                yield "edge", record
+            return
+
+        kind = "node"
+        for line in file_handle:
+            line = line.rstrip(",\n")
+            if line.startswith("]"):
+                kind = "edge"
+            elif line:
+                yield kind, json.loads(line)
+
+def read_seq_graph(path, attributes=("resname", "tacticity")):
+    """
+    Read a node-link file into flat arrays.
+
+    Returns
+    -------
+    dict[str, list]
+        per node, in order of their ids, the value of every attribute
+        in `attributes` or None
+    np.ndarray
+        (E, 2) edges as indices into the node order
+    """
+    ids = []
+    values = {attribute: [] for attribute in attributes}
+    edges = []
+    for kind, record in iter_records(path):
+        if kind == "node":
+            ids.append(record["id"])
+            for attribute in attributes:
+                values[attribute].append(record.get(attribute))
+        else:
+            edges.append((record["source"], record["target"]))
+
+    # like polyply, nodes are ordered by their ids
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    index = {ids[idx]: pos for pos, idx in enumerate(order)}
+    values = {attribute: [column[idx] for idx in order] for attribute, column in values.items()}
+    edges = np.array([(index[ndxA], index[ndxB]) for ndxA, ndxB in edges],
+                     dtype=np.int64).reshape(-1, 2)
+    return values, edges
+
+def read_seq_block(path, attributes=("resname", "tacticity")):
+    """
+    The residues of a seq file as :meth:`MoleculeGraph.add_block`
+    takes them: the resnames, the edges and the columns of the other
+    `attributes` that are set for any residue.
+    """
+    values, edges = read_seq_graph(path, attributes=attributes)
+    resnames, columns = split_resnames(values)
+    return resnames, edges, columns
+
+def convert_seq_file(inpath, outpath, compact=False):
+    """
+    Convert between node-link files, e.g. a gzipped compact file to
+    the plain json polyply gen_itp reads.
+    """
+    records = iter_records(inpath)
+    if not compact:
+        graph = nx.Graph()
+        for kind, record in records:
+            if kind == "node":
+                attributes = {key: value for key, value in record.items() if key != "id"}
+                graph.add_node(record["id"], **attributes)
+            else:
+                graph.add_edge(record["source"], record["target"])
+        with _open(outpath, "w") as file_handle:
+            json.dump(json_graph.node_link_data(graph), file_handle, indent=2)
+        return
+
+    edges = []
+    def _nodes():
+        for kind, record in records:
+            if kind == "node":
+                yield record
+            else:
+                edges.append((record["source"], record["target"]))
+    # edges follow the nodes, so they are collected while the nodes are written
+    write_records(outpath, _nodes(), edges)
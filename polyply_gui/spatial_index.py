@@ -0,0 +1,85 @@
+import numpy as np
+
+class GridIndex():
+    """
+    Uniform grid over a set of 2D points. Points are sorted by the
+    cell they fall in, such that the points of a row of cells are
+    a contiguous slice. Box queries therefore cost one slice per row
+    of cells plus the number of points returned.
+
+    Parameters
+    ----------
+    keys: list
+        the keys (e.g. node names) of the points
+    points: np.ndarray
+        (N, 2) array of coordinates
+    cell_size: float
+        edge length of a cell; defaults to roughly one point per cell
+    """
+
+    def __init__(self, keys, points, cell_size=None):
+        self.keys = list(keys)
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points):
+            self.lower = self.points.min(axis=0)
+            self.upper = self.points.max(axis=0)
+        else:
+            self.lower = self.upper = np.zeros(2)
+        extent = max((self.upper - self.lower).max(), 1e-12)
+        if cell_size is None:
+            cell_size = extent / max(np.sqrt(len(self.points)), 1)
+        self.cell_size = max(cell_size, extent * 1e-6)
+        self.shape = (np.floor((self.upper - self.lower) / self.cell_size).astype(int) + 1)
+
+        cell_ids = self._cell_ids(self._cells(self.points))
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_starts = np.searchsorted(cell_ids[self.order],
+                                           np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cells(self, points):
+        cells = np.floor((np.asarray(points) - self.lower) / self.cell_size).astype(int)
+        return np.clip(cells, 0, self.shape - 1)
+
+    def _cell_ids(self, cells):
+        return cells[..., 0] * self.shape[1] + cells[..., 1]
+
+    def query_box(self, lower, upper):
+        """
+        Indices of all points with `lower` <= point <= `upper`.
+        """
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        if not len(self.points) or np.any(upper < self.lower) or np.any(lower > self.upper):
+            return np.zeros(0, dtype=int)
+        (xmin, ymin), (xmax, ymax) = self._cells([lower, upper])
+        slices = [self.order[self.cell_starts[row * self.shape[1] + ymin]:
+                             self.cell_starts[row * self.shape[1] + ymax + 1]]
+                  for row in range(xmin, xmax + 1)]
+        candidates = np.concatenate(slices)
+        points = self.points[candidates]
+        inside = np.all((points >= lower) & (points <= upper), axis=1)
+        return candidates[inside]
+
+    def covers(self, lower, upper):
+        """
+        True if the box from `lower` to `upper` contains all points.
+        """
+        return np.all(np.asarray(lower) <= self.lower) and np.all(np.asarray(upper) >= self.upper)
+
+    def nearest(self, point, max_dist):
+        """
+        Index of the point closest to `point` within `max_dist`
+        or None if there is no such point.
+        """
+        point = np.asarray(point, dtype=float)
+        candidates = self.query_box(point - max_dist, point + max_dist)
+        if not len(candidates):
+            return None
+        dist2 = ((self.points[candidates] - point)**2).sum(axis=1)
+        best = np.argmin(dist2)
+        if dist2[best] > max_dist**2:
+            return None
+        return candidates[best]
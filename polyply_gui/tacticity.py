@@ -0,0 +1,57 @@
+import numpy as np
+
+_STATES = np.array(["R", "S"], dtype=object)
+
+def _atactic(n_res, rng, probability):
+    return rng.random(n_res) >= 0.5
+
+def _isotactic_r(n_res, rng, probability):
+    return np.zeros(n_res, dtype=bool)
+
+def _isotactic_s(n_res, rng, probability):
+    return np.ones(n_res, dtype=bool)
+
+def _syndiotactic(n_res, rng, probability):
+    return np.arange(n_res) % 2 == 1
+
+def _bernoulli(n_res, rng, probability):
+    return rng.random(n_res) >= probability
+
+def _markov(n_res, rng, probability):
+    # the first residue is R or S with equal chance, then every
+    # residue flips the previous one with chance `probability`
+    flips = np.empty(n_res, dtype=bool)
+    flips[:1] = rng.random(min(n_res, 1)) >= 0.5
+    flips[1:] = rng.random(max(n_res - 1, 0)) < probability
+    return np.cumsum(flips) % 2 == 1
+
+# the statistics map the number of residues, a random generator and
+# a probability to an array that is False for R and True for S
+TACTICITIES = {"atactic": _atactic,
+               "isotactic-R": _isotactic_r,
+               "isotactic-S": _isotactic_s,
+               "syndiotactic": _syndiotactic,
+               "bernoulli": _bernoulli,
+               "markov": _markov,}
+
+def sample_tacticity(n_res, statistic, rng=None, probability=0.5):
+    """
+    Tacticity of `n_res` residues in residue order.
+
+    Parameters
+    ----------
+    n_res: int
+    statistic: str
+        one of :data:`TACTICITIES`; bernoulli picks R with chance
+        `probability`, markov flips the previous residue's tacticity
+        with chance `probability`
+    rng: :class:`numpy.random.Generator`
+    probability: float
+
+    Returns
+    -------
+    np.ndarray
+        "R" or "S" per residue
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    return _STATES[TACTICITIES[statistic](n_res, rng, probability).astype(int)]
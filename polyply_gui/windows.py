@@ -1,14 +1,7 @@
 import PySimpleGUI as sg
 import os.path
-import json
-import numpy as np
-import networkx as nx
-from networkx.readwrite import json_graph
-import polyply
-from polyply import DATA_PATH
-from polyply.src.load_library import load_library
-from polyply.src.gen_seq import _branched_graph
 from . import IMG_PATH
+from .tacticity import TACTICITIES
 
 class WindowCreator():
     """
@@ -67,8 +60,13 @@ class ChainArchitechtureWindow(WindowCreator):
                          size=(40, 4),
                          visible=in2_visible)],
                   [sg.Text("set tacticity", visible=tacticity)],
-                  [sg.Listbox(values=['atactic', 'isotactic-R', 'isotactic-S', 'syndiotactic'],
+                  [sg.Listbox(values=list(TACTICITIES),
                               enable_events=False, key='tacticity', visible=tacticity)],
+                  [sg.Text("probability (bernoulli: R, markov: flip)", visible=tacticity)],
+                  [sg.In(enable_events=False, key='-PROB-', size=(40, 4),
+                         visible=tacticity, default_text="0.5")],
+                  [sg.Text("random seed", visible=tacticity)],
+                  [sg.In(enable_events=False, key='-SEED-', size=(40, 4), visible=tacticity)],
                   [sg.Button('add', enable_events=True, key='add_block')]]
         layout = [[sg.Column(rows)]]
         super().__init__(layout=layout, **kwargs)
@@ -89,7 +87,10 @@ class GraphViewerWindow(WindowCreator):
                           key='graph_event',
                           drag_submits=True,
                           enable_events=True)],
-                [sg.Text("Zoom"), sg.Button('+', enable_events=True, key='zoom_in'), sg.Button('-', enable_events=True, key='zoom_out')]]
+                [sg.Text("Zoom"), sg.Button('+', enable_events=True, key='zoom_in'), sg.Button('-', enable_events=True, key='zoom_out'),
+                 sg.Text("Layout"), sg.Combo(["multilevel", "kamada_kawai", "incremental"], default_value="multilevel",
+                                             readonly=True, enable_events=True, key='set_layout'),
+                 sg.Button('relayout', enable_events=True, key='relayout')]]
 
         layout = [[sg.Column(rows)]]
         super().__init__(layout=layout, **kwargs)
@@ -126,6 +127,28 @@ class AddConnectionWindow(WindowCreator):
         layout = [[sg.Column(rows)]]
         super().__init__(layout=layout, **kwargs)
 
+class BatchLinkWindow(WindowCreator):
+    """
+    Window for adding many links at once, either following a rule
+    or from a list of pairs.
+    """
+
+    def __init__(self, **kwargs):
+        rows = [[sg.Text("Link residues of a block by rule")],
+                [sg.Text("block"), sg.In(key='-BLOCKA-', size=(5, 1)),
+                 sg.Text("every"), sg.In(key='-STEP-', size=(5, 1), default_text="1"),
+                 sg.Text("from resid"), sg.In(key='-START-', size=(5, 1), default_text="1")],
+                [sg.Text("only resname"), sg.In(key='-RESNAME-', size=(10, 1))],
+                [sg.Text("to blocks (e.g. 2-10)"), sg.In(key='-BLOCKSB-', size=(10, 1)),
+                 sg.Text("resid"), sg.In(key='-RESIDB-', size=(5, 1), default_text="1")],
+                [sg.Text("or pairs 'blockA residA blockB residB' per line")],
+                [sg.Multiline(key='-PAIRS-', size=(40, 6))],
+                [sg.In(key='-PAIRSFILE-', size=(30, 1)), sg.FileBrowse("load pairs")],
+                [sg.Button("link", enable_events=True, key='batch_link')]]
+
+        layout = [[sg.Column(rows)]]
+        super().__init__(layout=layout, **kwargs)
+
 class MainWindow(WindowCreator):
     """
     Polyply GUI main window.
@@ -150,12 +173,17 @@ class MainWindow(WindowCreator):
                                        mouseover_colors=("blue", "blue"))],
                             [sg.Text("{:<26s}".format("comb")), sg.Text("carbohydrate")],
                             [sg.Text("From File")],
+                            [sg.Text("molecule"), sg.In(size=(10, 1), key="-MOLNAME-")],
                             [sg.In(size=(25, 1), enable_events=True, key="load_file"),sg.FileBrowse()]]
 
         connect_column = [[sg.Text("Modify blocks", justification="center", size=(20, 1), font='bold')],
                           [sg.Text("Current blocks")],
                           [sg.Listbox(values=[], size=(20, 5), key="-SEQ-")],
                           [sg.Button('delete selected block', enable_events=True, key='remove_block')],
+                          [sg.Button('link selected residues', enable_events=True, key='link_selected')],
+                          [sg.Button('batch link', enable_events=True, key='open_batch_link_window')],
+                          [sg.Button('undo', enable_events=True, key='undo'),
+                           sg.Button('redo', enable_events=True, key='redo')],
                           [sg.Button(image_filename=IMG_PATH+"/staple.png", size=(10, 5), image_size=(150, 200),
                                       image_subsample=2, enable_events=True, key='open_connect_window', button_color=(None, "white"),
                                       mouseover_colors=("blue", "blue")),
@@ -170,10 +198,12 @@ class MainWindow(WindowCreator):
                           ]
 
         sequence_viewer_column = [[sg.Text("I/O", justification="center", size=(20, 1), font='bold')],
-                                  [sg.Text("First save the graph.", size=(20, 1))],
-                                  [sg.Text("Then run generate itp.", size=(20, 1))],
+                                  [sg.Checkbox("compact (.gz to compress)", key='-COMPACT-')],
                                   [sg.SaveAs(button_text="save graph", enable_events=True, key='write_seq_file')],
-                                  [sg.SaveAs(button_text="generate itp file", enable_events=True, key='gen_itp')]]
+                                  [sg.SaveAs(button_text="generate itp file", enable_events=True, key='gen_itp')],
+                                  [sg.Text("Running jobs", size=(20, 1))],
+                                  [sg.Listbox(values=[], size=(20, 3), key="-JOBS-")],
+                                  [sg.Button('cancel selected job', enable_events=True, key='cancel_job')]]
 
         layout = [[sg.Column(add_blocks_rows, vertical_alignment='top'),
                    sg.VSeperator(),
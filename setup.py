@@ -27,7 +27,7 @@ def package_files(directory):
 setup(
     #package_data={'': package_files('polyply/data')
     #              + package_files('polyply/tests/test_data'),},
-    scripts=['bin/polyply_gui'],
+    scripts=['bin/polyply_gui', 'bin/polyply_build'],
     pbr=False,
     version=get_version("polyply_gui/__init__.py")
 )
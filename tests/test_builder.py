@@ -0,0 +1,27 @@
+import polyply_gui.builder as builder_module
+from polyply_gui.builder import GraphBuilder
+
+def test_link_existing_bond_is_no_edit():
+    builder = GraphBuilder(seed=1)
+    builder.add_block("PEO", 3)
+    edges = sorted(builder.graph.edges())
+    assert not builder.link_nodes(*builder.link(1, 1, 1, 2))
+    assert sorted(builder.graph.edges()) == edges
+    # undo goes back to before adding the block, not to a lost bond
+    builder.undo()
+    assert not len(builder.graph.nodes)
+
+def test_removed_blocks_are_compacted(monkeypatch):
+    monkeypatch.setattr(builder_module, "_COMPACT_MIN_RESIDUES", 0)
+    builder = GraphBuilder(seed=1, max_history_bytes=4096)
+    builder.add_block("PEO", 3)
+    builder.add_block("PS", 2)
+    builder.link(1, 3, 2, 1)
+    for _ in range(50):
+        builder.add_block("PEO", 10)
+        builder.remove_block(3)
+    # 500 removed residues without compacting
+    assert builder.graph.n_removed <= 50
+    builder.undo()
+    assert builder.seq_list == ["1 PEO 3", "2 PS 2", "3 PEO 10"]
+    assert builder.graph.number_of_edges() == 2 + 1 + 1 + 9
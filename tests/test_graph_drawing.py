@@ -0,0 +1,16 @@
+import numpy as np
+from polyply_gui.builder import GraphBuilder
+from polyply_gui.graph_drawing import incremental_layout
+
+def test_link_to_single_residue_block():
+    # the anchor of the relinked block has no other placed neighbour
+    builder = GraphBuilder(seed=1)
+    builder.add_block("PEO", 1)
+    builder.add_block("PEO", 5)
+    coords = incremental_layout(builder.graph, seed=1)
+    nodeA, nodeB = builder.link(1, 1, 2, 1)
+    moving = list(builder.graph.block_nodes(builder.graph.block_ids[1]))
+    coords = {node: coord for node, coord in coords.items() if node not in moving}
+    coords = incremental_layout(builder.graph, coordinates=coords, nodes=moving, seed=1)
+    assert set(coords) == set(builder.graph.nodes)
+    assert np.isfinite(np.array(list(coords.values()))).all()
@@ -0,0 +1,10 @@
+from polyply_gui.journal import SessionJournal
+
+def test_session_directory_is_locked(tmp_path):
+    first = SessionJournal(tmp_path)
+    second = SessionJournal(tmp_path)
+    assert first.lock()
+    assert not second.lock()
+    first.close()
+    assert second.lock()
+    second.close()
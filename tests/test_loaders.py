@@ -0,0 +1,20 @@
+import pytest
+from polyply_gui.loaders import load_gro
+
+GRO = """PEO
+    3
+    1PEO     EO    1   0.000   0.000   0.000
+    2PEO     EO    2   0.300   0.000   0.000
+    3PEO     EO    3   0.600   0.000   0.000
+   1.00000   1.00000   1.00000
+"""
+
+def test_load_gro():
+    name, graph = load_gro(iter(GRO.splitlines()))
+    assert name is None
+    assert len(graph.nodes) == 3
+
+@pytest.mark.parametrize("n_lines", [1, 4])
+def test_load_truncated_gro(n_lines):
+    with pytest.raises(ValueError):
+        load_gro(iter(GRO.splitlines()[:n_lines]))
@@ -0,0 +1,69 @@
+from collections import Counter, defaultdict
+import pytest
+from polyply_gui import polyply_runner
+from polyply_gui.builder import GraphBuilder
+from polyply_gui.ff_cache import ForceFieldCache
+from polyply_gui.fragments import FragmentCache
+
+def _linear(builder):
+    builder.add_block("PEO", 5)
+    builder.add_block("PS", 4)
+    builder.add_block("PEO", 3)
+    builder.link_pairs([[1, 5, 2, 1], [2, 4, 3, 1]])
+
+def _branched(builder):
+    builder.add_block("PEO", 9)
+    for _ in range(3):
+        builder.add_block("PS", 2)
+    builder.link_pairs([[1, 2, 2, 1], [1, 5, 3, 1], [1, 8, 4, 1]])
+
+def _cross_linked(builder):
+    builder.add_block("PEO", 6)
+    builder.add_block("PEO", 6)
+    builder.link_pairs([[1, 2, 2, 2], [1, 5, 2, 5], [1, 6, 1, 1]])
+
+def _disconnected(builder):
+    builder.add_block("PEO", 4)
+    builder.add_block("PS", 3)
+
+def _lone_residue(builder):
+    builder.add_block("PS", 1)
+    builder.add_block("PEO", 4)
+
+def _sections(path):
+    """
+    The lines of every section of an itp, ignoring comments and the
+    order of the lines.
+    """
+    sections = defaultdict(Counter)
+    section = None
+    with open(path) as file_handle:
+        for line in file_handle:
+            line = line.split(';')[0].strip()
+            if line.startswith('['):
+                section = line
+            elif line:
+                sections[section][line] += 1
+    return sections
+
+def _gen_itp(graph, path, force_field, fragments):
+    try:
+        polyply_runner.gen_itp_from_graph(graph, path, force_field, fragments=fragments)
+    except Exception as error:
+        return type(error)
+    return _sections(path)
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(polyply_runner, "_FF_CACHE", ForceFieldCache(cache_dir=tmp_path / "ff"))
+    monkeypatch.setattr(polyply_runner, "_FRAGMENTS", FragmentCache(cache_dir=tmp_path / "fragments"))
+
+@pytest.mark.parametrize("force_field", ["2016H66", "martini3"])
+@pytest.mark.parametrize("build", [_linear, _branched, _cross_linked, _disconnected, _lone_residue])
+def test_fragments_match_full_itp(caches, tmp_path, force_field, build):
+    builder = GraphBuilder(force_field, seed=1)
+    build(builder)
+    full = _gen_itp(builder.graph, tmp_path / "full.itp", force_field, fragments=False)
+    # the second run links from the cached fragments
+    for _ in range(2):
+        assert _gen_itp(builder.graph, tmp_path / "fragments.itp", force_field, fragments=True) == full